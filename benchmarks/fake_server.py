@@ -0,0 +1,272 @@
+"""
+Local HTTP server for benchmarks. It serves the fixtures of the repository
+(testing_pages/ and resources/) and generated pages, and can delay responses,
+limit their bandwidth and fail a share of image requests, so scrapping can be
+measured offline under controlled network conditions.
+
+Generated pages:
+    /synthetic/images/<count>           page with <count> <img> tags
+    /synthetic/data_uri/<count>/<size>  page with <count> data uris of about
+                                        <size> bytes each
+    /synthetic/graph/<fanout>/<depth>/<node>
+                                        page of a website whose pages link to
+                                        <fanout> child pages, <depth> levels
+                                        deep (node is e.g. 0, 0-2, 0-2-1)
+    /img/<name>                         image (one of resources/tiny)
+"""
+
+import os
+import time
+import base64
+import random
+import hashlib
+import threading
+import mimetypes
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DIRS = ('testing_pages', 'resources')
+TINY_IMAGES_DIR = os.path.join(REPO_DIR, 'resources', 'tiny')
+# Images shown on each page of a generated website.
+GRAPH_PAGE_IMAGES = 5
+
+
+class NetworkConditions(object):
+    """
+    Conditions applied to every response of the server.
+    :param latency: seconds waited before responding.
+    :param bandwidth: bytes per second sent per response (None = no limit).
+    :param error_rate: share of image requests answered with 503.
+    :param seed: seed of random errors, for reproducible runs.
+    :param max_age: images are sent with an ETag and Cache-Control max-age of
+    given seconds, and revalidated with 304 (None = no caching headers).
+    """
+    def __init__(self, latency=0.0, bandwidth=None, error_rate=0.0, seed=0,
+                 max_age=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.max_age = max_age
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def to_dict(self):
+        return {
+            'latency': self.latency,
+            'bandwidth': self.bandwidth,
+            'error_rate': self.error_rate,
+            'max_age': self.max_age
+        }
+
+
+def load_tiny_images():
+    """
+    Returns the images served at /img/ as a list of (content type, bytes).
+    """
+    images = []
+    for name in sorted(os.listdir(TINY_IMAGES_DIR)):
+        with open(os.path.join(TINY_IMAGES_DIR, name), 'rb') as f:
+            images.append((mimetypes.guess_type(name)[0] or
+                           'application/octet-stream', f.read()))
+    return images
+
+
+def html_page(title, body):
+    return ('<!DOCTYPE html>\n<html>\n<head><meta charset="UTF-8">'
+            '<title>{title}</title></head>\n<body>\n{body}\n</body>\n'
+            '</html>\n').format(title=title, body=body).encode('utf-8')
+
+
+def images_page(count):
+    """
+    Page with given number of distinct images, as a mix of src, data-src,
+    srcset and hyperlinks to images.
+    """
+    tags = []
+    for i in range(count):
+        kind = i % 10
+        if kind < 7:
+            tags.append('<img src="/img/{i}.jpg" alt="image {i}">'.format(
+                i=i))
+        elif kind == 7:
+            tags.append('<img data-src="/img/{i}.jpg">'.format(i=i))
+        elif kind == 8:
+            tags.append('<img srcset="/img/{i}-small.jpg 1x, /img/{i}.jpg 2x"'
+                        '>'.format(i=i))
+        else:
+            tags.append('<a href="/img/{i}.gif">image {i}</a>'.format(i=i))
+    return html_page('{count} images'.format(count=count), '\n'.join(tags))
+
+
+def data_uri_page(count, size):
+    """
+    Page with given number of data uris of about given size (in bytes of
+    decoded data) each.
+    """
+    tags = []
+    for i in range(count):
+        # Distinct data of each image, so images are not deduplicated.
+        seed = hashlib.sha1(str(i).encode('ascii')).digest()
+        data = (seed * (size // len(seed) + 1))[:size]
+        tags.append('<img src="data:image/jpeg;base64,{data}">'.format(
+            data=base64.b64encode(data).decode('ascii')))
+    return html_page('{count} data uris'.format(count=count),
+                     '\n'.join(tags))
+
+
+def graph_page(fanout, depth, node):
+    """
+    Page of a generated website. Each page links to its child pages (up to
+    given depth), to the start page and to its own images.
+    """
+    path = node.split('-')
+    prefix = '/synthetic/graph/{fanout}/{depth}/'.format(fanout=fanout,
+                                                         depth=depth)
+    tags = ['<a href="{prefix}0">home</a>'.format(prefix=prefix)]
+    if len(path) <= depth:
+        tags.extend('<a href="{prefix}{node}-{i}">page {node}-{i}</a>'.format(
+            prefix=prefix, node=node, i=i) for i in range(fanout))
+    tags.extend('<img src="/img/{node}-{i}.png">'.format(node=node, i=i)
+                for i in range(GRAPH_PAGE_IMAGES))
+    return html_page('page ' + node, '\n'.join(tags))
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean.
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(send_body=False)
+
+    def do_GET(self, send_body=True):
+        conditions = self.server.conditions
+        if conditions.latency:
+            time.sleep(conditions.latency)
+        path = self.path.split('?', 1)[0]
+        self.server.count_request(path)
+        try:
+            status, content_type, body = self.route(path)
+        except (ValueError, IndexError):
+            status, content_type, body = 400, 'text/plain', b'Bad request'
+        headers = {}
+        if conditions.max_age is not None and status == 200 and \
+                content_type.startswith('image/'):
+            headers['ETag'] = '"{digest}"'.format(
+                digest=hashlib.md5(body).hexdigest())
+            headers['Cache-Control'] = 'max-age={age}'.format(
+                age=conditions.max_age)
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status, body = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if send_body:
+            self.send_body(body, conditions.bandwidth)
+
+    def route(self, path):
+        """
+        Returns (status, content type, body) for given path.
+        """
+        parts = [part for part in path.split('/') if part]
+        if parts[:1] == ['img']:
+            if self.server.conditions.should_fail():
+                return 503, 'text/plain', b'Injected error'
+            images = self.server.images
+            digest = hashlib.md5(parts[-1].encode('utf-8')).digest()
+            content_type, body = images[digest[0] % len(images)]
+            return 200, content_type, body
+        if parts[:2] == ['synthetic', 'images']:
+            return 200, 'text/html', images_page(int(parts[2]))
+        if parts[:2] == ['synthetic', 'data_uri']:
+            return 200, 'text/html', data_uri_page(int(parts[2]),
+                                                   int(parts[3]))
+        if parts[:2] == ['synthetic', 'graph']:
+            return 200, 'text/html', graph_page(int(parts[2]), int(parts[3]),
+                                                parts[4])
+        if parts[:1] and parts[0] in FIXTURE_DIRS and '..' not in parts:
+            filename = os.path.join(REPO_DIR, *parts)
+            if os.path.isfile(filename):
+                if parts[0] == 'resources' and \
+                        self.server.conditions.should_fail():
+                    return 503, 'text/plain', b'Injected error'
+                with open(filename, 'rb') as f:
+                    return 200, mimetypes.guess_type(filename)[0] or \
+                        'application/octet-stream', f.read()
+        return 404, 'text/plain', b'Not found'
+
+    def send_body(self, body, bandwidth):
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        # Send chunks of a tenth of a second worth of data.
+        chunk_size = max(1, int(bandwidth // 10))
+        for pos in range(0, len(body), chunk_size):
+            self.wfile.write(body[pos:pos + chunk_size])
+            self.wfile.flush()
+            time.sleep(chunk_size / float(bandwidth))
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    """
+    Fake web server running in a background thread. Use as a context manager
+    or call start() and stop().
+    """
+    daemon_threads = True
+
+    def __init__(self, conditions=None, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), FakeRequestHandler)
+        self.conditions = conditions or NetworkConditions()
+        self.images = load_tiny_images()
+        # Number of requests by path.
+        self.requests = {}
+        self._requests_lock = threading.Lock()
+        self._thread = None
+
+    def count_request(self, path):
+        with self._requests_lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    @property
+    def base_url(self):
+        return 'http://{host}:{port}'.format(host=self.server_address[0],
+                                             port=self.server_address[1])
+
+    def url(self, path):
+        return self.base_url + path
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,491 @@
+"""
+Benchmarks of the image scrapper, run offline against the local fake server
+(see fake_server.py). Measures extraction of image urls, downloading images,
+decoding data uris, zipping images and the restapi end to end, and reports
+throughput, p50/p99 latency and peak RSS of each benchmark. Results are saved
+as JSON and can be compared with the results of an earlier run.
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --sizes 10,1000,100000 --latency 0.02 \\
+        --bandwidth 1000000 --error-rate 0.05 --output results.json
+    python -m benchmarks.run --compare baseline.json --output results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+from benchmarks.fake_server import FakeServer, NetworkConditions, REPO_DIR
+
+try:
+    # Python 3
+    from urllib.parse import quote
+except ImportError:
+    # Python 2
+    from urllib import quote
+
+# Configuration of application under benchmark. Caches are disabled so every
+# iteration does the full work, and logging to files is disabled.
+BENCHMARK_CONFIG = {
+    'RESULT_CACHE_ENABLED': False,
+    'IMAGE_CACHE_ENABLED': False,
+    'REVALIDATION_ENABLED': False,
+    'ROBOTS_ENABLED': False,
+    'CRAWL_DELAY': 0,
+    'HTTP_RETRIES': 0,
+    'MAX_JOB_BYTES': None,
+    'LOG_FILES': {},
+    'LOG_CONSOLE_LEVEL': 'ERROR'
+}
+
+
+def percentile(values, pct):
+    """
+    Returns the given percentile (0-100) of values, using nearest rank.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def current_rss():
+    """
+    Returns the resident set size of this process in bytes, or its peak if
+    current size is not available (i.e. outside Linux).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS.
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssSampler(object):
+    """
+    Samples the resident set size of the process in a background thread,
+    while in a with block, and keeps the peak.
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
+
+
+class BenchmarkResult(object):
+    """
+    Measurements of a single benchmark.
+    :param name: name of benchmark e.g. extract:images-1000
+    :param latencies: seconds taken by each operation measured.
+    :param items: number of items (urls, images, files) processed in total.
+    :param seconds: wall time of benchmark.
+    :param peak_rss: peak resident set size (bytes) during benchmark.
+    :param extra: other values to report e.g. failures.
+    """
+    def __init__(self, name, latencies, items, seconds, peak_rss,
+                 extra=None):
+        self.name = name
+        self.latencies = latencies
+        self.items = items
+        self.seconds = seconds
+        self.peak_rss = peak_rss
+        self.extra = extra or {}
+
+    def to_dict(self):
+        result = OrderedDict([
+            ('name', self.name),
+            ('operations', len(self.latencies)),
+            ('items', self.items),
+            ('seconds', self.seconds),
+            ('throughput', self.items / self.seconds if self.seconds else
+             None),
+            ('p50', percentile(self.latencies, 50)),
+            ('p99', percentile(self.latencies, 99)),
+            ('mean', sum(self.latencies) / len(self.latencies)
+             if self.latencies else None),
+            ('max', max(self.latencies) if self.latencies else None),
+            ('peak_rss_bytes', self.peak_rss)
+        ])
+        result.update(self.extra)
+        return result
+
+
+def measure(name, func, repeat):
+    """
+    Runs func repeat times, measuring each run.
+    :param name: name of benchmark.
+    :param func: function returning the number of items it processed.
+    :param repeat: number of runs.
+    :return: BenchmarkResult object.
+    """
+    latencies = []
+    items = 0
+    with RssSampler() as rss:
+        start = time.time()
+        for _ in range(repeat):
+            run_start = time.time()
+            items += func()
+            latencies.append(time.time() - run_start)
+        seconds = time.time() - start
+    return BenchmarkResult(name, latencies, items, seconds, rss.peak)
+
+
+def fixture_pages():
+    pages = sorted(name for name in os.listdir(
+        os.path.join(REPO_DIR, 'testing_pages')) if name.endswith('.html'))
+    return [('fixture-' + os.path.splitext(name)[0],
+             '/testing_pages/' + name) for name in pages]
+
+
+def synthetic_pages(args):
+    pages = [('images-{count}'.format(count=count),
+              '/synthetic/images/{count}'.format(count=count))
+             for count in args.sizes]
+    pages.append(('data-uri-{count}x{size}'.format(
+        count=args.data_uris, size=args.data_uri_size),
+        '/synthetic/data_uri/{count}/{size}'.format(
+            count=args.data_uris, size=args.data_uri_size)))
+    return pages
+
+
+def bench_extract(app, server, args):
+    """
+    Extraction of image urls from fixture and generated pages.
+    """
+    from scrapper.procedures.scrapping_functions import \
+        get_image_urls_from_webpage
+    results = []
+    with app.app_context():
+        for label, path in fixture_pages() + synthetic_pages(args):
+            url = server.url(path)
+            results.append(measure(
+                'extract:' + label,
+                lambda: len(get_image_urls_from_webpage(url)), args.repeat))
+    return results
+
+
+def download_result(name, urls, dest_dir):
+    """
+    Downloads given urls once, reporting the latency of each image.
+    """
+    from scrapper.procedures.scrapping_functions import download_images
+    with RssSampler() as rss:
+        start = time.time()
+        stats = download_images(urls, dest_dir=dest_dir)
+        seconds = time.time() - start
+    size = sum(os.path.getsize(os.path.join(dest_dir, name))
+               for name in os.listdir(dest_dir))
+    return BenchmarkResult(
+        name, list(stats['timings'].values()), stats['success'], seconds,
+        rss.peak, extra={
+            'failed': stats['fail'],
+            'bytes': size,
+            'bytes_per_second': size / seconds if seconds else None
+        })
+
+
+def bench_download(app, server, args):
+    """
+    Downloading images of a generated page and decoding data uris, the
+    images downloaded are kept in args.work_dir for the zip benchmark.
+    """
+    from scrapper.procedures.scrapping_functions import \
+        get_image_urls_from_webpage
+    results = []
+    with app.app_context():
+        urls = get_image_urls_from_webpage(server.url(
+            '/synthetic/images/{count}'.format(count=args.download_count)))
+        dest_dir = os.path.join(args.work_dir, 'download')
+        os.makedirs(dest_dir)
+        results.append(download_result(
+            'download:images-{count}'.format(count=len(urls)), list(urls),
+            dest_dir))
+        uris = get_image_urls_from_webpage(server.url(
+            '/synthetic/data_uri/{count}/{size}'.format(
+                count=args.data_uris, size=args.data_uri_size)))
+        uri_dir = os.path.join(args.work_dir, 'data-uri')
+        os.makedirs(uri_dir)
+        results.append(download_result(
+            'decode:data-uri-{count}x{size}'.format(
+                count=args.data_uris, size=args.data_uri_size), list(uris),
+            uri_dir))
+    return results
+
+
+def bench_zip(app, server, args):
+    """
+    Zipping downloaded images, and downloading and zipping images of a page
+    as done for the web interface.
+    """
+    from scrapper.procedures.scrapping_functions import \
+        get_image_urls_from_webpage
+    from scrapper.web.web_helpers import zip_directory_to_file, \
+        send_files_to_user, get_netloc_from_url
+    results = []
+    with app.app_context():
+        src_dir = os.path.join(args.work_dir, 'download')
+        if not os.path.isdir(src_dir):
+            return results
+        count = len(os.listdir(src_dir))
+        zip_filename = os.path.join(args.work_dir, 'images.zip')
+
+        def zip_images():
+            zip_directory_to_file(zip_filename, path=src_dir)
+            return count
+        result = measure('zip:images-{count}'.format(count=count),
+                         zip_images, args.repeat)
+        result.extra['bytes'] = os.path.getsize(zip_filename)
+        results.append(result)
+
+        page_url = server.url('/synthetic/images/{count}'.format(
+            count=args.download_count))
+        urls = list(get_image_urls_from_webpage(page_url))
+
+        def send_files():
+            filename = send_files_to_user(
+                url_name=get_netloc_from_url(page_url), urls=urls)
+            if filename is not None:
+                os.remove(filename)
+            return len(urls)
+        results.append(measure(
+            'send_files:images-{count}'.format(count=len(urls)), send_files,
+            1))
+    return results
+
+
+def bench_api(app, server, args):
+    """
+    Restapi endpoints end to end, using the test client of application.
+    """
+    client = app.test_client()
+    results = []
+
+    def get(path, key=None):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError('{path} returned {status}'.format(
+                path=path, status=response.status_code))
+        data = response.get_data(as_text=True)
+        if key is None:
+            return data
+        return json.loads(data)[key]
+
+    for label, path in synthetic_pages(args):
+        query = quote(server.url(path), safe='')
+        results.append(measure(
+            'api:get_url_list:' + label,
+            lambda: len(get('/api/get_url_list?refresh=1&url=' + query,
+                            'url_list')), args.repeat))
+        results.append(measure(
+            'api:stream_url_list:' + label,
+            lambda: len(get('/api/stream_url_list?refresh=1&url=' +
+                            query).splitlines()) - 1, args.repeat))
+    start = server.url('/synthetic/graph/{fanout}/{depth}/0'.format(
+        fanout=args.graph_fanout, depth=args.graph_depth))
+    results.append(measure(
+        'api:crawl_url_list:graph-{fanout}x{depth}'.format(
+            fanout=args.graph_fanout, depth=args.graph_depth),
+        lambda: len(get('/api/crawl_url_list?depth={depth}&max_pages={pages}'
+                        '&url={url}'.format(depth=args.graph_depth,
+                                            pages=args.graph_pages,
+                                            url=quote(start, safe='')),
+                        'pages')), 1))
+    return results
+
+
+# Benchmarks which can be selected with --only, in order of running.
+BENCHMARKS = OrderedDict([
+    ('extract', bench_extract),
+    ('download', bench_download),
+    ('zip', bench_zip),
+    ('api', bench_api)
+])
+
+
+def compare(results, baseline, max_regression):
+    """
+    Prints the change of results from baseline.
+    :param results: results of this run, as dictionaries.
+    :param baseline: results of an earlier run, as saved in JSON.
+    :param max_regression: largest allowed relative increase of p50 latency
+    or decrease of throughput.
+    :return: names of benchmarks which regressed more than allowed.
+    """
+    previous = dict((result['name'], result)
+                    for result in baseline['results'])
+    regressed = []
+    print('{name:<45} {p50:>10} {p99:>10} {tput:>10}'.format(
+        name='benchmark', p50='p50', p99='p99', tput='throughput'))
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None:
+            continue
+        ratios = {}
+        for key in ('p50', 'p99', 'throughput'):
+            if result.get(key) and old.get(key):
+                ratios[key] = result[key] / old[key]
+        print('{name:<45} {p50:>10} {p99:>10} {tput:>10}'.format(
+            name=result['name'],
+            **dict((short, '{:.2f}x'.format(ratios[key])
+                    if key in ratios else '-')
+                   for short, key in (('p50', 'p50'), ('p99', 'p99'),
+                                      ('tput', 'throughput')))))
+        if ratios.get('p50', 1) > 1 + max_regression or \
+                ratios.get('throughput', 1) < 1 - max_regression:
+            regressed.append(result['name'])
+    return regressed
+
+
+def summary(result):
+    """
+    Returns a line summarizing the result of a benchmark.
+    """
+    def number(value, unit, scale=1.0):
+        if value is None:
+            return '-'
+        return '{value:.4g}{unit}'.format(value=value / scale, unit=unit)
+    return '{name:<45} p50={p50} p99={p99} throughput={throughput} ' \
+        'rss={rss}'.format(name=result['name'],
+                           p50=number(result['p50'], 's'),
+                           p99=number(result['p99'], 's'),
+                           throughput=number(result['throughput'], '/s'),
+                           rss=number(result['peak_rss_bytes'], 'MB',
+                                      1024.0 * 1024.0))
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the image scrapper against a local fake web '
+                    'server.')
+    parser.add_argument('--only', type=lambda v: v.split(','),
+                        default=list(BENCHMARKS),
+                        help='comma separated benchmarks to run, of: ' +
+                             ', '.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs of each measured operation')
+    parser.add_argument('--sizes', type=int_list, default=[10, 1000, 10000],
+                        help='images on generated pages (up to 100000)')
+    parser.add_argument('--download-count', type=int, default=1000,
+                        help='images downloaded and zipped')
+    parser.add_argument('--data-uris', type=int, default=20,
+                        help='data uris on generated page')
+    parser.add_argument('--data-uri-size', type=int, default=256 * 1024,
+                        help='bytes of each data uri')
+    parser.add_argument('--graph-fanout', type=int, default=4,
+                        help='links to child pages on each page of website')
+    parser.add_argument('--graph-depth', type=int, default=3,
+                        help='levels of pages of website')
+    parser.add_argument('--graph-pages', type=int, default=100,
+                        help='pages crawled from website')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--bandwidth', type=int, default=None,
+                        help='bytes per second of every response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of image requests failing with 503')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of injected errors')
+    parser.add_argument('--metrics', action='store_true',
+                        help='run with METRICS_ENABLED')
+    parser.add_argument('--output', help='file where results are saved')
+    parser.add_argument('--compare', help='results of an earlier run')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='allowed relative regression with --compare')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    unknown = set(args.only) - set(BENCHMARKS)
+    if unknown:
+        sys.exit('Unknown benchmarks: ' + ', '.join(sorted(unknown)))
+    from scrapper import create_app
+
+    conditions = NetworkConditions(latency=args.latency,
+                                   bandwidth=args.bandwidth,
+                                   error_rate=args.error_rate, seed=args.seed)
+    args.work_dir = tempfile.mkdtemp(prefix='scrapper-benchmark-')
+    config = dict(BENCHMARK_CONFIG,
+                  FILES_DIR=os.path.join(args.work_dir, 'files') + os.sep,
+                  METRICS_ENABLED=args.metrics)
+    app = create_app('testing', **config)
+    results = []
+    try:
+        with FakeServer(conditions) as server:
+            for name, benchmark in BENCHMARKS.items():
+                if name not in args.only:
+                    continue
+                for result in benchmark(app, server, args):
+                    result = result.to_dict()
+                    results.append(result)
+                    print(summary(result))
+    finally:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    report = OrderedDict([
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('network', conditions.to_dict()),
+        ('options', dict((key, value) for key, value in vars(args).items()
+                         if key not in ('work_dir', 'output', 'compare'))),
+        ('results', results)
+    ])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(results, json.load(f), args.max_regression)
+        if regressed:
+            sys.exit('Regressed: ' + ', '.join(regressed))
+
+
+if __name__ == '__main__':
+    main()
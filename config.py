@@ -24,8 +24,159 @@ class Config:
     URL_REGEX = r"_^(?:(?:https?|ftp)://)(?:\S+(?::\S*)?@)?(?:(?!10(?:\.\d{1,3}){3})(?!127(?:\.\d{1,3}){3})(?!169\.254(?:\.\d{1,3}){2})(?!192\.168(?:\.\d{1,3}){2})(?!172\.(?:1[6-9]|2\d|3[0-1])(?:\.\d{1,3}){2})(?:[1-9]\d?|1\d\d|2[01]\d|22[0-3])(?:\.(?:1?\d{1,2}|2[0-4]\d|25[0-5])){2}(?:\.(?:[1-9]\d?|1\d\d|2[0-4]\d|25[0-4]))|(?:(?:[a-z\x{00a1}-\x{ffff}0-9]+-?)*[a-z\x{00a1}-\x{ffff}0-9]+)(?:\.(?:[a-z\x{00a1}-\x{ffff}0-9]+-?)*[a-z\x{00a1}-\x{ffff}0-9]+)*(?:\.(?:[a-z\x{00a1}-\x{ffff}]{2,})))(?::\d{2,5})?(?:/[^\s]*)?$_iuS"
 
     SSL_DISABLE = False
-    # Number of links shown per page
+    # Number of links shown per page, and per page of /api/get_url_list
     LINKS_PER_PAGE = 30
+    # Maximum number of images downloaded concurrently for a single request.
+    DOWNLOAD_WORKERS = 8
+    # Maximum number of concurrent downloads from the same host.
+    DOWNLOAD_PER_HOST_LIMIT = 4
+    # Timeouts (in seconds) for establishing connection and reading response.
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_READ_TIMEOUT = 30
+    # Retries for failed requests, waiting backoff * 2^(retry - 1) seconds.
+    HTTP_RETRIES = 3
+    HTTP_RETRY_BACKOFF = 0.5
+    # Number of hosts with pooled connections and pool size for each host.
+    HTTP_POOL_HOSTS = 20
+    HTTP_POOL_PER_HOST = DOWNLOAD_PER_HOST_LIMIT
+    # User agent sent with requests and matched against robots.txt rules.
+    USER_AGENT = 'image-scrapper'
+    # Downloads are streamed to disk in chunks of this size (in bytes).
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+    # Maximum size (in bytes) of a single image and of all images downloaded
+    # for one request. None disables the limit.
+    MAX_IMAGE_BYTES = 50 * 1024 * 1024
+    MAX_JOB_BYTES = 1024 * 1024 * 1024
+    # Send zip archive of images to user while the images are downloaded,
+    # instead of building the whole archive on disk first.
+    STREAM_ARCHIVES = True
+    # Backend running background jobs ('thread' or 'inline'), number of jobs
+    # running at the same time and number of jobs kept for polling. Results
+    # of jobs (e.g. zip files) are removed JOB_FILES_TTL seconds after the
+    # job finished.
+    JOB_BACKEND = 'thread'
+    JOB_WORKERS = 4
+    JOB_HISTORY = 1000
+    JOB_FILES_TTL = 3600
+    # Download images requested from web interface in a background job.
+    ASYNC_DOWNLOADS = False
+    # Downloaded images are kept in a content-addressed cache (inside the
+    # FILES_DIR) and reused by later scrapes. Least recently used images are
+    # removed when cache grows beyond IMAGE_CACHE_MAX_BYTES. Urls of cached
+    # images are saved at most every IMAGE_CACHE_SAVE_INTERVAL seconds (and
+    # at exit), so images are reused after a restart. Images are reused only
+    # while fresh, so the cache is used only with REVALIDATION_ENABLED.
+    IMAGE_CACHE_ENABLED = True
+    IMAGE_CACHE_DIR = 'cache/images/'
+    IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    IMAGE_CACHE_SAVE_INTERVAL = 60
+    # Record ETag/Last-Modified/Cache-Control of fetched pages and images, so
+    # they are not requested again while fresh and are revalidated once stale.
+    # Bodies of pages are kept in memory, up to REVALIDATION_MAX_BYTES in
+    # total.
+    REVALIDATION_ENABLED = True
+    REVALIDATION_MAX_ENTRIES = 10000
+    REVALIDATION_MAX_BYTES = 64 * 1024 * 1024
+    # Image urls extracted from a webpage are cached for RESULT_CACHE_TTL
+    # seconds, in memory or on disk ('memory' or 'disk' backend).
+    RESULT_CACHE_ENABLED = True
+    RESULT_CACHE_BACKEND = 'memory'
+    RESULT_CACHE_TTL = 300
+    RESULT_CACHE_MAX_ENTRIES = 1000
+    RESULT_CACHE_DIR = 'cache/results/'
+    # Webpages scrapped concurrently for a batch request, in total and from
+    # the same host, and maximum number of webpages in a batch.
+    BATCH_WORKERS = 8
+    BATCH_PER_HOST_LIMIT = 2
+    BATCH_MAX_URLS = 1000
+    # Crawling follows same-origin hyperlinks up to CRAWL_MAX_DEPTH links from
+    # the start page and scraps at most CRAWL_MAX_PAGES pages, CRAWL_WORKERS
+    # at a time, waiting CRAWL_DELAY seconds between requests to a host.
+    CRAWL_MAX_DEPTH = 2
+    CRAWL_MAX_PAGES = 100
+    CRAWL_WORKERS = 4
+    CRAWL_DELAY = 1.0
+    # Deduplicate crawl frontier with a Bloom filter sized for
+    # CRAWL_BLOOM_CAPACITY urls instead of a set (for large websites).
+    CRAWL_BLOOM_FILTER = False
+    CRAWL_BLOOM_CAPACITY = 1000000
+    # Honor robots.txt (and its Crawl-delay) when crawling and in batches. The
+    # parsed robots.txt of a host is kept for ROBOTS_CACHE_TTL seconds.
+    ROBOTS_ENABLED = True
+    ROBOTS_CACHE_TTL = 3600
+    # Maximum number of sitemaps read and of urls collected from them.
+    SITEMAP_MAX_FILES = 50
+    SITEMAP_MAX_URLS = 100000
+    # Extractors used for finding images on a web page, see
+    # scrapper/procedures/extraction.py for the available extractors. Add
+    # 'stylesheet' to find images in linked stylesheets as well, which fetches
+    # up to MAX_STYLESHEETS more documents per web page.
+    IMAGE_EXTRACTORS = ['img', 'hyperlink', 'srcset', 'style', 'preload',
+                        'meta']
+    # Device pixel ratio for choosing among srcset candidates, None downloads
+    # the largest variant of each image.
+    SRCSET_TARGET_DPR = None
+    # Maximum number of linked stylesheets fetched per web page.
+    MAX_STYLESHEETS = 10
+    # Remove query string from image urls (e.g. resizing parameters), so the
+    # same image linked with different parameters is downloaded once.
+    STRIP_IMAGE_QUERY = True
+    # Probe hyperlinks without a file extension with HEAD requests, and take
+    # those whose content type is an image. At most PROBE_MAX_LINKS links of a
+    # page are probed, PROBE_WORKERS at a time.
+    PROBE_LINK_CONTENT_TYPE = False
+    PROBE_MAX_LINKS = 200
+    PROBE_WORKERS = 8
+    PROBE_PER_HOST_LIMIT = 4
+    # Number of bytes fetched from the start of an image (Range request) for
+    # finding its type and dimensions without downloading it.
+    PROBE_BYTES = 16 * 1024
+    # Show type, dimensions and size of images on the page listing them. The
+    # images of each page are probed before it is shown, so it is off by
+    # default.
+    SHOW_IMAGE_INFO = False
+    # Leave near-duplicates (same image in several sizes or encodings) out of
+    # zip files of downloaded images, keeping the largest image of each. Images
+    # are near-duplicates if their perceptual hashes (NEAR_DUPLICATE_HASH_SIZE
+    # ** 2 bits) differ in at most NEAR_DUPLICATE_DISTANCE bits. Requires numpy
+    # and Pillow (pip install -r requirements-dedup.txt).
+    NEAR_DUPLICATE_REMOVAL = False
+    NEAR_DUPLICATE_DISTANCE = 4
+    NEAR_DUPLICATE_HASH_SIZE = 8
+    # Records are logged through a queue and written by a background thread.
+    # Records of the loggers in LOG_FILES (and their children, '' for all
+    # loggers) are written as JSON lines to given files in LOG_DIR, rotated
+    # after LOG_FILE_MAX_BYTES bytes. Records of at least LOG_CONSOLE_LEVEL are
+    # also printed to console.
+    LOG_LEVEL = 'INFO'
+    LOG_CONSOLE_LEVEL = 'INFO'
+    LOG_DIR = 'logs/'
+    LOG_FILES = {
+        '': 'scrapper.log',
+        'scrapper.web': 'webapi.log',
+        'scrapper.api': 'restapi.log'
+    }
+    LOG_FILE_MAX_BYTES = 1000000
+    LOG_FILE_BACKUPS = 5
+    # Maximum number of records waiting to be written, 0 for no limit. Records
+    # logged while the queue is full are dropped.
+    LOG_QUEUE_SIZE = 0
+    # Collect latency of scrapping stages and counters of downloads, failures,
+    # cache hits and jobs by host, served at METRICS_PATH in Prometheus text
+    # format.
+    METRICS_ENABLED = False
+    METRICS_PATH = '/metrics'
+    # Profile requests carrying PROFILING_HEADER header or PROFILING_QUERY_ARG
+    # query argument (and the jobs they submit). Profiles are saved in
+    # PROFILING_SUBFOLDER of FILES_DIR, as cProfile stats ('cprofile') or
+    # stacks sampled every PROFILING_SAMPLE_INTERVAL seconds ('stacks').
+    # From Python 3.12 stacks are sampled instead of cProfile stats.
+    PROFILING_ENABLED = False
+    PROFILING_HEADER = 'X-Profile'
+    PROFILING_QUERY_ARG = 'profile'
+    PROFILING_FORMAT = 'cprofile'
+    PROFILING_SUBFOLDER = 'profiles/'
+    PROFILING_SAMPLE_INTERVAL = 0.005
 
     @staticmethod
     def init_app(app):
@@ -42,6 +193,7 @@ class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
     PRESERVE_CONTEXT_ON_EXCEPTION = False
+    JOB_BACKEND = 'inline'
 
 config = {
     'development': DevelopmentConfig,
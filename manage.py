@@ -1,18 +1,11 @@
 """
 Main module for managing image scrapper web application
 """
-import logging
 from scrapper import create_app
 from flask_script import Manager, Shell
 
-# Setup logging
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s - %(name)s - '
-                           '%(levelname)s - %(message)s')
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-# Create application and bind application manager as well as shell
+# Create application (which also sets up logging, see
+# scrapper/procedures/logs.py) and bind application manager as well as shell
 app = create_app('default')
 manager = Manager(app)
 
@@ -4,8 +4,26 @@ Initialization of application and api blueprints and other modules.
 from flask import Flask
 from config import config
 from flask_bootstrap import Bootstrap
+from .procedures.http_session import HTTPSessionManager
+from .procedures.logs import LogManager
+from .procedures.metrics import MetricsManager
+from .procedures.profiling import ProfilingManager
+from .procedures.image_cache import ImageCacheManager
+from .procedures.revalidation import RevalidationManager
+from .procedures.result_cache import ResultCacheManager
+from .procedures.robots import RobotsManager
+from .jobs import JobManager
 
 bootstrap = Bootstrap()         # Styling of web interface.
+logs = LogManager()             # Logging through a background thread.
+metrics = MetricsManager()      # Latency and counters of scrapping.
+profiling = ProfilingManager()  # Profiles of single requests and jobs.
+http_sessions = HTTPSessionManager()    # Pooled connections for scrapping.
+image_cache = ImageCacheManager()       # Images shared between scrapes.
+revalidation = RevalidationManager()    # Validators of fetched resources.
+result_cache = ResultCacheManager()     # Image urls extracted from pages.
+robots = RobotsManager()        # Parsed robots.txt of websites.
+jobs = JobManager()             # Background scrapping jobs.
 
 
 def create_app(config_name='default', **config_overrides):
@@ -18,7 +36,16 @@ def create_app(config_name='default', **config_overrides):
     # Override configurations **kwargs if any/
     config[config_name].init_app(app)
 
+    logs.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
     bootstrap.init_app(app)
+    http_sessions.init_app(app)
+    image_cache.init_app(app)
+    revalidation.init_app(app)
+    result_cache.init_app(app)
+    robots.init_app(app)
+    jobs.init_app(app)
 
     # Register blueprints for restapi. All Restapi calls will be prefixed as
     # http(s)://<server_ip>:<server_port>/api/
@@ -42,6 +42,21 @@ def bad_request(message):
     return response
 
 
+def conflict(message):
+    """
+    Return conflict JSON response to user, for requests which cannot be
+    served in current state of the resource.
+    :param message: Message provided in response.
+    :return:
+    """
+    response = jsonify({
+        'error': 'conflict',
+        'message': message
+    })
+    response.status_code = 409
+    return response
+
+
 @r_api.app_errorhandler(500)
 def internal_server_error(message):
     """
@@ -2,13 +2,32 @@
 Function calls for rest api of image scrapper application.
 """
 import os
-from flask import jsonify, request, current_app
-from scrapper.procedures.scrapping_functions import get_image_urls_from_webpage
+import json
+from functools import partial
+from flask import jsonify, request, current_app, url_for, send_file, \
+    Response, stream_with_context
+from scrapper.procedures.scrapping_functions import get_cached_image_urls, \
+    iter_image_urls_from_webpage
 from scrapper.api import r_api, api_logger
 from scrapper.web.web_helpers import create_files_folder, store_urls_to_file,\
-    get_netloc_from_url
-from scrapper.procedures.helpers import get_filename
-from .errors import bad_request, internal_server_error
+    url_list_filename, files_path, paginate_urls, JOB_TASKS
+from scrapper.procedures.image_cache import get_image_cache
+from scrapper.procedures.revalidation import get_revalidation_cache
+from scrapper.procedures.result_cache import get_result_cache
+from scrapper.procedures.download_engine import DownloadEngine
+from scrapper.procedures.crawler import Crawler, HostRateLimiter
+from scrapper.procedures.robots import get_robots_cache
+from scrapper.procedures.probe import probe_images
+from scrapper.exceptions import ValidationError, RobotsDisallowed
+from scrapper.jobs import get_job_queue
+from .errors import bad_request, internal_server_error, not_found, conflict
+
+try:
+    # Python 3
+    from urllib.parse import urlsplit
+except ImportError:
+    # Python 2
+    from urlparse import urlsplit
 
 
 @r_api.route('/get_url_list', methods=['GET'])
@@ -19,40 +38,418 @@ def get_url_list():
     be provided as an encoded string).
     :parameter url: Url of webpage from where image resources need to be
     retrieved should be included in querystring.
+    :parameter refresh: scrap the webpage again even if its image urls are
+    cached (optional, 1/true/yes).
+    :parameter max_images: stop after this many images are found (optional).
+    :parameter probe: include type, dimensions and size of each image found
+    by fetching only the start of the image (optional, 1/true/yes).
+    :parameter min_width: leave out images narrower than this many pixels,
+    implies probe (optional).
+    :parameter min_height: leave out images lower than this many pixels,
+    implies probe (optional).
+    :parameter limit: return urls in pages of this many urls, in sorted order
+    (optional, default LINKS_PER_PAGE if cursor is given).
+    :parameter cursor: next_cursor returned with previous page (optional).
+    Images of the current page only are probed.
     :return:
     """
     url = request.args.get('url')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    paginate = cursor is not None or limit is not None
+    refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+    max_images = request.args.get('max_images', type=int)
+    min_width = request.args.get('min_width', type=int)
+    min_height = request.args.get('min_height', type=int)
+    probe = request.args.get('probe', '').lower() in ('1', 'true', 'yes') or \
+        min_width is not None or min_height is not None
     if url is None:
         api_logger.error('No url provided with restapi call to get url list '
                          'for images loaded in the page.')
         return bad_request('No url provided in query string.')
     try:
-        urls = get_image_urls_from_webpage(url)
-        api_logger.info('{count} urls retrieved for image sources in given '
-                        'webpage={url}'.format(count=len(urls), url=url))
-        # Create directory for storing files
-        create_files_folder(current_app.config['FILES_DIR'],
-                            change_to_directory=False)
-        api_logger.debug('{dir} created for storing the file containing image '
-                         'urls for webpage={url}'.format(
-                            dir=current_app.config['FILES_DIR'], url=url))
-        filename = get_filename(os.path.join(
-            current_app.config['FILES_DIR'],
-            get_netloc_from_url(url) + '.txt'))
-        # Store list of files for later use.
-        store_urls_to_file(filename, urls)
-        api_logger.info('Urls for image resources retrieved from webpage='
-                        '{url} successfully stored in '
-                        'file={fname}'.format(url=url, fname=filename))
-        return jsonify({
+        urls, cached = get_cached_image_urls(url, refresh=refresh,
+                                             max_images=max_images)
+        api_logger.info('%s urls retrieved for image sources in given '
+                        'webpage=%s', len(urls), url)
+        total = len(urls)
+        if cursor is None:
+            # Create directory for storing files
+            create_files_folder(files_path())
+            filename = url_list_filename(url)
+            # Store list of files for later use.
+            store_urls_to_file(filename, urls)
+            api_logger.info('Urls for image resources retrieved from '
+                            'webpage=%s successfully stored in file=%s', url,
+                            filename)
+        next_cursor = None
+        if paginate:
+            urls, next_cursor = paginate_urls(urls, cursor=cursor,
+                                              limit=limit)
+        images = None
+        if probe:
+            infos = probe_images(urls)
+            images = [infos[img_url] for img_url in urls
+                      if not infos[img_url].is_smaller_than(min_width,
+                                                            min_height)]
+            urls = [info.url for info in images]
+            api_logger.info('%s images left after probing images of '
+                            'webpage=%s', len(urls), url)
+        response = {
             "status": "success",
             "count": len(urls),
+            "cached": cached,
             "url_list": [url for url in urls]
-        })
+        }
+        if images is not None:
+            response["images"] = [info.to_dict() for info in images]
+        if paginate:
+            response["total"] = total
+            response["next_cursor"] = next_cursor
+        return jsonify(response)
+    except ValidationError:
+        raise
     except Exception as ex:
-        api_logger.error('Unable to retrieve list of urls for image resources '
-                         'from webpage url={url}. '
-                         'Error {err}'.format(err=ex, url=url))
+        api_logger.error('Unable to retrieve list of urls for image '
+                         'resources from webpage url=%s. Error %s', url, ex)
         return internal_server_error(
             message='Unable to retrieve list of urls for image resources from '
                     'webpage url={url}. Error {err}'.format(err=ex, url=url))
+
+
+@r_api.route('/stream_url_list', methods=['GET'])
+def stream_url_list():
+    """
+    This function implements the endpoint for getting the image urls loaded
+    in a webpage as a stream. Each url is sent as a line of NDJSON as soon as
+    it is found while the webpage is being received, and a last line gives
+    the status and number of urls.
+    :parameter url: Url of webpage from where image resources need to be
+    retrieved should be included in querystring.
+    :parameter refresh: scrap the webpage again even if its image urls are
+    cached (optional, 1/true/yes).
+    :return: NDJSON response.
+    """
+    url = request.args.get('url')
+    refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+    if url is None:
+        api_logger.error('No url provided with restapi call to stream url '
+                         'list for images loaded in the page.')
+        return bad_request('No url provided in query string.')
+
+    def generate():
+        count = 0
+        try:
+            for img_url in iter_image_urls_from_webpage(url,
+                                                        refresh=refresh):
+                count += 1
+                yield json.dumps({"url": img_url}) + '\n'
+        except Exception as ex:
+            api_logger.error('Unable to stream list of urls for image '
+                             'resources from webpage url=%s. Error %s', url,
+                             ex)
+            yield json.dumps({
+                "status": "error",
+                "count": count,
+                "message": 'Unable to retrieve list of urls for image '
+                           'resources from webpage url={url}. Error '
+                           '{err}'.format(url=url, err=ex)
+            }) + '\n'
+            return
+        yield json.dumps({"status": "success", "count": count}) + '\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+@r_api.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    This function implements the endpoint for submitting a scrapping job. The
+    job id is returned immediately and the job runs in background.
+    :parameter url: Url of webpage to be scrapped, in JSON body, form or
+    querystring.
+    :parameter type: url_list (default) for list of image urls, images for
+    zip file containing the images, crawl for list of image urls on all
+    pages crawled from the webpage.
+    :return: job status, HTTP status code: 202
+    """
+    data = request.get_json(silent=True) or request.values
+    url = data.get('url')
+    kind = data.get('type', 'url_list')
+    if url is None:
+        api_logger.error('No url provided with restapi call to submit job.')
+        return bad_request('No url provided for the job.')
+    if kind not in JOB_TASKS:
+        return bad_request('Invalid job type={kind}. Valid types are '
+                           '{types}'.format(kind=kind,
+                                            types=', '.join(JOB_TASKS)))
+    job = get_job_queue().submit(kind, url, JOB_TASKS[kind])
+    api_logger.info('Job=%s submitted for webpage=%s', job.id, url)
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = url_for('r_api.get_job', job_id=job.id)
+    return response
+
+
+@r_api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    This function implements the endpoint for polling status and progress of
+    a job.
+    :param job_id: id of job returned when it was submitted.
+    :return:
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return not_found('No job found with id={id}'.format(id=job_id))
+    return jsonify(job.to_dict())
+
+
+@r_api.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """
+    This function implements the endpoint for fetching the result of a
+    finished job i.e. list of image urls or zip file containing images.
+    :param job_id: id of job returned when it was submitted.
+    :return:
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return not_found('No job found with id={id}'.format(id=job_id))
+    if job.status == job.FAILED:
+        return internal_server_error(
+            message='Job={id} failed. Error {err}'.format(id=job_id,
+                                                          err=job.error))
+    if not job.is_done:
+        return conflict('Job={id} is {status}'.format(id=job_id,
+                                                      status=job.status))
+    if job.kind == 'images':
+        if not os.path.isfile(job.result):
+            return not_found('Result of job={id} has expired'.format(
+                id=job_id))
+        return send_file(job.result, as_attachment=True,
+                         attachment_filename=os.path.basename(job.result))
+    return jsonify({
+        "status": "success",
+        "count": len(job.result),
+        "url_list": job.result
+    })
+
+
+@r_api.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """
+    This function implements the endpoint for hit, miss and revalidation
+    counters of the caches used for scrapping.
+    :return:
+    """
+    image_cache = get_image_cache()
+    revalidation_cache = get_revalidation_cache()
+    result_cache = get_result_cache()
+    return jsonify({
+        "images": image_cache.stats() if image_cache else None,
+        "results": result_cache.stats() if result_cache else None,
+        "revalidation": revalidation_cache.stats() if revalidation_cache
+        else None
+    })
+
+
+def get_batch_urls():
+    """
+    Reads the list of webpage urls given for a batch request. The urls are
+    given as a JSON list (or object with "urls" list) or as NDJSON, with one
+    url (string or object with "url") on each line.
+    :return: list of unique urls, in given order.
+    :raises ValidationError: if no valid list of urls is given.
+    """
+    body = request.get_data(as_text=True)
+    try:
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            items = [json.loads(line) for line in body.splitlines()
+                     if line.strip()]
+        else:
+            items = json.loads(body)
+            if isinstance(items, dict):
+                items = items.get('urls')
+    except ValueError as ex:
+        raise ValidationError('Invalid JSON in request body. '
+                              'Error {err}'.format(err=ex))
+    if not isinstance(items, list) or not items:
+        raise ValidationError('No list of urls provided in request body.')
+    urls = []
+    seen = set()
+    for item in items:
+        url = item.get('url') if isinstance(item, dict) else item
+        if not isinstance(url, str) or not url.strip():
+            raise ValidationError('Invalid url={url} in list of '
+                                  'urls.'.format(url=url))
+        if url not in seen:
+            seen.add(url)
+            urls.append(url)
+    if len(urls) > current_app.config['BATCH_MAX_URLS']:
+        raise ValidationError('At most {count} urls can be provided in a '
+                              'batch.'.format(
+                                count=current_app.config['BATCH_MAX_URLS']))
+    return urls
+
+
+def scrape_batch_page(url, robots=None, rate_limiter=None, refresh=False):
+    """
+    This function returns the urls of images of a webpage of a batch, see
+    get_cached_image_urls. Webpages disallowed by robots.txt are not scrapped
+    and requests to a host are spaced by its Crawl-delay.
+    :param url: url of webpage.
+    :param robots: RobotsCache object, None to ignore robots.txt.
+    :param rate_limiter: HostRateLimiter object shared by the batch.
+    :param refresh: scrap the webpage even if cached.
+    :return: tuple (urls of images, True if urls were served from cache)
+    :raises RobotsDisallowed: if webpage is disallowed by robots.txt.
+    """
+    if robots is not None:
+        if not robots.can_fetch(url):
+            raise RobotsDisallowed('Webpage url={url} is disallowed by '
+                                   'robots.txt'.format(url=url))
+        delay = robots.crawl_delay(url)
+        if delay is not None and rate_limiter is not None:
+            rate_limiter.set_delay(urlsplit(url).netloc, delay)
+    if rate_limiter is not None:
+        rate_limiter.wait(urlsplit(url).netloc)
+    return get_cached_image_urls(url, refresh=refresh)
+
+
+@r_api.route('/batch_url_list', methods=['POST'])
+def batch_url_list():
+    """
+    This function implements the endpoint for getting lists of image urls
+    loaded in many webpages with a single request. The webpages are scrapped
+    concurrently and the result of each webpage is streamed back as a line of
+    NDJSON as soon as it is done. Failures (including webpages disallowed by
+    robots.txt) are reported in the line of failed webpage and do not fail
+    the batch. Requests to a host are spaced by the Crawl-delay of its
+    robots.txt.
+    :parameter refresh: scrap the webpages even if cached (optional).
+    :return: NDJSON response, one object per webpage.
+    """
+    urls = get_batch_urls()
+    refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+    engine = DownloadEngine(
+        max_workers=current_app.config['BATCH_WORKERS'],
+        per_host_limit=current_app.config['BATCH_PER_HOST_LIMIT'])
+    api_logger.info('Batch of %s webpages submitted for retrieving image urls',
+                    len(urls))
+
+    # robots.txt is checked by the workers, so the first lines are not
+    # delayed by fetching robots.txt of every host.
+    scrape = partial(scrape_batch_page, robots=get_robots_cache(),
+                     rate_limiter=HostRateLimiter(0), refresh=refresh)
+
+    def generate():
+        for result in engine.iter_download(urls, scrape):
+            if result.success:
+                image_urls, cached = result.value
+                line = {
+                    "url": result.url,
+                    "status": "success",
+                    "count": len(image_urls),
+                    "cached": cached,
+                    "url_list": [url for url in image_urls]
+                }
+            elif isinstance(result.error, RobotsDisallowed):
+                line = {
+                    "url": result.url,
+                    "status": "error",
+                    "message": str(result.error)
+                }
+            else:
+                line = {
+                    "url": result.url,
+                    "status": "error",
+                    "message": 'Unable to retrieve list of urls for image '
+                               'resources from webpage url={url}. Error '
+                               '{err}'.format(url=result.url,
+                                              err=result.error)
+                }
+            yield json.dumps(line) + '\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+@r_api.route('/crawl_url_list', methods=['GET'])
+def crawl_url_list():
+    """
+    This function implements the endpoint for getting list of image urls
+    loaded in all pages of a website, crawled by following same-origin
+    hyperlinks from given webpage. Large crawls should be submitted as jobs
+    of type crawl instead.
+    :parameter url: Url of webpage where crawl starts.
+    :parameter depth: Number of hyperlinks followed from webpage (optional,
+    default=CRAWL_MAX_DEPTH).
+    :parameter max_pages: Maximum number of pages crawled (optional,
+    default=CRAWL_MAX_PAGES).
+    :parameter sitemap: Seed crawl with pages and images listed in sitemaps
+    of website (optional, 1/true/yes).
+    :return:
+    """
+    url = request.args.get('url')
+    if url is None:
+        api_logger.error('No url provided with restapi call to crawl '
+                         'website for images.')
+        return bad_request('No url provided in query string.')
+    depth = request.args.get('depth', type=int)
+    max_pages = request.args.get('max_pages', type=int)
+    use_sitemap = request.args.get('sitemap', '').lower() in ('1', 'true',
+                                                               'yes')
+    if max_pages is not None and \
+            max_pages > current_app.config['CRAWL_MAX_PAGES']:
+        return bad_request('At most {count} pages can be crawled in a '
+                           'request.'.format(
+                            count=current_app.config['CRAWL_MAX_PAGES']))
+    try:
+        crawler = Crawler.from_config(url, current_app.config,
+                                      max_depth=depth, max_pages=max_pages,
+                                      use_sitemap=use_sitemap)
+        result = crawler.crawl()
+        api_logger.info('%s urls retrieved for image sources in %s pages '
+                        'crawled from webpage=%s', len(result.image_urls),
+                        len(result.pages), url)
+        response = result.to_dict()
+        response['status'] = 'success'
+        return jsonify(response)
+    except Exception as ex:
+        api_logger.error('Unable to crawl website of webpage url=%s. Error %s',
+                         url, ex)
+        return internal_server_error(
+            message='Unable to crawl website of webpage url={url}. '
+                    'Error {err}'.format(err=ex, url=url))
+
+
+@r_api.route('/sitemap_url_list', methods=['GET'])
+def sitemap_url_list():
+    """
+    This function implements the endpoint for getting list of image urls
+    listed in the image sitemaps of a website. The sitemaps are found from
+    robots.txt of the website (or /sitemap.xml) and no HTML page is fetched.
+    :parameter url: Url of any webpage of the website.
+    :return:
+    """
+    url = request.args.get('url')
+    if url is None:
+        api_logger.error('No url provided with restapi call to read '
+                         'sitemaps of website.')
+        return bad_request('No url provided in query string.')
+    try:
+        result = Crawler.from_config(url, current_app.config,
+                                     sitemap_only=True).crawl()
+        api_logger.info('%s urls retrieved for image sources from sitemaps '
+                        'of webpage=%s', len(result.image_urls), url)
+        response = result.to_dict()
+        response['status'] = 'success'
+        return jsonify(response)
+    except Exception as ex:
+        api_logger.error('Unable to read sitemaps of website of webpage '
+                         'url=%s. Error %s', url, ex)
+        return internal_server_error(
+            message='Unable to read sitemaps of website of webpage url={url}.'
+                    ' Error {err}'.format(err=ex, url=url))
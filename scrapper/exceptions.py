@@ -5,3 +5,24 @@ Application exceptions
 
 class ValidationError(ValueError):
     pass
+
+
+class DownloadLimitExceeded(IOError):
+    """
+    Raised when a download exceeds the size allowed for an image or a job.
+    """
+    pass
+
+
+class DownloadError(IOError):
+    """
+    Raised when a server answers a download with an error status.
+    """
+    pass
+
+
+class RobotsDisallowed(Exception):
+    """
+    Raised when robots.txt of a website disallows fetching a webpage.
+    """
+    pass
@@ -0,0 +1,257 @@
+"""
+Background jobs for scrapping web pages. A job is submitted with the url of a
+web page and a task, and its id is returned immediately. The task runs on a
+job backend while the status, progress and result of job can be polled using
+the job id.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from .procedures.logs import log_context
+from .procedures.metrics import ACTIVE_JOBS, url_host
+from .procedures.profiling import profile_for_job, current_profile, \
+    profiled, save_profile
+
+
+class Job(object):
+    """
+    State of a single scrapping job.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    def __init__(self, kind, url):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.url = url
+        self.status = Job.QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # Progress counts, updated by the task while it runs.
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.result = None
+        self.error = None
+        # Profile of job if it was submitted by a profiled request.
+        self.profile = None
+        # Files created by the task (e.g. zip file of images), removed when
+        # the job is dropped from history or its files expire.
+        self.files = []
+        self._lock = threading.Lock()
+
+    @property
+    def is_done(self):
+        return self.status in (Job.FINISHED, Job.FAILED)
+
+    def set_total(self, total):
+        self.total = total
+
+    def update_progress(self, success=True):
+        """
+        Records completion of one unit of work (e.g. an image download).
+        :param success: whether the unit of work succeeded.
+        """
+        with self._lock:
+            if success:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def remove_files(self):
+        """
+        Removes the files created by the task of job.
+        """
+        for filename in self.files:
+            try:
+                os.remove(filename)
+            except OSError as ex:
+                logging.debug('Unable to remove file=%s of job=%s. Error=%s',
+                              filename, self.id, ex)
+        self.files = []
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.kind,
+            'url': self.url,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'progress': {
+                'total': self.total,
+                'done': self.done,
+                'failed': self.failed
+            },
+            'error': self.error,
+            'profile': self.profile.url if self.profile is not None else None
+        }
+
+
+class ThreadPoolBackend(object):
+    """
+    Runs jobs on a pool of threads inside the application process.
+    """
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, func, *args):
+        self.executor.submit(func, *args)
+
+
+class InlineBackend(object):
+    """
+    Runs jobs synchronously when they are submitted. Used as a stand-in for
+    a real backend in testing.
+    """
+    def __init__(self, max_workers=None):
+        pass
+
+    def submit(self, func, *args):
+        func(*args)
+
+
+# Job backends which can be selected with JOB_BACKEND configuration. An
+# external broker only needs to provide submit(func, *args).
+JOB_BACKENDS = {
+    'thread': ThreadPoolBackend,
+    'inline': InlineBackend
+}
+
+
+class JobQueue(object):
+    """
+    Keeps track of submitted jobs and runs them on the job backend. Only the
+    most recent `history` jobs are kept, jobs which are queued or running are
+    never dropped. Files of jobs finished more than `files_ttl` seconds ago
+    are removed.
+    """
+    def __init__(self, backend, history=1000, files_ttl=3600):
+        self.backend = backend
+        self.history = history
+        self.files_ttl = files_ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, url, task):
+        """
+        Creates a job and submits it to the backend.
+        :param kind: type of job e.g. url_list, images
+        :param url: url of web page to be scrapped.
+        :param task: function accepting the job and returning its result.
+        :return: Job object.
+        """
+        job = Job(kind, url)
+        job.profile = profile_for_job(job.id)
+        with self._lock:
+            self._jobs[job.id] = job
+            evicted = self._evict() + self._expired()
+        for old_job in evicted:
+            old_job.remove_files()
+        app = current_app._get_current_object()
+        self.backend.submit(self._run, app, job, task)
+        logging.info('Job=%s of type=%s submitted for webpage=%s', job.id,
+                     kind, url)
+        return job
+
+    def _evict(self):
+        """
+        Drops the oldest finished jobs beyond history. Called with lock held.
+        :return: list of dropped jobs.
+        """
+        excess = len(self._jobs) - self.history
+        evicted = []
+        if excess <= 0:
+            return evicted
+        for job_id, job in list(self._jobs.items()):
+            if len(evicted) >= excess:
+                break
+            if job.is_done:
+                del self._jobs[job_id]
+                evicted.append(job)
+        return evicted
+
+    def _expired(self):
+        """
+        Returns the finished jobs whose files expired. Called with lock held.
+        """
+        if self.files_ttl is None:
+            return []
+        deadline = time.time() - self.files_ttl
+        return [job for job in self._jobs.values()
+                if job.files and job.is_done and job.finished is not None and
+                job.finished < deadline]
+
+    def get(self, job_id):
+        """
+        Returns the job with given id, None if no such job exists.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @staticmethod
+    def _run(app, job, task):
+        job.status = Job.RUNNING
+        job.started = time.time()
+        host = url_host(job.url)
+        ACTIVE_JOBS.inc(host=host)
+        try:
+            profile = current_profile()
+            if profile is not None:
+                # Job runs inline in a profiled request, and is profiled with
+                # it (along with its workers).
+                job.profile = None
+            else:
+                profile = job.profile
+            with log_context.bind(job_id=job.id), profiled(profile):
+                try:
+                    with app.app_context():
+                        job.result = task(job)
+                    job.status = Job.FINISHED
+                except Exception as ex:
+                    logging.error('Job=%s for webpage=%s failed. Error=%s',
+                                  job.id, job.url, ex)
+                    job.error = str(ex)
+                    job.status = Job.FAILED
+        except Exception as ex:
+            # Job could not be run at all, it must not stay running.
+            logging.error('Unable to run job=%s. Error=%s', job.id, ex)
+            job.error = str(ex)
+            job.status = Job.FAILED
+        finally:
+            ACTIVE_JOBS.dec(host=host)
+            if job.profile is not None:
+                save_profile(job.profile)
+            job.finished = time.time()
+
+
+class JobManager(object):
+    """
+    Flask extension creating the job queue for an application.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = JOB_BACKENDS[app.config.get('JOB_BACKEND', 'thread')](
+            max_workers=app.config.get('JOB_WORKERS', 4))
+        app.extensions['job_queue'] = JobQueue(
+            backend, history=app.config.get('JOB_HISTORY', 1000),
+            files_ttl=app.config.get('JOB_FILES_TTL', 3600))
+
+
+def get_job_queue():
+    """
+    Returns job queue of current application.
+    """
+    return current_app.extensions['job_queue']
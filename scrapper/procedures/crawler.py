@@ -0,0 +1,282 @@
+"""
+This module implements crawling of a website for images. Starting from a
+web page, the same-origin hyperlinks on each page are followed up to a
+maximum depth and number of pages, and the image urls found on all pages are
+merged into one set. Pages are fetched concurrently, with a minimum delay
+between requests to the same host. robots.txt rules and Crawl-delay of the
+website are honored, and sitemaps can seed the crawl with pages and images.
+"""
+
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import current_app
+from .helpers import image_extensions, has_extension
+from .scrapping_functions import scrape_webpage
+from .robots import get_robots_cache
+from .sitemaps import read_sitemaps
+from .urls import normalize_url, absolute_url
+from .logs import log_context
+from .profiling import current_profile, profiled
+
+try:
+    # Python 3
+    from urllib.parse import urljoin, urlsplit
+except ImportError:
+    # Python 2
+    from urlparse import urljoin, urlsplit
+
+
+class BloomFilter(object):
+    """
+    Set of strings with fixed memory use and a small rate of false positives,
+    for deduplicating the frontier of large websites.
+    :param capacity: expected number of items.
+    :param error_rate: acceptable rate of false positives.
+    """
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.md5(item.encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+
+class HostRateLimiter(object):
+    """
+    Spaces requests to the same host at least `delay` seconds apart.
+    """
+    def __init__(self, delay=1.0):
+        self.delay = delay
+        self._next = {}         # host -> earliest time of next request
+        self._delays = {}       # host -> host specific delay
+        self._lock = threading.Lock()
+
+    def set_delay(self, host, delay):
+        """
+        Sets a host specific delay (e.g. Crawl-delay of robots.txt), which is
+        never shorter than the default delay.
+        """
+        with self._lock:
+            self._delays[host] = max(delay, self.delay)
+
+    def wait(self, host):
+        """
+        Blocks until a request to given host is allowed.
+        """
+        with self._lock:
+            delay = self._delays.get(host, self.delay)
+            now = time.time()
+            start = max(now, self._next.get(host, 0))
+            self._next[host] = start + delay
+        if start > now:
+            time.sleep(start - now)
+
+
+class CrawlResult(object):
+    """
+    Outcome of crawling a website.
+    """
+    def __init__(self):
+        self.image_urls = set()
+        self.pages = []
+        self.errors = {}
+
+    def to_dict(self):
+        return {
+            'pages': self.pages,
+            'errors': self.errors,
+            'count': len(self.image_urls),
+            'url_list': sorted(self.image_urls)
+        }
+
+
+class Crawler(object):
+    """
+    Crawls the website of a starting web page for images.
+    :param start_url: url of web page where crawl starts.
+    :param max_depth: number of hyperlinks followed from start page.
+    :param max_pages: maximum number of pages scrapped.
+    :param workers: number of pages scrapped at the same time.
+    :param delay: minimum delay (seconds) between requests to the same host.
+    :param bloom_filter: deduplicate frontier using Bloom filter instead of a
+    set of urls (default=False).
+    :param bloom_capacity: number of urls the Bloom filter is sized for.
+    :param robots: RobotsCache whose rules and Crawl-delay are honored
+    (default=None i.e. robots.txt is ignored).
+    :param use_sitemap: take images listed in sitemaps of the website and
+    scrap the pages listed in them as well (default=False).
+    :param sitemap_only: only read sitemaps, no HTML page is scrapped
+    (default=False).
+    """
+    def __init__(self, start_url, max_depth=2, max_pages=100, workers=4,
+                 delay=1.0, bloom_filter=False, bloom_capacity=1000000,
+                 robots=None, use_sitemap=False, sitemap_only=False):
+        self.start_url = start_url
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.workers = max(1, workers)
+        self.robots = robots
+        self.use_sitemap = use_sitemap or sitemap_only
+        self.sitemap_only = sitemap_only
+        self.rate_limiter = HostRateLimiter(delay)
+        self.seen = BloomFilter(bloom_capacity) if bloom_filter else set()
+        parts = urlsplit(normalize_url(start_url))
+        self.origin = (parts.scheme, parts.netloc)
+
+    @classmethod
+    def from_config(cls, start_url, config, **overrides):
+        """
+        Creates a crawler using the crawl configuration of the application.
+        :param start_url: url of web page where crawl starts.
+        :param config: Application configuration.
+        :param overrides: parameters overriding the configuration.
+        :return: Crawler object.
+        """
+        params = {
+            'max_depth': config.get('CRAWL_MAX_DEPTH', 2),
+            'max_pages': config.get('CRAWL_MAX_PAGES', 100),
+            'workers': config.get('CRAWL_WORKERS', 4),
+            'delay': config.get('CRAWL_DELAY', 1.0),
+            'bloom_filter': config.get('CRAWL_BLOOM_FILTER', False),
+            'bloom_capacity': config.get('CRAWL_BLOOM_CAPACITY', 1000000),
+            'robots': get_robots_cache()
+        }
+        params.update((key, value) for key, value in overrides.items()
+                      if value is not None)
+        return cls(start_url, **params)
+
+    def is_followed(self, url):
+        """
+        Checks whether a hyperlink should be crawled i.e. it is on the same
+        origin as the start page and is allowed by robots.txt.
+        :param url: normalized absolute url.
+        """
+        parts = urlsplit(url)
+        if (parts.scheme, parts.netloc) != self.origin:
+            return False
+        return self.robots is None or self.robots.can_fetch(url)
+
+    def _enqueue(self, frontier, page_url, hyperlinks, depth, extensions):
+        """
+        Adds unseen same-origin hyperlinks of a page to the frontier. Links to
+        images are not crawled, they are found as images of the page already.
+        """
+        for link in hyperlinks:
+            link = link.strip()
+            if not link or has_extension(link, extensions):
+                continue
+            url = absolute_url(page_url, link)
+            if url in self.seen or not self.is_followed(url):
+                continue
+            self.seen.add(url)
+            frontier.append((url, depth))
+
+    def _seed_from_sitemaps(self, start, frontier, result):
+        """
+        Adds the images listed in sitemaps of the website to the result and
+        the pages listed in them to the frontier. Hyperlinks of sitemap pages
+        are not followed, since the sitemap lists the pages of website.
+        """
+        config = current_app.config
+        if self.robots is not None:
+            sitemap_urls = self.robots.sitemaps(start)
+        else:
+            sitemap_urls = [urljoin(start, '/sitemap.xml')]
+        sitemap = read_sitemaps(
+            sitemap_urls, max_sitemaps=config.get('SITEMAP_MAX_FILES', 50),
+            max_urls=config.get('SITEMAP_MAX_URLS', 100000),
+            robots=self.robots)
+        result.image_urls.update(sitemap.image_urls)
+        result.errors.update(sitemap.errors)
+        for page in sitemap.pages:
+            url = normalize_url(page)
+            if url not in self.seen and self.is_followed(url):
+                self.seen.add(url)
+                frontier.append((url, self.max_depth))
+
+    def _scrape(self, app, context, profile, url):
+        with app.app_context(), log_context.bind(**context), \
+                profiled(profile):
+            self.rate_limiter.wait(urlsplit(url).netloc)
+            return scrape_webpage(url)
+
+    def crawl(self, progress=None):
+        """
+        Crawls the website.
+        :param progress: function called with success (True/False) of each
+        page as soon as it is scrapped.
+        :return: CrawlResult object.
+        """
+        app = current_app._get_current_object()
+        context = log_context.get()
+        profile = current_profile()
+        extensions = image_extensions(
+            current_app.config['IMAGE_EXTENSIONS'])
+        result = CrawlResult()
+        start = normalize_url(self.start_url)
+        self.seen.add(start)
+        frontier = deque()
+        if self.robots is not None:
+            delay = self.robots.crawl_delay(start)
+            if delay is not None:
+                self.rate_limiter.set_delay(urlsplit(start).netloc, delay)
+        if self.use_sitemap:
+            self._seed_from_sitemaps(start, frontier, result)
+            if self.sitemap_only:
+                return result
+        if self.robots is None or self.robots.can_fetch(start):
+            frontier.appendleft((start, 0))
+        else:
+            result.errors[start] = 'Disallowed by robots.txt'
+        in_flight = {}      # future -> (url, depth)
+        scheduled = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while frontier or in_flight:
+                while frontier and len(in_flight) < self.workers and \
+                        scheduled < self.max_pages:
+                    url, depth = frontier.popleft()
+                    in_flight[executor.submit(self._scrape, app, context,
+                                              profile, url)] = (url, depth)
+                    scheduled += 1
+                if not in_flight:
+                    break
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth = in_flight.pop(future)
+                    try:
+                        image_urls, hyperlinks = future.result()
+                    except Exception as ex:
+                        logging.error('Unable to crawl webpage=%s. Error=%s',
+                                      url, ex)
+                        result.errors[url] = str(ex)
+                        if progress is not None:
+                            progress(False)
+                        continue
+                    result.pages.append(url)
+                    result.image_urls.update(image_urls)
+                    if depth < self.max_depth:
+                        self._enqueue(frontier, url, hyperlinks, depth + 1,
+                                      extensions)
+                    if progress is not None:
+                        progress(True)
+        logging.info('%s unique image urls found on %s pages crawled from '
+                     'webpage=%s', len(result.image_urls), len(result.pages),
+                     self.start_url)
+        return result
@@ -0,0 +1,158 @@
+"""
+This module finds near-duplicate images among downloaded images, e.g. the
+same image served in several sizes or re-encoded. Each image gets a
+perceptual hash (dHash) computed from a small grayscale version of it, and
+images whose hashes differ in only a few bits are clustered using a BK-tree.
+Only the largest image of each cluster is kept.
+
+numpy and Pillow are optional requirements (see requirements-dedup.txt), so
+this module is imported only when NEAR_DUPLICATE_REMOVAL is enabled.
+"""
+
+import os
+import logging
+import numpy
+from PIL import Image
+
+
+def hamming_distance(hash1, hash2):
+    """
+    Returns the number of bits in which given hashes differ.
+    """
+    return bin(hash1 ^ hash2).count('1')
+
+
+def dhash(image, hash_size=8):
+    """
+    This function computes the difference hash of an image i.e. for each
+    pixel of the image downscaled to (hash_size + 1) x hash_size grayscale
+    pixels, whether it is brighter than its right neighbour.
+    :param image: PIL Image object.
+    :param hash_size: number of rows and columns compared, the hash has
+    hash_size ** 2 bits.
+    :return: hash as int.
+    """
+    # Let JPEG decoder scale the image down already while decoding.
+    image.draft('L', (hash_size * 4, hash_size * 4))
+    pixels = numpy.asarray(
+        image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR),
+        dtype=numpy.int16)
+    bits = numpy.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+class ImageHash(object):
+    """
+    Perceptual hash and size of a downloaded image.
+    """
+    def __init__(self, filename, value, pixels, size):
+        self.filename = filename
+        self.hash = value
+        self.pixels = pixels
+        self.size = size
+
+    @classmethod
+    def from_file(cls, filename, hash_size=8):
+        """
+        Hashes the image stored in given file.
+        :return: ImageHash object, None if file is not a readable image.
+        """
+        try:
+            image = Image.open(filename)
+            width, height = image.size
+            return cls(filename, dhash(image, hash_size), width * height,
+                       os.path.getsize(filename))
+        except Exception as ex:
+            logging.debug('Unable to hash image=%s. Error=%s', filename, ex)
+            return None
+
+
+class BKTree(object):
+    """
+    BK-tree of hashes for finding the hashes within a Hamming distance of a
+    hash, without comparing it with every hash in the tree.
+    """
+    def __init__(self):
+        self.root = None        # [hash, item, {distance: child node}]
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = [value, item, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """
+        Returns the items whose hashes are within max_distance of given hash.
+        """
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                found.append(node[1])
+            # Only subtrees with distance within range may contain matches.
+            nodes.extend(child for d, child in node[2].items()
+                         if distance - max_distance <= d <=
+                         distance + max_distance)
+        return found
+
+
+def cluster_near_duplicates(hashes, max_distance=4):
+    """
+    This function clusters images whose hashes are within max_distance bits
+    of each other. Images are clustered from the largest to the smallest, so
+    the first image of each cluster is the largest one.
+    :param hashes: list of ImageHash objects.
+    :param max_distance: maximum Hamming distance of near-duplicates.
+    :return: list of clusters, each a list of ImageHash objects.
+    """
+    tree = BKTree()
+    clusters = []
+    for image in sorted(hashes, key=lambda h: (h.pixels, h.size),
+                        reverse=True):
+        matches = tree.search(image.hash, max_distance)
+        if matches:
+            # Join the cluster of the closest larger image.
+            closest = min(matches, key=lambda cluster: hamming_distance(
+                image.hash, cluster[0].hash))
+            closest.append(image)
+        else:
+            cluster = [image]
+            clusters.append(cluster)
+            tree.add(image.hash, cluster)
+    return clusters
+
+
+def remove_near_duplicates(filenames, max_distance=4, hash_size=8):
+    """
+    This function removes the near-duplicate images among given files from
+    disk, keeping the largest image of each cluster. Files which are not
+    readable images are kept.
+    :param filenames: files of downloaded images.
+    :param max_distance: maximum Hamming distance of near-duplicates.
+    :param hash_size: size of hash (see dhash).
+    :return: list of removed files.
+    """
+    hashes = [h for h in (ImageHash.from_file(filename, hash_size)
+                          for filename in filenames) if h is not None]
+    removed = []
+    for cluster in cluster_near_duplicates(hashes, max_distance):
+        for image in cluster[1:]:
+            try:
+                os.remove(image.filename)
+                removed.append(image.filename)
+            except OSError as ex:
+                logging.error('Unable to remove near-duplicate image=%s. '
+                              'Error=%s', image.filename, ex)
+    logging.info('%s near-duplicate images removed out of %s images',
+                 len(removed), len(hashes))
+    return removed
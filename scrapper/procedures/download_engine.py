@@ -0,0 +1,154 @@
+"""
+This module implements a bounded-concurrency engine for downloading image
+resources. A global limit caps the number of downloads in flight for a job and
+a per-host limit keeps a single host from being flooded with connections.
+"""
+
+import time
+import logging
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import current_app
+from .logs import log_context
+from .profiling import current_profile, profiled
+
+try:
+    # Python 3
+    from urllib.parse import urlparse
+except ImportError:
+    # Python 2
+    from urlparse import urlparse
+
+
+class DownloadResult(object):
+    """
+    Outcome of a single download handled by the download engine. value is
+    the value returned by the download function (the stored filename for
+    image downloads).
+    """
+    def __init__(self, url, success, elapsed, value=None, error=None):
+        self.url = url
+        self.success = success
+        self.elapsed = elapsed
+        self.value = value
+        self.error = error
+
+    @property
+    def filename(self):
+        return self.value
+
+    def __repr__(self):
+        return '<DownloadResult url={url} success={succ} ' \
+               'elapsed={t:.3f}>'.format(url=self.url, succ=self.success,
+                                         t=self.elapsed)
+
+
+class DownloadEngine(object):
+    """
+    Schedules downloads on a thread pool. At most `max_workers` downloads run
+    at the same time and at most `per_host_limit` of them target the same
+    host. Urls waiting for a busy host do not occupy a worker thread, so other
+    hosts keep making progress in the meantime.
+    """
+    def __init__(self, max_workers=8, per_host_limit=4):
+        self.max_workers = max(1, int(max_workers))
+        self.per_host_limit = max(1, int(per_host_limit))
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create download engine using the limits given in application config.
+        :param config: Application configuration.
+        :return: DownloadEngine object.
+        """
+        return cls(max_workers=config.get('DOWNLOAD_WORKERS', 8),
+                   per_host_limit=config.get('DOWNLOAD_PER_HOST_LIMIT', 4))
+
+    @staticmethod
+    def _host(url):
+        """
+        Returns the host used for limiting concurrency for given url. Data
+        uris and unparseable urls are not bound to any host.
+        :param url: url for image resource.
+        :return: host name or None
+        """
+        try:
+            return urlparse(url).netloc.lower() or None
+        except Exception:
+            return None
+
+    @staticmethod
+    def _run(app, context, profile, func, url):
+        """
+        Run the download function for a single url inside application context
+        and measure the time taken by it.
+        :param app: Flask application object.
+        :param context: ids of request/job for log records (see logs.py).
+        :param profile: profile of request/job (see profiling.py), or None.
+        :param func: function accepting a url and returning stored filename.
+        :param url: url for image resource.
+        :return: DownloadResult object.
+        """
+        start = time.time()
+        try:
+            with app.app_context(), log_context.bind(**context), \
+                    profiled(profile):
+                value = func(url)
+            return DownloadResult(url, True, time.time() - start,
+                                  value=value)
+        except Exception as ex:
+            logging.error('Unable to download url=%s. Error=%s', url, ex)
+            return DownloadResult(url, False, time.time() - start, error=ex)
+
+    def iter_download(self, urls, func):
+        """
+        Downloads given urls concurrently and yields the result for each url
+        as soon as its download finishes.
+        :param urls: iterable of urls for image resources.
+        :param func: function accepting a url and returning stored filename.
+        :return: generator of DownloadResult objects.
+        """
+        app = current_app._get_current_object()
+        context = log_context.get()
+        profile = current_profile()
+        # Pending urls grouped by host, in order of first appearance.
+        pending = OrderedDict()
+        for url in urls:
+            pending.setdefault(self._host(url), deque()).append(url)
+        in_flight = {}          # future -> host
+        host_counts = {}
+
+        def schedule(executor):
+            for host in list(pending.keys()):
+                if len(in_flight) >= self.max_workers:
+                    return
+                queue = pending[host]
+                while queue and len(in_flight) < self.max_workers and \
+                        (host is None or
+                         host_counts.get(host, 0) < self.per_host_limit):
+                    future = executor.submit(self._run, app, context,
+                                             profile, func, queue.popleft())
+                    in_flight[future] = host
+                    host_counts[host] = host_counts.get(host, 0) + 1
+                if not queue:
+                    del pending[host]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            schedule(executor)
+            while in_flight:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    host = in_flight.pop(future)
+                    host_counts[host] -= 1
+                schedule(executor)
+                for future in done:
+                    yield future.result()
+
+    def download(self, urls, func):
+        """
+        Downloads given urls concurrently and waits for all of them.
+        :param urls: iterable of urls for image resources.
+        :param func: function accepting a url and returning stored filename.
+        :return: list of DownloadResult objects in order of completion.
+        """
+        return list(self.iter_download(urls, func))
@@ -0,0 +1,495 @@
+"""
+This module implements extraction of image links from web pages in a single
+pass over the page. The page is fed to lxml's parser chunk by chunk as it is
+received and the attributes referring to images are collected by a parser
+target, so neither the decoded page nor its element tree is kept in memory.
+
+Image links are found by extractors registered with register_extractor, e.g.
+<img> @src, srcset of <img> and <picture><source>, CSS backgrounds in style
+attributes and <style> elements, <link rel=preload as=image>, og:image meta
+and linked stylesheets. Extractors used are chosen with IMAGE_EXTRACTORS
+configuration. Linked stylesheets cost extra requests, so their extractor is
+used only when chosen explicitly.
+"""
+
+import re
+import logging
+from collections import OrderedDict
+from .helpers import install_package, image_extensions, has_extension
+from .revalidation import iter_page, fetch_page
+from .urls import resolve_url
+from .metrics import PageClock, NULL_TIMER
+
+try:
+    from lxml import etree
+except ImportError:
+    install_package('lxml')
+    from lxml import etree
+
+# url(...) in CSS, with or without quotes.
+CSS_URL_RE = re.compile(r'''url\(\s*(?:"([^"]*)"|'([^']*)'|([^)\s]*))\s*\)''',
+                        re.IGNORECASE)
+# Meta properties giving the representative image of a page.
+META_IMAGE_PROPERTIES = ('og:image', 'og:image:url', 'og:image:secure_url',
+                         'twitter:image', 'twitter:image:src')
+
+# Registered extractors: name -> (tags handled, function(collector, attrib))
+EXTRACTORS = OrderedDict()
+# Names of extractors used when none are chosen.
+DEFAULT_EXTRACTORS = []
+
+
+def register_extractor(name, tags, default=True):
+    """
+    Decorator registering a function extracting image links from elements
+    with given tags. The function is called with the collector and the
+    attributes of element when the start tag of an element is parsed.
+    :param name: name of extractor, used in IMAGE_EXTRACTORS configuration.
+    :param tags: tags of elements handled by the extractor.
+    :param default: use the extractor when none are chosen (default=True).
+    """
+    def decorator(func):
+        EXTRACTORS[name] = (tuple(tags), func)
+        if default:
+            DEFAULT_EXTRACTORS.append(name)
+        return func
+    return decorator
+
+
+def parse_srcset(srcset):
+    """
+    This function parses the candidates of a srcset attribute.
+    e.g. "a.jpg 300w, b.jpg 600w" -> [('a.jpg', 300, 'w'), ('b.jpg', 600, 'w')]
+    :param srcset: value of srcset attribute.
+    :return: list of tuples (url, value of descriptor, kind of descriptor i.e.
+    'w' or 'x'). Candidates without descriptor are 1x.
+    """
+    candidates = []
+    pos, length = 0, len(srcset)
+    while pos < length:
+        # Skip separators before url.
+        while pos < length and (srcset[pos].isspace() or srcset[pos] == ','):
+            pos += 1
+        start = pos
+        while pos < length and not srcset[pos].isspace():
+            pos += 1
+        url = srcset[start:pos]
+        if not url:
+            break
+        descriptor = ''
+        if url.endswith(','):
+            url = url.rstrip(',')
+        else:
+            start = pos
+            while pos < length and srcset[pos] != ',':
+                pos += 1
+            descriptor = srcset[start:pos].strip().lower()
+        try:
+            if descriptor.endswith('w'):
+                candidates.append((url, float(descriptor[:-1]), 'w'))
+            elif descriptor.endswith('x'):
+                candidates.append((url, float(descriptor[:-1]), 'x'))
+            else:
+                candidates.append((url, 1.0, 'x'))
+        except ValueError:
+            candidates.append((url, 1.0, 'x'))
+    return candidates
+
+
+def select_srcset_candidate(candidates, target_dpr=None):
+    """
+    This function selects the one variant of an image to be downloaded from
+    the candidates of a srcset attribute.
+    :param candidates: candidates returned by parse_srcset.
+    :param target_dpr: device pixel ratio wanted (default=None i.e. largest
+    variant). With density (x) descriptors the smallest variant of at least
+    target_dpr is selected. Width (w) descriptors depend on the layout of
+    page, so the largest variant is selected for them.
+    :return: url of selected candidate, None if there are no candidates.
+    """
+    if not candidates:
+        return None
+    if target_dpr is not None:
+        densities = [c for c in candidates if c[2] == 'x']
+        enough = [c for c in densities if c[1] >= target_dpr]
+        if enough:
+            return min(enough, key=lambda c: c[1])[0]
+        if densities and len(densities) == len(candidates):
+            return max(densities, key=lambda c: c[1])[0]
+    widths = [c for c in candidates if c[2] == 'w']
+    if widths:
+        return max(widths, key=lambda c: c[1])[0]
+    return max(candidates, key=lambda c: c[1])[0]
+
+
+def css_urls(css):
+    """
+    Returns the urls given with url(...) in CSS.
+    :param css: CSS declarations or stylesheet.
+    :return: list of urls.
+    """
+    return [next(group for group in match.groups() if group is not None)
+            for match in CSS_URL_RE.finditer(css)
+            if any(match.groups())]
+
+
+class StopExtraction(Exception):
+    """
+    Raised by the parser target to stop parsing once enough images are found.
+    """
+    pass
+
+
+class ImageLinkCollector(object):
+    """
+    lxml parser target collecting links to images while the page is parsed.
+    <img> @src, <img> @data-src and <a> @href are kept in separate lists, as
+    links found by other extractors are. The srcset candidate of an <img>
+    replaces its src, and a <picture> gives a single image.
+    :param max_images: stop after this many images are found (default=None
+    i.e. parse whole page).
+    :param file_extensions: extensions of hyperlinks counted as images when
+    max_images is given.
+    :param extractors: names of extractors used (default=
+    DEFAULT_EXTRACTORS).
+    :param target_dpr: device pixel ratio for selecting srcset candidate
+    (default=None i.e. largest variant).
+    """
+    def __init__(self, max_images=None, file_extensions=None,
+                 extractors=None, target_dpr=None):
+        self.max_images = max_images
+        self.file_extensions = image_extensions(file_extensions)
+        self.target_dpr = target_dpr
+        self.image_urls = []
+        self.data_src_urls = []
+        self.hyperlinks = []
+        self.extra_urls = []        # Found by other extractors.
+        self.stylesheets = []
+        self.base_url = None        # <base href> of page, if given.
+        self.count = 0
+        self._handlers = {}
+        extractors = list(extractors if extractors is not None
+                          else DEFAULT_EXTRACTORS)
+        self.uses_srcset = 'srcset' in extractors
+        self.in_picture = False
+        # Set once an image of current <picture> is taken.
+        self.picture_taken = False
+        # Contents of <style> elements are read by the style extractor.
+        self._read_style_elements = 'style' in extractors
+        for name in extractors:
+            if name not in EXTRACTORS:
+                logging.warning('Unknown image extractor=%s', name)
+                continue
+            tags, func = EXTRACTORS[name]
+            for tag in tags:
+                self._handlers.setdefault(tag, []).append(func)
+        self._style_text = None
+        self._taken = {}
+
+    # Lists of links returned by take_new.
+    LINK_LISTS = ('image_urls', 'data_src_urls', 'extra_urls', 'hyperlinks',
+                  'stylesheets')
+
+    def take_new(self):
+        """
+        Returns the links found since the previous call, for handling links
+        while the page is still being parsed.
+        :return: list of tuples (name of list e.g. 'image_urls', link).
+        """
+        links = []
+        for name in self.LINK_LISTS:
+            found = getattr(self, name)
+            start = self._taken.get(name, 0)
+            links.extend((name, link) for link in found[start:])
+            self._taken[name] = len(found)
+        return links
+
+    def _found(self, images=1):
+        self.count += images
+        if self.max_images is not None and self.count >= self.max_images:
+            raise StopExtraction()
+
+    def add_image(self, url):
+        """
+        Adds link to an image found by an extractor.
+        """
+        if url:
+            self.extra_urls.append(url)
+            self._found()
+
+    def srcset_candidate(self, attrib):
+        """
+        Returns the selected candidate of srcset (or data-srcset) of an
+        element, None if it has none.
+        """
+        srcset = attrib.get('srcset') or attrib.get('data-srcset')
+        if not srcset:
+            return None
+        return select_srcset_candidate(parse_srcset(srcset), self.target_dpr)
+
+    def add_srcset(self, srcset):
+        """
+        Adds the selected candidate of a srcset attribute.
+        """
+        if srcset:
+            self.add_image(select_srcset_candidate(parse_srcset(srcset),
+                                                   self.target_dpr))
+
+    def start(self, tag, attrib):
+        if tag == 'base' and self.base_url is None and attrib.get('href'):
+            self.base_url = attrib.get('href').strip()
+        if tag == 'style' and self._read_style_elements:
+            self._style_text = []
+        if tag == 'picture':
+            self.in_picture = True
+            self.picture_taken = False
+        for func in self._handlers.get(tag, ()):
+            func(self, attrib)
+        for func in self._handlers.get('*', ()):
+            func(self, attrib)
+
+    def end(self, tag):
+        if tag == 'picture':
+            self.in_picture = False
+            self.picture_taken = False
+        if tag == 'style' and self._style_text is not None:
+            for url in css_urls(''.join(self._style_text)):
+                self.add_image(url)
+            self._style_text = None
+
+    def data(self, data):
+        if self._style_text is not None:
+            self._style_text.append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return self
+
+
+@register_extractor('img', ('img',))
+def extract_img(collector, attrib):
+    """
+    <img> @src and lazy loaded <img> @data-src, unless they are replaced by
+    the srcset candidate of the <img> or by a <source> of its <picture>.
+    """
+    if collector.picture_taken:
+        return
+    if collector.uses_srcset and \
+            collector.srcset_candidate(attrib) is not None:
+        # Taken by extract_srcset.
+        return
+    src = attrib.get('src')
+    data_src = attrib.get('data-src')
+    if src is not None:
+        collector.image_urls.append(src)
+    if data_src is not None:
+        collector.data_src_urls.append(data_src)
+    if src is not None or data_src is not None:
+        collector._found((src is not None) + (data_src is not None))
+
+
+@register_extractor('hyperlink', ('a',))
+def extract_hyperlink(collector, attrib):
+    """
+    <a> @href, which refer to images if they have an image extension.
+    """
+    href = attrib.get('href')
+    if href is not None:
+        collector.hyperlinks.append(href)
+        if collector.max_images is not None and \
+                has_extension(href, collector.file_extensions):
+            collector._found()
+
+
+@register_extractor('srcset', ('img', 'source'))
+def extract_srcset(collector, attrib):
+    """
+    srcset of <img> and of <source> in <picture> (and their lazy loaded
+    data-srcset), reduced to the best candidate. Only the first <source>
+    (or <img>) of a <picture> giving a candidate is taken.
+    """
+    if collector.picture_taken:
+        return
+    url = collector.srcset_candidate(attrib)
+    if url is not None:
+        collector.add_image(url)
+        collector.picture_taken = collector.in_picture
+
+
+@register_extractor('style', ('*',))
+def extract_style(collector, attrib):
+    """
+    CSS backgrounds in style attribute of any element. Contents of <style>
+    elements are handled by the collector when the element ends.
+    """
+    style = attrib.get('style')
+    if style and 'url(' in style.lower():
+        for url in css_urls(style):
+            collector.add_image(url)
+
+
+@register_extractor('preload', ('link',))
+def extract_preload(collector, attrib):
+    """
+    <link rel=preload as=image>, reduced to the best candidate if it gives
+    imagesrcset.
+    """
+    rel = attrib.get('rel', '').lower().split()
+    if 'preload' in rel and attrib.get('as', '').lower() == 'image':
+        if attrib.get('imagesrcset'):
+            collector.add_srcset(attrib.get('imagesrcset'))
+        else:
+            collector.add_image(attrib.get('href'))
+
+
+@register_extractor('meta', ('meta',))
+def extract_meta(collector, attrib):
+    """
+    og:image and twitter:image meta properties.
+    """
+    prop = (attrib.get('property') or attrib.get('name') or '').lower()
+    if prop in META_IMAGE_PROPERTIES:
+        collector.add_image(attrib.get('content'))
+
+
+@register_extractor('stylesheet', ('link',), default=False)
+def extract_stylesheet(collector, attrib):
+    """
+    <link rel=stylesheet>, fetched after the page is parsed (see
+    extract_from_stylesheets).
+    """
+    if 'stylesheet' in attrib.get('rel', '').lower().split() and \
+            attrib.get('href'):
+        collector.stylesheets.append(attrib.get('href'))
+
+
+def extract_from_stylesheets(page_url, stylesheets, file_extensions,
+                             max_stylesheets=10):
+    """
+    This function fetches linked stylesheets and returns the urls of images
+    referred in them. Only urls with image extensions (or image data uris)
+    are returned, since stylesheets refer to fonts etc. as well.
+    :param page_url: url of web page linking the stylesheets.
+    :param stylesheets: hrefs of stylesheets, as given on the page.
+    :param file_extensions: extensions of images.
+    :param max_stylesheets: maximum number of stylesheets fetched.
+    :return: list of absolute urls of images.
+    """
+    image_urls = []
+    file_extensions = image_extensions(file_extensions)
+    for href in stylesheets[:max_stylesheets]:
+        stylesheet_url = resolve_url(page_url, href)
+        try:
+            css = fetch_page(stylesheet_url).decode('utf-8', 'replace')
+        except Exception as ex:
+            logging.warning('Unable to fetch stylesheet=%s. Error=%s',
+                            stylesheet_url, ex)
+            continue
+        for url in css_urls(css):
+            if url.startswith('data:image/'):
+                image_urls.append(url)
+            elif has_extension(url, file_extensions):
+                # Urls in stylesheet are relative to the stylesheet.
+                image_urls.append(resolve_url(stylesheet_url, url))
+    return image_urls
+
+
+def extract_from_chunks(chunks, max_images=None, file_extensions=None,
+                        extractors=None, target_dpr=None, clock=None):
+    """
+    This function parses an HTML document given in chunks and collects the
+    links to images in it.
+    :param chunks: iterable of bytes of HTML document.
+    :param max_images: stop after this many images are found (default=None).
+    :param file_extensions: extensions of hyperlinks referring to images.
+    :param extractors: names of extractors used (default=
+    DEFAULT_EXTRACTORS).
+    :param target_dpr: device pixel ratio for selecting srcset candidates.
+    :param clock: PageClock timing the parsing of document (see metrics.py).
+    :return: ImageLinkCollector object.
+    """
+    collector = ImageLinkCollector(max_images=max_images,
+                                   file_extensions=file_extensions,
+                                   extractors=extractors,
+                                   target_dpr=target_dpr)
+    parser = etree.HTMLParser(target=collector)
+    parsing = clock.parsing if clock is not None else NULL_TIMER
+    try:
+        for chunk in chunks:
+            with parsing:
+                parser.feed(chunk)
+        with parsing:
+            parser.close()
+    except StopExtraction:
+        logging.debug('Extraction stopped after %s images', collector.count)
+    except etree.XMLSyntaxError as ex:
+        # Empty or badly broken document. Keep whatever was collected.
+        logging.warning('Unable to parse document completely. Error=%s', ex)
+    return collector
+
+
+def extract_from_url(url, max_images=None, file_extensions=None,
+                     extractors=None, target_dpr=None):
+    """
+    This function fetches a web page and collects the links to images in it
+    while the page is being received.
+    :param url: url of web page.
+    :param max_images: stop after this many images are found (default=None).
+    :param file_extensions: extensions of hyperlinks referring to images.
+    :param extractors: names of extractors used (default=
+    DEFAULT_EXTRACTORS).
+    :param target_dpr: device pixel ratio for selecting srcset candidates.
+    :return: ImageLinkCollector object.
+    """
+    chunks = iter_page(url)
+    clock = PageClock(url)
+    try:
+        return extract_from_chunks(clock.wrap(chunks), max_images=max_images,
+                                   file_extensions=file_extensions,
+                                   extractors=extractors,
+                                   target_dpr=target_dpr, clock=clock)
+    finally:
+        chunks.close()
+        clock.observe()
+
+
+def iter_extract_from_url(url, file_extensions=None, extractors=None,
+                          target_dpr=None):
+    """
+    This function fetches a web page and yields the links found in it while
+    the page is being received, i.e. after each chunk of page is parsed.
+    :param url: url of web page.
+    :param file_extensions: extensions of hyperlinks referring to images.
+    :param extractors: names of extractors used (default=
+    DEFAULT_EXTRACTORS).
+    :param target_dpr: device pixel ratio for selecting srcset candidates.
+    :return: generator of tuples (collector, new links) where new links are
+    as returned by ImageLinkCollector.take_new. The collector gives e.g. the
+    <base href> of page found so far.
+    """
+    collector = ImageLinkCollector(file_extensions=file_extensions,
+                                   extractors=extractors,
+                                   target_dpr=target_dpr)
+    parser = etree.HTMLParser(target=collector)
+    chunks = iter_page(url)
+    clock = PageClock(url)
+    try:
+        for chunk in clock.wrap(chunks):
+            with clock.parsing:
+                parser.feed(chunk)
+            links = collector.take_new()
+            if links:
+                yield collector, links
+        with clock.parsing:
+            parser.close()
+    except etree.XMLSyntaxError as ex:
+        # Empty or badly broken document. Keep whatever was collected.
+        logging.warning('Unable to parse document completely. Error=%s', ex)
+    finally:
+        chunks.close()
+        clock.observe()
+    links = collector.take_new()
+    if links:
+        yield collector, links
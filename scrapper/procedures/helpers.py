@@ -5,7 +5,24 @@ This package contains helper functions to be used in the project.
 import re
 import os
 import sys
+import hashlib
 import logging
+import binascii
+import threading
+from scrapper.exceptions import DownloadLimitExceeded, DownloadError
+from .urls import absolute_url
+from .naming import url_filename, temporary_file, commit_file
+from .metrics import DATA_URI_DECODE_SECONDS, count_failure
+
+try:
+    # Python 3
+    from urllib.parse import unquote_to_bytes
+except ImportError:
+    # Python 2
+    from urllib import unquote as unquote_to_bytes
+
+# Whitespace allowed in base64 data of data uris.
+WHITESPACE_RE = re.compile(br'\s')
 
 
 def install_package(package_name):
@@ -21,39 +38,68 @@ def install_package(package_name):
         have root privileges to install the package.
         '''
         if not hasattr(sys, 'real_prefix') and os.getuid() != 0:
-            logging.warning("Unable to install {pkg} because user is not "
-                            "running python in virtual environment, neither "
-                            "it has root privileges".format(pkg=package_name))
+            logging.warning('Unable to install %s because user is not '
+                            'running python in virtual environment, neither '
+                            'it has root privileges', package_name)
             return False
-        logging.info('Installing {pkg} using pip.'.format(pkg=package_name))
+        logging.info('Installing %s using pip.', package_name)
         pip.main(['install', package_name])
         return True
     except ImportError:
-        logging.error('Unable to import PIP for installing package={'
-                      'pkg}'.format(pkg=package_name))
+        logging.error('Unable to import PIP for installing package=%s',
+                      package_name)
         return False
     except Exception as ex:
-        logging.error("Error {err} during installing {pkg} using "
-                      "pip.".format(err=str(ex), pkg=package_name))
+        logging.error('Error %s during installing %s using pip.', str(ex),
+                      package_name)
         return False
 
 
+def image_extensions(file_extensions):
+    """
+    Returns given file extensions as a lowercase tuple, for matching links
+    with str.endswith.
+    """
+    if isinstance(file_extensions, tuple):
+        return file_extensions
+    return tuple(ext.lower() for ext in file_extensions or ())
+
+
+def has_extension(link, file_extensions):
+    """
+    Checks whether path of given link ends with one of file extensions. Query
+    string and fragment are ignored and the comparison is case insensitive
+    e.g. 'a/IMG.JPG?w=100' has extension '.jpg'.
+    :param link: url or path.
+    :param file_extensions: extensions, preferably as returned by
+    image_extensions.
+    :return: True/False
+    """
+    path = link.split('#', 1)[0].split('?', 1)[0].lower()
+    return path.endswith(image_extensions(file_extensions))
+
+
 def process_links(hyperlinks, file_extensions=None):
     """
     This function processes a list of hyperlinks retrieved from the webpage
     and returns the list of links which refer to an image resource. The links
-    are filtered by matching the file extensions of basename in that link.
+    are filtered by matching the file extensions of path in that link, in a
+    single pass over the links.
     :param hyperlinks: List of hyperlinks (i.e. @href in <a>) retrieved from
     webpage
     :param file_extensions: Extensions of files we are searching for in links.
-    :return: List of hyperlinks which refer to an image resource.
+    :return: List of unique hyperlinks which refer to an image resource, in
+    the order they are given.
     """
+    extensions = image_extensions(file_extensions)
+    if not extensions:
+        return []
     img_links = []
+    seen = set()
     for link in hyperlinks:
-        # Look thorough all extensions if links satisfies any media resource.
-        for ext in file_extensions:
-            if link[-len(ext):] == ext:
-                img_links.append(link)
+        if link not in seen and has_extension(link, extensions):
+            img_links.append(link)
+        seen.add(link)
     return img_links
 
 
@@ -65,21 +111,17 @@ def save_from_relative_to_root(base_url, img_url):
     :param img_url: name of image file.
     :return:
     """
-    import requests
-    from posixpath import dirname
-    filename = get_filename(dirname(img_url) or 'unknown.jpg')
+    # Resolve against parent folder i.e. base_url with a trailing slash.
+    img_src = absolute_url(base_url.rstrip('/') + '/', img_url)
+    filename = url_filename(img_src)
     try:
-        f = open(filename, "wb+")
-        logging.debug('Downloaded img={img_name} from url={path}'
-                      ''.format(img_name=img_url, path=base_url+'/'+img_url))
-        f.write(requests.request('get', base_url+'/'+img_url).content)
-        logging.info('Image={img_name} downloaded from url={path} and stored '
-                     'to disk'.format(img_name=img_url,
-                                      path=base_url+'/'+img_url))
-        f.close()
+        logging.debug('Downloaded img=%s from url=%s', img_url, img_src)
+        fetch_to_file(img_src, filename)
+        logging.info('Image=%s downloaded from url=%s and stored to disk',
+                     img_url, img_src)
     except Exception as ex:
-        logging.error("Unable to download and store images from url={url}. "
-                      "Error={err}".format(url=base_url+'/'+img_url, err=ex))
+        logging.error('Unable to download and store images from url=%s. '
+                      'Error=%s', img_src, ex)
 
 
 def save_image_from_link(img_url):
@@ -89,48 +131,118 @@ def save_image_from_link(img_url):
     :param img_url: url for image to be extracted.
     :return:
     """
-    import requests
-    from posixpath import dirname
-    if not img_url.startswith('http'):
-        img_url = 'https:' + img_url
-    logging.debug('Downloading image from url={url}}'.format(url=img_url))
-    filename = get_filename(dirname(img_url.split('?')[0]) or 'unknown.jpg')
+    # Protocol relative urls i.e. //host/path are fetched using https.
+    img_url = absolute_url('https:', img_url)
+    logging.debug('Downloading image from url=%s', img_url)
+    filename = url_filename(img_url)
     try:
-        f = open(filename, "wb+")
-        f.write(requests.request('get', img_url).content)
-        logging.info('Image={img} downloaded from url={url} and saved to '
-                     'disk'.format(img=filename, url=img_url))
-        f.close()
+        fetch_to_file(img_url, filename)
+        logging.info('Image=%s downloaded from url=%s and saved to disk',
+                     filename, img_url)
     except Exception as ex:
-        logging.error("Unable to download and store images from url={url}. "
-                      "Error={err}".format(url=img_url, err=ex))
+        logging.error('Unable to download and store images from url=%s. '
+                      'Error=%s', img_url, ex)
 
 
-def save_image_from_uri(uri):
+def save_image_from_uri(uri, dest_dir='.', max_bytes=None, budget=None,
+                        chunk_size=None):
     """
     This functions convert base64 encoded uri to an <img> tag in HTML page
-    and saves it in current working directory.
+    and saves it in given directory. The uri is decoded in chunks written
+    directly to the file, and the file is named after the hash of its content
+    so identical images are stored once.
     :param uri: url for image to be extracted.
-    :return:
+    :param dest_dir: directory where image is stored (default=current working
+    directory).
+    :param max_bytes: maximum decoded size of image in bytes (default=
+    MAX_IMAGE_BYTES in application config), checked before decoding.
+    :param budget: ByteBudget limiting total bytes stored for the job.
+    :param chunk_size: size of decoded chunks (default=DOWNLOAD_CHUNK_SIZE in
+    application config).
+    :return: filename of stored image (None if image could not be stored).
     """
-    import base64
-    if not uri.startswith('data:image'):
-        logging.info('Invalid uri for extracting image uri={in_uri}'.format(
-            in_uri=uri))
+    from flask import current_app, has_app_context
+    comma = uri.find(',')
+    if not uri.startswith('data:image') or comma < 0:
+        logging.info('Invalid uri for extracting image uri=%s', uri[:64])
         return
-    # Get file extension and encoding scheme from URI.
-    extension = uri.split(';')[0].split('/')[1]
-    filename = get_filename('uri-image.' + extension)
-    # Get file to the disk.
+    if has_app_context():
+        if max_bytes is None:
+            max_bytes = current_app.config.get('MAX_IMAGE_BYTES')
+        if chunk_size is None:
+            chunk_size = current_app.config.get('DOWNLOAD_CHUNK_SIZE')
+    # Get file extension and encoding scheme from URI e.g. image/png;base64
+    header = uri[5:comma].lower()
+    is_base64 = header.endswith(';base64')
+    extension = header.split(';')[0].split('/')[-1].split('+')[0] or 'img'
+    # Upper bound of decoded size, known without decoding.
+    payload_size = len(uri) - comma - 1
+    if is_base64:
+        size = payload_size * 3 // 4 - uri[-2:].count('=')
+    else:
+        size = payload_size
+    tmp_filename = None
+    consumed = 0
     try:
-        f = open(filename, 'wb+')
-        f.write(base64.b64decode(str(uri.split(",")[1])))
-        logging.info('Image={img} extracted using data-uri'
-                     ''.format(img=filename))
-        f.close()
+        if max_bytes is not None and size > max_bytes:
+            raise DownloadLimitExceeded(
+                'Data uri of {size} bytes exceeds image limit of {limit} '
+                'bytes'.format(size=size, limit=max_bytes))
+        if budget is not None:
+            budget.consume(size)
+            consumed = size
+        digest = hashlib.sha1()
+        written = 0
+        tmp_filename = temporary_file(os.path.join(dest_dir, 'uri-image'))
+        with DATA_URI_DECODE_SECONDS.time(), open(tmp_filename, 'wb') as f:
+            for chunk in decode_data_uri(uri, comma + 1, is_base64,
+                                         chunk_size or 64 * 1024):
+                digest.update(chunk)
+                f.write(chunk)
+                written += len(chunk)
+        if not written:
+            raise ValueError('Data uri has no image data')
+        filename = os.path.join(dest_dir, 'uri-{digest}.{ext}'.format(
+            digest=digest.hexdigest()[:16], ext=extension))
+        if os.path.exists(filename):
+            # Same image is stored already.
+            os.remove(tmp_filename)
+        else:
+            commit_file(tmp_filename, filename)
+        logging.info('Image=%s extracted using data-uri', filename)
+        return filename
     except Exception as ex:
-        logging.error("Unable to download and store images from data-uri."
-                      "Error={err}".format(err=ex))
+        if tmp_filename is not None and os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        if consumed:
+            budget.release(consumed)
+        logging.error('Unable to download and store images from '
+                      'data-uri.Error=%s', ex)
+        count_failure(None, ex)
+
+
+def decode_data_uri(uri, start, is_base64, chunk_size=64 * 1024):
+    """
+    This function decodes the data of a data uri in chunks. Base64 data is
+    decoded from a memoryview of the uri, so the data is not copied before
+    decoding.
+    :param uri: data uri.
+    :param start: position of data in uri i.e. after ','.
+    :param is_base64: data is base64 encoded, otherwise percent encoded.
+    :param chunk_size: approximate size of decoded chunks.
+    :return: generator of bytes.
+    """
+    if not is_base64:
+        yield unquote_to_bytes(uri[start:])
+        return
+    data = uri.encode('ascii') if not isinstance(uri, bytes) else uri
+    if WHITESPACE_RE.search(data, start):
+        # Chunks must be whole groups of 4 characters.
+        data, start = b''.join(data[start:].split()), 0
+    view = memoryview(data)
+    step = max(1, chunk_size // 3) * 4
+    for pos in range(start, len(data), step):
+        yield binascii.a2b_base64(view[pos:pos + step])
 
 
 def save_image_from_relative_path(base_url, image_url):
@@ -141,46 +253,137 @@ def save_image_from_relative_path(base_url, image_url):
     :param image_url: path for image relative to root path
     :return:
     """
-    import requests
-    from posixpath import dirname
+    img_src = absolute_url(base_url, image_url)
     # Extract filename i.e image name.
-    img_src = os.path.join(os.path.dirname(base_url), image_url)
-    filename = get_filename(dirname(image_url))
+    filename = url_filename(img_src)
     # Save file to disk.
     try:
-        f = open(filename, "wb+")
-        f.write(requests.request('get', img_src).content)
-        logging.info('Image={img} downloaded from url={img_url} and saved to '
-                     'disk'.format(img=filename, img_url=img_src))
-        f.close()
+        fetch_to_file(img_src, filename)
+        logging.info('Image=%s downloaded from url=%s and saved to disk',
+                     filename, img_src)
     except Exception as ex:
-        logging.error("Unable to download and store images from url={url}."
-                      "Error={err}".format(url=img_src, err=ex))
-
-
-def get_filename(fq_filepath):
-    """
-    This function adds a numerical increment to the filename in case the file
-    exists already in the disk.
-    :param fq_filepath: fully qualified filepath i.e.
-    folder/sub_folder/filename.extension
-    :return: fq_filepath (with incremented path if similar filepath already
-    exists) e.g. folder/sub_folder/filename(1).extension
-    """
-    import os
-    filename = fq_filepath.split('/')[-1]
-    if os.path.exists(fq_filepath):
-        counter = 1
-        logging.info('Finding incremented filepath for '
-                     '{fp}'.format(fp=fq_filepath))
-        while os.path.exists(fq_filepath):
-            # Get incremented file number
-            i_fn = '.'.join(filename.split('.')[:-1])\
-                   + ' (%s).' % counter\
-                   + filename.split('.')[-1]
-            fq_filepath = os.path.join('/'.join(fq_filepath.split('/')[:-1]),
-                                       i_fn)
-            counter += 1
-        logging.info('Incremented filepath={ifp} for given existing '
-                     'filepath'.format(ifp=fq_filepath))
-    return fq_filepath
+        logging.error('Unable to download and store images from '
+                      'url=%s.Error=%s', img_src, ex)
+
+
+class ByteBudget(object):
+    """
+    Number of bytes which may still be downloaded for a job. The budget is
+    shared by all threads downloading images for the same job.
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def check(self, nbytes):
+        """
+        Raises DownloadLimitExceeded if nbytes more bytes do not fit in the
+        budget, without consuming them.
+        """
+        if self.max_bytes is not None and \
+                self.used + nbytes > self.max_bytes:
+            raise DownloadLimitExceeded(
+                'Download of {n} bytes exceeds job limit of {limit} '
+                'bytes'.format(n=nbytes, limit=self.max_bytes))
+
+    def consume(self, nbytes):
+        """
+        Consumes nbytes from the budget.
+        :raises DownloadLimitExceeded: if budget is exhausted.
+        """
+        with self._lock:
+            self.check(nbytes)
+            self.used += nbytes
+
+    def release(self, nbytes):
+        """
+        Gives back nbytes consumed by a download which was abandoned, so the
+        discarded bytes do not count against the job.
+        """
+        with self._lock:
+            self.used = max(0, self.used - nbytes)
+
+
+def fetch_to_file(url, filename, max_bytes=None, budget=None,
+                  chunk_size=None):
+    """
+    This function downloads the resource at given url and streams it to a file
+    in fixed size chunks, so the body is never held in memory as a whole. The
+    file is not created if the download fails or exceeds the allowed size.
+    :param url: url for the resource.
+    :param filename: file where the resource is stored.
+    :param max_bytes: maximum size of resource in bytes (default=
+    MAX_IMAGE_BYTES in application config).
+    :param budget: ByteBudget shared by downloads of the same job.
+    :param chunk_size: size of chunks written to file (default=
+    DOWNLOAD_CHUNK_SIZE in application config).
+    :return: number of bytes written to file.
+    """
+    from .http_session import get_session
+    return stream_response_to_file(get_session().get(url, stream=True),
+                                   filename, max_bytes=max_bytes,
+                                   budget=budget, chunk_size=chunk_size)
+
+
+def stream_response_to_file(response, filename, max_bytes=None, budget=None,
+                            chunk_size=None):
+    """
+    This function streams the body of a response (requested with stream=True)
+    to a file and closes the response. The body is written to a temporary
+    file which is renamed to given filename once complete, so the file is
+    never seen partly written. See fetch_to_file for parameters.
+    :param response: requests.Response object.
+    :return: number of bytes written to file.
+    :raises DownloadError: if response status is not 2xx, nothing is written.
+    """
+    from flask import current_app, has_app_context
+    if has_app_context():
+        if max_bytes is None:
+            max_bytes = current_app.config.get('MAX_IMAGE_BYTES')
+        if chunk_size is None:
+            chunk_size = current_app.config.get('DOWNLOAD_CHUNK_SIZE')
+    chunk_size = chunk_size or 64 * 1024
+    url = response.url
+    written = 0
+    consumed = 0
+    tmp_filename = None
+    try:
+        if not 200 <= response.status_code < 300:
+            # Error pages must not be stored as images.
+            raise DownloadError(
+                'Download from url={url} failed with status={status}'.format(
+                    url=url, status=response.status_code))
+        content_length = response.headers.get('Content-Length', '')
+        if content_length.isdigit():
+            if max_bytes is not None and int(content_length) > max_bytes:
+                raise DownloadLimitExceeded(
+                    'Content-Length={length} of url={url} exceeds image '
+                    'limit of {limit} bytes'.format(
+                        length=content_length, url=url, limit=max_bytes))
+            if budget is not None:
+                budget.check(int(content_length))
+        tmp_filename = temporary_file(filename)
+        with open(tmp_filename, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                written += len(chunk)
+                if max_bytes is not None and written > max_bytes:
+                    raise DownloadLimitExceeded(
+                        'Download from url={url} exceeds image limit of '
+                        '{limit} bytes'.format(url=url, limit=max_bytes))
+                if budget is not None:
+                    budget.consume(len(chunk))
+                    consumed += len(chunk)
+                f.write(chunk)
+        commit_file(tmp_filename, filename)
+    except Exception:
+        if tmp_filename is not None and os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        if consumed:
+            budget.release(consumed)
+        raise
+    finally:
+        response.close()
+    return written
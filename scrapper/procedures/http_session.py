@@ -0,0 +1,89 @@
+"""
+This module provides the HTTP session shared by all network operations of the
+application i.e. fetching web pages and downloading images. Connections are
+pooled per host and kept alive between requests, every request has a connect
+and read timeout and failed requests are retried with an exponential backoff.
+"""
+
+import logging
+from flask import current_app, has_app_context
+from .helpers import install_package
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3.util.retry import Retry
+except ImportError:
+    install_package('requests')
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3.util.retry import Retry
+
+
+class ScrapperSession(requests.Session):
+    """
+    requests.Session applying default timeout to every request which is not
+    given an explicit timeout.
+    """
+    def __init__(self, timeout=None):
+        super(ScrapperSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(ScrapperSession, self).request(method, url, **kwargs)
+
+
+def create_session(config):
+    """
+    Creates an HTTP session configured using given application config.
+    :param config: Application configuration.
+    :return: ScrapperSession object.
+    """
+    session = ScrapperSession(timeout=(config.get('HTTP_CONNECT_TIMEOUT', 5),
+                                       config.get('HTTP_READ_TIMEOUT', 30)))
+    retries = Retry(total=config.get('HTTP_RETRIES', 3),
+                    backoff_factor=config.get('HTTP_RETRY_BACKOFF', 0.5),
+                    status_forcelist=(500, 502, 503, 504),
+                    raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=config.get('HTTP_POOL_HOSTS', 10),
+                          pool_maxsize=config.get('HTTP_POOL_PER_HOST', 4),
+                          max_retries=retries)
+    if config.get('USER_AGENT'):
+        session.headers['User-Agent'] = config['USER_AGENT']
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class HTTPSessionManager(object):
+    """
+    Flask extension creating one pooled HTTP session per application.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['http_session'] = create_session(app.config)
+        logging.debug('HTTP session created with connect/read timeout=%s',
+                      app.extensions['http_session'].timeout)
+
+
+# Session used when no application context is available.
+_default_session = None
+
+
+def get_session():
+    """
+    Returns the HTTP session for current application. Outside of an
+    application context a session with default configuration is returned.
+    :return: ScrapperSession object.
+    """
+    global _default_session
+    if has_app_context() and 'http_session' in current_app.extensions:
+        return current_app.extensions['http_session']
+    if _default_session is None:
+        _default_session = create_session({})
+    return _default_session
@@ -0,0 +1,291 @@
+"""
+This module implements a content-addressed store for downloaded images, so
+images loaded by several web pages (logos, sprites, avatars etc.) are
+downloaded only once. Each image is stored once per distinct content, under
+the SHA-256 hash of its bytes, and urls are mapped to the hash of the image
+they returned. The store is bounded in size and least recently used images
+are evicted first. The url to hash map is saved next to the images, so cached
+images are reused after a restart.
+"""
+
+import os
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from .naming import write_file
+
+INDEX_FILENAME = 'index.json'
+
+
+def file_digest(filename, chunk_size=64 * 1024):
+    """
+    Computes SHA-256 hash of contents of given file.
+    :param filename: path of file.
+    :param chunk_size: size of chunks read from file.
+    :return: hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """
+    Makes file at src available at path dst, replacing dst if it exists. A
+    hardlink is used when possible, otherwise the file is copied.
+    :param src: existing file.
+    :param dst: path where file is made available.
+    """
+    tmp = '{dst}.{tid}.tmp'.format(dst=dst,
+                                   tid=threading.current_thread().ident)
+    try:
+        os.link(src, tmp)
+    except (OSError, AttributeError):
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ImageCache(object):
+    """
+    Size bounded content-addressed store of images kept in a directory.
+    Images are stored as <root>/<first two chars of hash>/<hash> and the urls
+    of images in <root>/index.json, saved at most every save_interval seconds
+    and when the process exits.
+    """
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, save_interval=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self._blobs = OrderedDict()     # hash -> size, in LRU order
+        self._urls = {}                 # url -> hash
+        self._blob_urls = {}            # hash -> set of urls
+        self._size = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._changed = False
+        self._saved_at = time.time()
+        self._load()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root, INDEX_FILENAME)
+
+    def _load_index(self):
+        """
+        Returns the url to hash map saved by previous runs, empty if there is
+        none or it cannot be read.
+        """
+        try:
+            with open(self.index_path) as f:
+                urls = json.load(f)
+        except (IOError, OSError, ValueError) as ex:
+            if os.path.exists(self.index_path):
+                logging.warning('Unable to read image cache index=%s. '
+                                'Error=%s', self.index_path, ex)
+            return {}
+        return urls if isinstance(urls, dict) else {}
+
+    def _load(self):
+        """
+        Registers images left in the store by previous runs, oldest first,
+        with their urls saved in the index. Images of no known url can not be
+        found again, so they are removed.
+        """
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        urls = self._load_index()
+        digests = set(urls.values())
+        blobs = []
+        for root, dirs, files in os.walk(self.root):
+            if root == self.root:
+                # Only the index is kept outside of hash directories, remove
+                # index files left half written.
+                for name in files:
+                    if name.endswith('.part'):
+                        os.remove(os.path.join(root, name))
+                continue
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith('.tmp') or name not in digests:
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                blobs.append((stat.st_mtime, name, stat.st_size))
+        for mtime, digest, size in sorted(blobs):
+            self._blobs[digest] = size
+            self._size += size
+        for url, digest in urls.items():
+            if digest in self._blobs:
+                self._urls[url] = digest
+                self._blob_urls.setdefault(digest, set()).add(url)
+        logging.info('%s images (%s bytes) of %s urls loaded in image '
+                     'cache=%s', len(self._blobs), self._size,
+                     len(self._urls), self.root)
+        self._evict()
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def __contains__(self, url):
+        with self._lock:
+            return self._urls.get(url) in self._blobs
+
+    def lookup(self, url):
+        """
+        Returns the path of cached image for given url.
+        :param url: url of image.
+        :return: path of cached image, None if url is not cached.
+        """
+        with self._lock:
+            digest = self._urls.get(url)
+            if digest is None or digest not in self._blobs:
+                return None
+            self._blobs.move_to_end(digest)
+            self.hits += 1
+            return self.blob_path(digest)
+
+    def store(self, url, filename):
+        """
+        Adds image downloaded from url to the store. The image file is
+        hardlinked into the store, so no copy is made when possible.
+        :param url: url from which image was downloaded.
+        :param filename: file containing the image.
+        :return: hash of image content.
+        """
+        digest = file_digest(filename)
+        path = self.blob_path(digest)
+        with self._lock:
+            # Image had to be downloaded, so it was not served from cache.
+            self.misses += 1
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+            else:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                link_or_copy(filename, path)
+                size = os.path.getsize(path)
+                self._blobs[digest] = size
+                self._size += size
+            self._urls[url] = digest
+            self._blob_urls.setdefault(digest, set()).add(url)
+            self._changed = True
+            self._evict()
+            due = self.save_interval is not None and \
+                time.time() - self._saved_at >= self.save_interval
+        if due:
+            self.save()
+        return digest
+
+    def save(self):
+        """
+        Atomically writes the url to hash map to the index, if it changed
+        since last save.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._changed:
+                    return
+                urls = dict(self._urls)
+                self._changed = False
+                self._saved_at = time.time()
+            try:
+                write_file(self.index_path,
+                           json.dumps(urls, sort_keys=True).encode('utf-8'))
+            except (IOError, OSError) as ex:
+                logging.warning('Unable to save image cache index=%s. '
+                                'Error=%s', self.index_path, ex)
+                with self._lock:
+                    self._changed = True
+
+    def copy_to(self, url, filename):
+        """
+        Makes cached image of given url available at filename.
+        :param url: url of image.
+        :param filename: path where image is made available.
+        :return: True if image was cached, False otherwise.
+        """
+        path = self.lookup(url)
+        if path is None:
+            return False
+        try:
+            link_or_copy(path, filename)
+            return True
+        except (IOError, OSError) as ex:
+            # Image evicted in the meanwhile.
+            logging.warning('Unable to reuse cached image for url=%s. '
+                            'Error=%s', url, ex)
+            return False
+
+    def _evict(self):
+        """
+        Removes least recently used images until store fits in max_bytes.
+        Must be called holding the lock.
+        """
+        while self.max_bytes is not None and self._size > self.max_bytes \
+                and self._blobs:
+            digest, size = self._blobs.popitem(last=False)
+            self._size -= size
+            for url in self._blob_urls.pop(digest, ()):
+                self._urls.pop(url, None)
+            self._changed = True
+            try:
+                os.remove(self.blob_path(digest))
+            except OSError:
+                pass
+            logging.debug('Image=%s evicted from image cache', digest)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'images': len(self._blobs),
+                'urls': len(self._urls),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class ImageCacheManager(object):
+    """
+    Flask extension creating the image cache of an application, if enabled
+    with IMAGE_CACHE_ENABLED. Cached images are reused only while their
+    revalidation entry is fresh, so the cache needs REVALIDATION_ENABLED.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache = None
+        if app.config.get('IMAGE_CACHE_ENABLED') and \
+                not app.config.get('REVALIDATION_ENABLED'):
+            logging.warning('Image cache is disabled, because it needs '
+                            'REVALIDATION_ENABLED')
+        elif app.config.get('IMAGE_CACHE_ENABLED'):
+            cache = ImageCache(
+                os.path.join(app.config['APP_WD'], app.config['FILES_DIR'],
+                             app.config['IMAGE_CACHE_DIR']),
+                max_bytes=app.config.get('IMAGE_CACHE_MAX_BYTES'),
+                save_interval=app.config.get('IMAGE_CACHE_SAVE_INTERVAL', 60))
+            atexit.register(cache.save)
+        app.extensions['image_cache'] = cache
+
+
+def get_image_cache():
+    """
+    Returns image cache of current application, None if it is disabled.
+    """
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('image_cache')
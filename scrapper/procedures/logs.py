@@ -0,0 +1,197 @@
+"""
+This module sets up logging of the application off the request threads.
+Loggers only put records on a queue, and a background thread formats them and
+writes them to the console and to log files, so neither formatting nor disk
+writes add to the time spent by requests and jobs. Log files contain one JSON
+object per record, including the id of request or job which logged it.
+"""
+
+import os
+import json
+import queue
+import uuid
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class LogContext(threading.local):
+    """
+    Ids of the request and job handled by current thread, added to records
+    logged by it.
+    """
+    request_id = None
+    job_id = None
+
+    def get(self):
+        return {'request_id': self.request_id, 'job_id': self.job_id}
+
+    @contextmanager
+    def bind(self, **ids):
+        """
+        Sets given ids (request_id and/or job_id) while in the context, e.g.
+        in the worker threads of a request or job.
+        """
+        previous = self.get()
+        for name, value in ids.items():
+            setattr(self, name, value)
+        try:
+            yield self
+        finally:
+            for name, value in previous.items():
+                setattr(self, name, value)
+
+
+log_context = LogContext()
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds the ids of current request and job to records. Runs in the thread
+    logging the record.
+    """
+    def filter(self, record):
+        record.request_id = log_context.request_id
+        record.job_id = log_context.job_id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single line JSON objects.
+    """
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'job_id': getattr(record, 'job_id', None),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler leaving the formatting of records to the listener thread.
+    Messages are merged with their arguments only when written, so arguments
+    should not be modified after logging them.
+    """
+    def __init__(self, log_queue):
+        QueueHandler.__init__(self, log_queue)
+        self.addFilter(ContextFilter())
+        self.listener = None
+
+    def prepare(self, record):
+        return record
+
+    def stop_listener(self):
+        """
+        Writes the records left in the queue and closes the handlers.
+        """
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Drop the record instead of blocking the logging thread.
+            pass
+
+
+class LogListener(QueueListener):
+    """
+    QueueListener waiting for room in a bounded queue when stopped, so the
+    records already in the queue are written before it stops.
+    """
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class LogManager(object):
+    """
+    Flask extension routing the logs of an application through a queue.
+    Records of all loggers reach the queue handler on the root logger, and
+    a listener thread passes them to the console and file handlers.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        root = logging.getLogger()
+        # Replace the handler of a previously created application.
+        for handler in list(root.handlers):
+            if isinstance(handler, DeferredQueueHandler):
+                root.removeHandler(handler)
+                atexit.unregister(handler.stop_listener)
+                handler.stop_listener()
+        root.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+
+        handler = DeferredQueueHandler(
+            queue.Queue(app.config.get('LOG_QUEUE_SIZE', 0)))
+        handler.listener = LogListener(
+            handler.queue, *self.create_handlers(app.config),
+            respect_handler_level=True)
+        handler.listener.start()
+        atexit.register(handler.stop_listener)
+        root.addHandler(handler)
+        app.extensions['log_queue'] = handler
+
+        app.before_request(self.start_request)
+        app.after_request(self.add_request_id)
+        app.teardown_request(self.end_request)
+
+    @staticmethod
+    def create_handlers(config):
+        """
+        Creates the handlers writing records taken from the queue i.e. a
+        console handler, and a rotating JSON file handler for each logger
+        in LOG_FILES.
+        :param config: Application configuration.
+        :return: list of handlers.
+        """
+        console = logging.StreamHandler()
+        console.setLevel(config.get('LOG_CONSOLE_LEVEL', 'INFO'))
+        console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers = [console]
+
+        log_dir = config.get('LOG_DIR', 'logs/')
+        if config.get('LOG_FILES'):
+            os.makedirs(log_dir, exist_ok=True)
+        for name, filename in config.get('LOG_FILES', {}).items():
+            file_handler = RotatingFileHandler(
+                os.path.join(log_dir, filename),
+                maxBytes=config.get('LOG_FILE_MAX_BYTES', 1000000),
+                backupCount=config.get('LOG_FILE_BACKUPS', 5))
+            file_handler.setFormatter(JsonFormatter())
+            # Only records of given logger (and its children) go to its file.
+            file_handler.addFilter(logging.Filter(name))
+            handlers.append(file_handler)
+        return handlers
+
+    @staticmethod
+    def start_request():
+        log_context.request_id = request.headers.get(REQUEST_ID_HEADER) or \
+            uuid.uuid4().hex
+
+    @staticmethod
+    def add_request_id(response):
+        if log_context.request_id is not None:
+            response.headers[REQUEST_ID_HEADER] = log_context.request_id
+        return response
+
+    @staticmethod
+    def end_request(exc=None):
+        log_context.request_id = None
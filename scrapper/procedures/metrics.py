@@ -0,0 +1,335 @@
+"""
+This module collects metrics of scrapping i.e. latency of its stages (fetching
+and parsing pages, processing urls, downloading images, decoding data uris and
+zipping images) and counters of downloaded bytes, failures, cache hits and
+active jobs, labelled by target host. Metrics are served at /metrics in the
+Prometheus text exposition format. While metrics are disabled, recording a
+metric returns immediately and timers do not read the clock.
+"""
+
+import time
+import bisect
+import threading
+
+try:
+    # Python 3
+    from urllib.parse import urlsplit
+except ImportError:
+    # Python 2
+    from urlparse import urlsplit
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Upper bounds (in seconds) of histogram buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+
+class MetricsRegistry(object):
+    """
+    Metrics of the application process.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {name} {description}'.format(
+                name=metric.name, description=metric.description))
+            lines.append('# TYPE {name} {type}'.format(name=metric.name,
+                                                       type=metric.type))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def metrics_enabled():
+    return REGISTRY.enabled
+
+
+def url_host(url):
+    """
+    Returns the host of given url used as label of metrics, '' for urls
+    without a host e.g. data uris.
+    """
+    return urlsplit(url or '').netloc.lower()
+
+
+def format_labels(names, values, extra=''):
+    labels = ['{name}="{value}"'.format(
+        name=name, value=str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Values of a metric by label values.
+    """
+    type = None
+
+    def __init__(self, name, description, labels=(), registry=REGISTRY):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.registry = registry
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return ['{name}{labels} {value}'.format(
+            name=self.name, labels=format_labels(self.labels, key),
+            value=format_value(value)) for key, value in values]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class NullTimer(object):
+    """
+    Timer used while metrics are disabled.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class HistogramTimer(object):
+    """
+    Observes the time spent in a with block.
+    """
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start,
+                               **self.labels)
+        return False
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(),
+                 buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super(Histogram, self).__init__(name, description, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [count of each bucket (and +Inf), sum, count]
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1),
+                                             0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """
+        Returns a context manager observing the time spent in it.
+        """
+        if not self.registry.enabled:
+            return NULL_TIMER
+        return HistogramTimer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1], entry[2]))
+                            for key, entry in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),),
+                                           counts):
+                cumulative += bucket_count
+                lines.append('{name}_bucket{labels} {value}'.format(
+                    name=self.name, value=cumulative,
+                    labels=format_labels(self.labels, key, 'le="{le}"'.format(
+                        le=format_value(bound)))))
+            lines.append('{name}_sum{labels} {value}'.format(
+                name=self.name, labels=format_labels(self.labels, key),
+                value=format_value(total)))
+            lines.append('{name}_count{labels} {value}'.format(
+                name=self.name, labels=format_labels(self.labels, key),
+                value=count))
+        return lines
+
+
+class PageClock(object):
+    """
+    Splits the time taken by a page fetched and parsed in chunks into the time
+    spent waiting for chunks and the time spent parsing them, and observes
+    both once the page is done.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.enabled = REGISTRY.enabled
+        self.fetching = 0.0
+        self.parsing = StageTimer() if self.enabled else NULL_TIMER
+
+    def wrap(self, chunks):
+        """
+        Returns given chunks of page, timing the wait for each chunk.
+        """
+        if not self.enabled:
+            return chunks
+        return self._timed(iter(chunks))
+
+    def _timed(self, chunks):
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            self.fetching += time.perf_counter() - start
+            if chunk is None:
+                return
+            yield chunk
+
+    def observe(self):
+        if not self.enabled:
+            return
+        host = url_host(self.url)
+        PAGE_FETCH_SECONDS.observe(self.fetching, host=host)
+        HTML_PARSE_SECONDS.observe(self.parsing.elapsed, host=host)
+
+
+class StageTimer(object):
+    """
+    Sums the time spent in a with block entered several times.
+    """
+    def __init__(self):
+        self.elapsed = 0.0
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed += time.perf_counter() - self.start
+        return False
+
+
+PAGE_FETCH_SECONDS = Histogram(
+    'scrapper_page_fetch_seconds',
+    'Time spent receiving web pages.', ['host'])
+HTML_PARSE_SECONDS = Histogram(
+    'scrapper_html_parse_seconds',
+    'Time spent parsing web pages.', ['host'])
+URL_PROCESSING_SECONDS = Histogram(
+    'scrapper_url_processing_seconds',
+    'Time spent resolving and normalizing the image links of a web page.',
+    ['host'])
+IMAGE_DOWNLOAD_SECONDS = Histogram(
+    'scrapper_image_download_seconds',
+    'Time taken by downloading (or reusing) a single image.', ['host'])
+DATA_URI_DECODE_SECONDS = Histogram(
+    'scrapper_data_uri_decode_seconds',
+    'Time taken by decoding and storing an image from a data uri.')
+ZIP_CREATION_SECONDS = Histogram(
+    'scrapper_zip_creation_seconds',
+    'Time taken by zipping the images downloaded from a web page.', ['host'])
+DOWNLOADED_BYTES = Counter(
+    'scrapper_downloaded_bytes_total',
+    'Bytes of images downloaded.', ['host'])
+FAILURES = Counter(
+    'scrapper_failures_total',
+    'Failed scrapes and downloads by error class.', ['host', 'error'])
+CACHE_HITS = Counter(
+    'scrapper_cache_hits_total',
+    'Image urls and images served from cache.', ['host', 'cache'])
+ACTIVE_JOBS = Gauge(
+    'scrapper_active_jobs',
+    'Jobs running at the moment.', ['host'])
+
+
+def count_failure(url, error):
+    """
+    Counts a failure for the host of given url, by class of given error.
+    """
+    if REGISTRY.enabled:
+        FAILURES.inc(host=url_host(url), error=type(error).__name__)
+
+
+def metrics_view():
+    from flask import Response
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+class MetricsManager(object):
+    """
+    Flask extension enabling the metrics of an application and serving them
+    at /metrics.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        REGISTRY.enabled = bool(app.config.get('METRICS_ENABLED', False))
+        if REGISTRY.enabled:
+            app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'),
+                             'metrics', metrics_view)
+        app.extensions['metrics'] = REGISTRY
@@ -0,0 +1,133 @@
+"""
+This module names the files of downloaded images. The name of an image is the
+basename of its url (made safe for file systems) followed by a short hash of
+the whole url, e.g. https://a.com/x/image.jpg?w=2 -> image-3f2a9c0b1d.jpg, so
+images with the same basename get distinct names without probing the file
+system and the same url always gets the same name. Files are written to a
+temporary file and renamed into place, so concurrent writers never see
+partly written files. A manifest maps the url of each image to its file.
+"""
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    # Python 3
+    from urllib.parse import urlsplit, unquote
+except ImportError:
+    # Python 2
+    from urlparse import urlsplit
+    from urllib import unquote
+
+# Characters not kept in filenames.
+UNSAFE_CHARS_RE = re.compile(r'[^A-Za-z0-9._-]+')
+MAX_STEM_LENGTH = 64
+MAX_EXTENSION_LENGTH = 10
+URL_HASH_LENGTH = 10
+MANIFEST_NAME = 'manifest.json'
+
+
+def url_hash(url, length=URL_HASH_LENGTH):
+    """
+    Returns a short hex digest of given url.
+    """
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:length]
+
+
+def url_filename(url, default_stem='image'):
+    """
+    This function gives the filename for the resource at given url.
+    :param url: url of resource.
+    :param default_stem: name used if url path has no basename.
+    :return: filename i.e. <basename>-<hash of url><extension>
+    """
+    basename = unquote(urlsplit(url).path.rsplit('/', 1)[-1])
+    stem, extension = os.path.splitext(basename)
+    stem = UNSAFE_CHARS_RE.sub('_', stem).strip('._')[:MAX_STEM_LENGTH]
+    extension = UNSAFE_CHARS_RE.sub('', extension.lower())
+    return '{stem}-{digest}{ext}'.format(
+        stem=stem or default_stem, digest=url_hash(url),
+        ext=extension[:MAX_EXTENSION_LENGTH])
+
+
+def temporary_file(filename):
+    """
+    Creates an empty temporary file in the directory of given file, to be
+    renamed to it once written (see commit_file).
+    :param filename: final path of file.
+    :return: path of temporary file.
+    """
+    fd, tmp_filename = tempfile.mkstemp(
+        prefix='.' + os.path.basename(filename) + '.', suffix='.part',
+        dir=os.path.dirname(filename) or '.')
+    os.close(fd)
+    return tmp_filename
+
+
+def commit_file(tmp_filename, filename):
+    """
+    Atomically replaces given file with a written temporary file.
+    """
+    os.replace(tmp_filename, filename)
+
+
+def write_file(filename, data):
+    """
+    Atomically writes given data (bytes) to a file.
+    """
+    tmp_filename = temporary_file(filename)
+    try:
+        with open(tmp_filename, 'wb') as f:
+            f.write(data)
+        commit_file(tmp_filename, filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
+
+
+class Manifest(object):
+    """
+    Names of stored files by url of resource, in order of storing. Shared by
+    all threads downloading images of the same job.
+    """
+    def __init__(self):
+        self._names = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, url, filename):
+        with self._lock:
+            self._names[url] = os.path.basename(filename)
+
+    def discard(self, filenames):
+        """
+        Removes the entries of given files e.g. files removed after download.
+        """
+        names = set(os.path.basename(filename) for filename in filenames)
+        with self._lock:
+            for url in [url for url, name in self._names.items()
+                        if name in names]:
+                del self._names[url]
+
+    def __len__(self):
+        return len(self._names)
+
+    def to_dict(self):
+        with self._lock:
+            return OrderedDict(self._names)
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def write(self, directory):
+        """
+        Writes the manifest to MANIFEST_NAME file in given directory.
+        :return: filename of manifest.
+        """
+        filename = os.path.join(directory, MANIFEST_NAME)
+        write_file(filename, self.to_json().encode('utf-8'))
+        return filename
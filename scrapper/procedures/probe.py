@@ -0,0 +1,298 @@
+"""
+This module probes urls for information about the resources they refer to,
+without downloading the resources. Hyperlinks without a file extension (e.g.
+/photos/1234) are probed with HEAD requests for their content type, so links
+to images served by scripts are found as well. Images are probed for their
+type, dimensions and size by fetching only the first few KB of the image with
+a Range request and parsing the image header, so e.g. tracking pixels and
+thumbnails can be filtered out before the images are downloaded. Probes run
+concurrently on the download engine.
+"""
+
+import struct
+import base64
+import logging
+import binascii
+from functools import partial
+from flask import current_app
+from .download_engine import DownloadEngine
+from .http_session import get_session
+from .urls import is_data_uri
+
+try:
+    # Python 3
+    from urllib.parse import urlsplit
+except ImportError:
+    # Python 2
+    from urlparse import urlsplit
+
+
+def is_extensionless(link):
+    """
+    Checks whether given http(s) link has no file extension in the last
+    segment of its path.
+    """
+    parts = urlsplit(link)
+    if parts.scheme not in ('http', 'https'):
+        return False
+    return '.' not in parts.path.rsplit('/', 1)[-1]
+
+
+def head_content_type(url):
+    """
+    Returns the content type (without parameters) of given url using a HEAD
+    request, None if the request fails.
+    :param url: absolute url.
+    :return: content type e.g. 'image/png', or None.
+    """
+    response = get_session().head(url, allow_redirects=True)
+    response.close()
+    if response.status_code >= 400:
+        return None
+    return response.headers.get('Content-Type', '').split(';')[0] \
+        .strip().lower() or None
+
+
+def probe_engine(config):
+    """
+    Creates the download engine used for probing, with PROBE_WORKERS and
+    PROBE_PER_HOST_LIMIT limits.
+    """
+    return DownloadEngine(max_workers=config.get('PROBE_WORKERS', 8),
+                          per_host_limit=config.get('PROBE_PER_HOST_LIMIT', 4))
+
+
+def probe_image_links(links, max_links=None, engine=None):
+    """
+    This function finds the links referring to images among the links
+    without a file extension, by probing their content type concurrently.
+    :param links: absolute urls e.g. hyperlinks of a web page.
+    :param max_links: maximum number of links probed (default=None i.e.
+    PROBE_MAX_LINKS configuration).
+    :param engine: DownloadEngine running the probes (default=None i.e.
+    engine created with probe configuration).
+    :return: list of links whose content type is image/*.
+    """
+    config = current_app.config
+    if max_links is None:
+        max_links = config.get('PROBE_MAX_LINKS', 200)
+    candidates = []
+    seen = set()
+    for link in links:
+        if link not in seen and is_extensionless(link):
+            seen.add(link)
+            candidates.append(link)
+            if len(candidates) >= max_links:
+                break
+    if not candidates:
+        return []
+    engine = engine or probe_engine(config)
+    image_links = [result.url
+                   for result in engine.iter_download(candidates,
+                                                      head_content_type)
+                   if result.success and result.value and
+                   result.value.startswith('image/')]
+    logging.debug('%s of %s extensionless links refer to images',
+                  len(image_links), len(candidates))
+    return image_links
+
+
+def _jpeg_size(data):
+    """
+    Returns (width, height) given by the start of frame segment of JPEG.
+    """
+    pos = 2
+    while pos + 9 <= len(data):
+        if data[pos] != 0xFF:
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte.
+            pos += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            # Markers without a segment.
+            pos += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', bytes(data[pos + 5:pos + 9]))
+            return width, height
+        pos += 2 + struct.unpack('>H', bytes(data[pos + 2:pos + 4]))[0]
+    return None, None
+
+
+def _webp_size(data):
+    """
+    Returns (width, height) of lossy (VP8), lossless (VP8L) or extended
+    (VP8X) WebP image.
+    """
+    chunk = bytes(data[12:16])
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack('<HH', bytes(data[26:30]))
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(data) >= 25:
+        bits = struct.unpack('<I', bytes(data[21:25]))[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(data) >= 30:
+        width = data[24] | data[25] << 8 | data[26] << 16
+        height = data[27] | data[28] << 8 | data[29] << 16
+        return width + 1, height + 1
+    return None, None
+
+
+def image_header_info(data):
+    """
+    This function finds the type and dimensions of an image from the start of
+    its content. PNG, GIF, JPEG, WebP and BMP images are recognized.
+    :param data: first bytes of image.
+    :return: tuple (content type, width, height). Unknown values are None.
+    """
+    data = bytearray(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        width, height = struct.unpack('>II', bytes(data[16:24]))
+        return 'image/png', width, height
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        width, height = struct.unpack('<HH', bytes(data[6:10]))
+        return 'image/gif', width, height
+    if data[:2] == b'\xff\xd8':
+        width, height = _jpeg_size(data)
+        return 'image/jpeg', width, height
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        width, height = _webp_size(data)
+        return 'image/webp', width, height
+    if data[:2] == b'BM' and len(data) >= 26:
+        if struct.unpack('<I', bytes(data[14:18]))[0] == 12:
+            # OS/2 bitmap header.
+            width, height = struct.unpack('<HH', bytes(data[18:22]))
+        else:
+            width, height = struct.unpack('<ii', bytes(data[18:26]))
+        return 'image/bmp', width, abs(height)
+    return None, None, None
+
+
+def is_image_file(filename, content_type=None, probe_bytes=32):
+    """
+    This function checks whether a downloaded file is an image, i.e. it was
+    served with an image content type or starts with a known image header.
+    :param filename: downloaded file.
+    :param content_type: Content-Type header of response (optional).
+    :return: True if file is an image, False otherwise.
+    """
+    if (content_type or '').lower().startswith('image/'):
+        return True
+    with open(filename, 'rb') as f:
+        return image_header_info(f.read(probe_bytes))[0] is not None
+
+
+class ImageInfo(object):
+    """
+    Type, dimensions and size (bytes) of an image found by probing it.
+    Unknown values are None.
+    """
+    def __init__(self, url, content_type=None, width=None, height=None,
+                 size=None, error=None):
+        self.url = url
+        self.content_type = content_type
+        self.width = width
+        self.height = height
+        self.size = size
+        self.error = error
+
+    def is_smaller_than(self, min_width=None, min_height=None):
+        """
+        Checks whether image is known to be smaller than given dimensions.
+        Images with unknown dimensions (e.g. SVG) are not.
+        """
+        return (min_width is not None and self.width is not None and
+                self.width < min_width) or \
+               (min_height is not None and self.height is not None and
+                self.height < min_height)
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'type': self.content_type,
+            'width': self.width,
+            'height': self.height,
+            'size': self.size,
+            'error': self.error
+        }
+
+
+def _probe_data_uri(uri, probe_bytes):
+    """
+    Probes an image given as data uri, decoding only the start of it.
+    """
+    header, _, payload = uri.partition(',')
+    content_type = header[5:].split(';')[0].lower() or None
+    if ';base64' in header.lower():
+        size = len(payload) * 3 // 4 - payload[-2:].count('=')
+        try:
+            data = base64.b64decode(payload[:(probe_bytes // 3 + 1) * 4])
+        except (binascii.Error, TypeError, ValueError):
+            data = b''
+    else:
+        size, data = len(payload), b''
+    parsed_type, width, height = image_header_info(data)
+    return ImageInfo(uri, parsed_type or content_type, width, height, size)
+
+
+def probe_image(url, probe_bytes=16384):
+    """
+    This function finds the type, dimensions and size of an image by fetching
+    only the first bytes of it with a Range request. Servers not supporting
+    Range requests send the whole image, of which only the first bytes are
+    read before the connection is closed.
+    :param url: url of image, or data uri.
+    :param probe_bytes: number of bytes fetched.
+    :return: ImageInfo object.
+    """
+    if is_data_uri(url):
+        return _probe_data_uri(url, probe_bytes)
+    response = get_session().get(
+        url, stream=True,
+        headers={'Range': 'bytes=0-{end}'.format(end=probe_bytes - 1)})
+    try:
+        response.raise_for_status()
+        data = b''
+        for chunk in response.iter_content(chunk_size=probe_bytes):
+            data += chunk
+            if len(data) >= probe_bytes:
+                break
+    finally:
+        response.close()
+    size = None
+    content_range = response.headers.get('Content-Range', '')
+    if response.status_code == 206 and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1].strip()
+        size = int(total) if total.isdigit() else None
+    elif response.headers.get('Content-Length', '').isdigit():
+        size = int(response.headers['Content-Length'])
+    content_type, width, height = image_header_info(data)
+    if content_type is None:
+        content_type = response.headers.get('Content-Type', '') \
+            .split(';')[0].strip().lower() or None
+    return ImageInfo(url, content_type, width, height, size)
+
+
+def probe_images(urls, engine=None):
+    """
+    This function probes the given images concurrently (see probe_image).
+    :param urls: urls of images.
+    :param engine: DownloadEngine running the probes (default=None i.e.
+    engine created with probe configuration).
+    :return: dict url -> ImageInfo. Images which could not be probed have
+    only the error set.
+    """
+    config = current_app.config
+    engine = engine or probe_engine(config)
+    func = partial(probe_image, probe_bytes=config.get('PROBE_BYTES', 16384))
+    infos = {}
+    for result in engine.iter_download(urls, func):
+        if result.success:
+            infos[result.url] = result.value
+        else:
+            infos[result.url] = ImageInfo(result.url, error=str(result.error))
+    logging.debug('%s images probed', len(infos))
+    return infos
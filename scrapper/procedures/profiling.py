@@ -0,0 +1,313 @@
+"""
+This module profiles single requests and jobs on demand. With profiling
+enabled in config, a request carrying the PROFILING_HEADER header or the
+PROFILING_QUERY_ARG query argument is profiled, along with the worker threads
+downloading or crawling for it and the background jobs it submits. The
+profile is saved in PROFILING_SUBFOLDER of FILES_DIR and its url is returned
+in the X-Profile-URL header of the response (and in the status of jobs).
+
+Profiles are either cProfile stats ('cprofile', open with pstats or snakeviz)
+or stacks sampled every PROFILING_SAMPLE_INTERVAL seconds in the collapsed
+format of flamegraph.pl and speedscope ('stacks'). The value of the header or
+query argument selects the format, e.g. ?profile=stacks, any other value
+selects PROFILING_FORMAT. From Python 3.12 only one cProfile profiler can be
+active at a time in the whole process, so stacks are sampled instead.
+"""
+
+import os
+import sys
+import uuid
+import logging
+import cProfile
+import pstats
+import threading
+from contextlib import contextmanager
+from collections import Counter
+from flask import request, g, url_for, current_app, send_from_directory, \
+    abort
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_URL_HEADER = 'X-Profile-URL'
+
+_local = threading.local()
+
+
+class CProfileSession(object):
+    """
+    cProfile profile of the threads working for a request or job. Each thread
+    is profiled separately and the stats are merged when saved.
+    """
+    extension = '.prof'
+
+    def __init__(self, filename, url=None, interval=None):
+        self.filename = filename
+        self.url = url
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def start_thread(self):
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop_thread(self, profile):
+        profile.disable()
+        with self._lock:
+            self._profiles.append(profile)
+
+    def save(self):
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.filename)
+        return self.filename
+
+
+class StackSampler(object):
+    """
+    Samples the stacks of the threads working for a request or job and counts
+    identical stacks, for drawing flame graphs.
+    """
+    extension = '.folded'
+
+    def __init__(self, filename, url=None, interval=0.005):
+        self.filename = filename
+        self.url = url
+        self.interval = interval
+        self.stacks = Counter()
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start_thread(self):
+        ident = threading.current_thread().ident
+        with self._lock:
+            self._threads.add(ident)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run)
+                self._sampler.daemon = True
+                self._sampler.start()
+        return ident
+
+    def stop_thread(self, ident):
+        with self._lock:
+            self._threads.discard(ident)
+
+    @staticmethod
+    def collapse(frame):
+        """
+        Returns given stack as 'outermost;...;innermost' function names.
+        """
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{func} ({file}:{line})'.format(
+                func=code.co_name, file=os.path.basename(code.co_filename),
+                line=code.co_firstlineno))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = list(self._threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[self.collapse(frame)] += 1
+
+    def save(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if not self.stacks:
+            return None
+        with open(self.filename, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{stack} {count}\n'.format(stack=stack, count=count))
+        return self.filename
+
+
+# Profile formats which can be selected with the header/query argument or
+# PROFILING_FORMAT configuration.
+PROFILERS = {
+    'cprofile': CProfileSession,
+    'stacks': StackSampler
+}
+# cProfile profilers of several threads can not run at the same time.
+CPROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+
+def current_profile():
+    """
+    Returns the profile of the request or job handled by current thread,
+    None if it is not profiled.
+    """
+    return getattr(_local, 'profile', None)
+
+
+def start_profiling(profile):
+    """
+    Starts profiling current thread, see stop_profiling. A thread already
+    profiled with given profile keeps being profiled as it is. Profiling
+    errors (e.g. another profiler running) are logged and the thread is
+    not profiled.
+    :return: state passed to stop_profiling.
+    """
+    previous = current_profile()
+    _local.profile = profile
+    token = None
+    if profile is not None and profile is not previous:
+        try:
+            token = profile.start_thread()
+        except (ValueError, RuntimeError) as ex:
+            logging.warning('Unable to profile thread for profile=%s. '
+                            'Error=%s', profile.filename, ex)
+    return previous, token
+
+
+def stop_profiling(state):
+    previous, token = state
+    profile = current_profile()
+    if profile is not None and token is not None:
+        profile.stop_thread(token)
+    _local.profile = previous
+
+
+@contextmanager
+def profiled(profile):
+    """
+    Profiles current thread with given profile (None does nothing) while in
+    the context, e.g. in the worker threads of a profiled request or job.
+    """
+    state = start_profiling(profile)
+    try:
+        yield profile
+    finally:
+        stop_profiling(state)
+
+
+def profiles_dir(config):
+    return os.path.abspath(os.path.join(config['APP_WD'], config['FILES_DIR'],
+                                        config.get('PROFILING_SUBFOLDER',
+                                                   'profiles/')))
+
+
+def create_profile(kind=None, name=None):
+    """
+    Creates a profile, saved in the profiles directory of application once
+    profiling is done.
+    :param kind: format of profile, a key of PROFILERS (default=
+    PROFILING_FORMAT).
+    :param name: name of profile file without extension (default=random).
+    :return: CProfileSession or StackSampler object.
+    """
+    config = current_app.config
+    profiler = PROFILERS.get(kind) or \
+        PROFILERS[config.get('PROFILING_FORMAT', 'cprofile')]
+    if profiler is CProfileSession and not CPROFILE_PER_THREAD:
+        profiler = StackSampler
+    filename = (name or uuid.uuid4().hex) + profiler.extension
+    directory = profiles_dir(config)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return profiler(os.path.join(directory, filename),
+                    url=url_for('profile_file', filename=filename),
+                    interval=config.get('PROFILING_SAMPLE_INTERVAL', 0.005))
+
+
+def requested_profile():
+    """
+    Returns the profile format requested with header or query argument of
+    current request, None if profiling is not requested.
+    """
+    config = current_app.config
+    if not config.get('PROFILING_ENABLED'):
+        return None
+    value = request.headers.get(config.get('PROFILING_HEADER', PROFILE_HEADER))
+    if value is None:
+        value = request.args.get(config.get('PROFILING_QUERY_ARG', 'profile'))
+    if value is None or value.lower() in ('', '0', 'false', 'no'):
+        return None
+    return value.lower()
+
+
+def profile_for_job(name):
+    """
+    Returns a new profile for a job submitted by current request if the
+    request is profiled, None otherwise.
+    :param name: name of profile file e.g. id of job.
+    """
+    profile = getattr(g, 'profile', None)
+    if profile is None:
+        return None
+    kind = 'stacks' if isinstance(profile, StackSampler) else 'cprofile'
+    return create_profile(kind, name=name)
+
+
+def save_profile(profile):
+    try:
+        filename = profile.save()
+        if filename is not None:
+            logging.info('Profile saved to file=%s', filename)
+    except Exception as ex:
+        logging.error('Unable to save profile=%s. Error=%s', profile.filename,
+                      ex)
+
+
+def send_profile(filename):
+    directory = profiles_dir(current_app.config)
+    if not os.path.isfile(os.path.join(directory, filename)):
+        abort(404)
+    return send_from_directory(directory, filename, as_attachment=True)
+
+
+class ProfilingManager(object):
+    """
+    Flask extension profiling the requests asking for it, when
+    PROFILING_ENABLED is set, and serving the profiles at /profiles/.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('PROFILING_ENABLED'):
+            return
+        app.add_url_rule('/profiles/<filename>', 'profile_file', send_profile)
+        app.before_request(self.start_request)
+        app.after_request(self.add_profile_url)
+        app.teardown_request(self.end_request)
+
+    @staticmethod
+    def start_request():
+        kind = requested_profile()
+        if kind is None:
+            return
+        g.profile = create_profile(kind)
+        g.profiling_state = start_profiling(g.profile)
+
+    @staticmethod
+    def add_profile_url(response):
+        profile = getattr(g, 'profile', None)
+        if profile is not None:
+            response.headers[PROFILE_URL_HEADER] = profile.url
+        return response
+
+    @staticmethod
+    def end_request(exc=None):
+        # Streamed responses are profiled until the whole response is sent.
+        profile = getattr(g, 'profile', None)
+        if profile is None:
+            return
+        stop_profiling(g.profiling_state)
+        g.profile = None
+        save_profile(profile)
@@ -0,0 +1,179 @@
+"""
+This module implements the cache of image urls extracted from web pages, so
+popular pages are not fetched and parsed again for every request. Results are
+kept for a limited time (TTL) and least recently used results are removed
+when the cache is full. Results are kept in memory by default, or on disk to
+survive restarts of the application.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from .urls import normalize_url
+
+
+class MemoryBackend(object):
+    """
+    Keeps cached results in memory, in LRU order.
+    """
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+
+class DiskBackend(object):
+    """
+    Keeps cached results as JSON files in a directory. Files are named after
+    the hash of cache key, their modification time gives the LRU order.
+    """
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        files = [(os.path.getmtime(os.path.join(path, name)), name)
+                 for name in os.listdir(path) if name.endswith('.json')]
+        self._files = OrderedDict((name, None) for _, name in sorted(files))
+
+    def _filename(self, key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+
+    def get(self, key):
+        name = self._filename(key)
+        if name not in self._files:
+            return None
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            self._files.pop(name, None)
+            return None
+        self._files.move_to_end(name)
+        os.utime(os.path.join(self.path, name), None)
+        return entry['expires'], entry['urls']
+
+    def set(self, key, entry):
+        name = self._filename(key)
+        tmp = os.path.join(self.path, name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'expires': entry[0], 'urls': entry[1]}, f)
+        os.replace(tmp, os.path.join(self.path, name))
+        self._files[name] = None
+        self._files.move_to_end(name)
+        while len(self._files) > self.max_entries:
+            old, _ = self._files.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.path, old))
+            except OSError:
+                pass
+
+    def delete(self, key):
+        name = self._filename(key)
+        if name in self._files:
+            del self._files[name]
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+
+class ResultCache(object):
+    """
+    Cache of image urls extracted from web pages, keyed by normalized url of
+    web page. Entries expire after ttl seconds.
+    """
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """
+        Returns cached image urls of given web page.
+        :param url: url of web page.
+        :return: set of image urls, None if page is not cached or expired.
+        """
+        key = normalize_url(url)
+        with self._lock:
+            entry = self.backend.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self.backend.delete(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return set(entry[1])
+
+    def set(self, url, image_urls):
+        """
+        Caches image urls extracted from given web page.
+        :param url: url of web page.
+        :param image_urls: iterable of image urls.
+        """
+        key = normalize_url(url)
+        with self._lock:
+            self.backend.set(key, (time.time() + self.ttl,
+                                   sorted(image_urls)))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'ttl': self.ttl}
+
+
+class ResultCacheManager(object):
+    """
+    Flask extension creating the result cache of an application, if enabled
+    with RESULT_CACHE_ENABLED.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache = None
+        if app.config.get('RESULT_CACHE_ENABLED'):
+            max_entries = app.config.get('RESULT_CACHE_MAX_ENTRIES', 1000)
+            if app.config.get('RESULT_CACHE_BACKEND') == 'disk':
+                backend = DiskBackend(
+                    os.path.join(app.config['APP_WD'],
+                                 app.config['FILES_DIR'],
+                                 app.config['RESULT_CACHE_DIR']),
+                    max_entries=max_entries)
+            else:
+                backend = MemoryBackend(max_entries=max_entries)
+            cache = ResultCache(backend,
+                                ttl=app.config.get('RESULT_CACHE_TTL', 300))
+            logging.debug('Result cache created with %s backend',
+                          type(backend).__name__)
+        app.extensions['result_cache'] = cache
+
+
+def get_result_cache():
+    """
+    Returns result cache of current application, None if it is disabled.
+    """
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('result_cache')
@@ -0,0 +1,277 @@
+"""
+This module implements HTTP conditional revalidation of web pages and images.
+The ETag, Last-Modified and Cache-Control/Expires headers of fetched resources
+are recorded, so repeated fetches are skipped while a resource is fresh
+(max-age) and are sent with If-None-Match/If-Modified-Since once it is stale.
+A 304 Not Modified response then reuses the body fetched earlier.
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_tz, mktime_tz
+from flask import current_app, has_app_context
+from .http_session import get_session
+
+_MAX_AGE_RE = re.compile(r'max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+
+def parse_expiry(headers, now=None):
+    """
+    Computes time until which a response is fresh, using Cache-Control and
+    Expires headers of the response.
+    :param headers: response headers.
+    :param now: time of response (default=current time).
+    :return: expiry timestamp, None if response must not be cached.
+    """
+    now = time.time() if now is None else now
+    cache_control = headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control:
+        return None
+    if 'no-cache' in cache_control:
+        return now
+    match = _MAX_AGE_RE.search(cache_control)
+    if match:
+        age = headers.get('Age', '0')
+        return now + int(match.group(1)) - (int(age) if age.isdigit() else 0)
+    expires = headers.get('Expires')
+    if expires:
+        parsed = parsedate_tz(expires)
+        return mktime_tz(parsed) if parsed else now
+    return now
+
+
+class CacheEntry(object):
+    """
+    Validators and freshness of a fetched resource. For web pages the body is
+    kept as well, to be reused when the page is not modified.
+    """
+    def __init__(self, etag=None, last_modified=None, expires=0, body=None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+        self.body = body
+
+    @property
+    def size(self):
+        return len(self.body) if self.body is not None else 0
+
+    @classmethod
+    def from_response(cls, response, body=None):
+        """
+        Creates cache entry for given response.
+        :return: CacheEntry object, None if response must not be cached.
+        """
+        expires = parse_expiry(response.headers)
+        if expires is None:
+            return None
+        entry = cls(etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                    expires=expires, body=body)
+        if not entry.is_fresh() and not entry.can_revalidate():
+            # Would have to be fetched again anyway.
+            return None
+        return entry
+
+    def refreshed(self, response):
+        """
+        Returns a copy of the entry updated using a 304 Not Modified
+        response. Entries are shared by threads, so they are not modified.
+        """
+        return CacheEntry(
+            etag=response.headers.get('ETag', self.etag),
+            last_modified=response.headers.get('Last-Modified',
+                                               self.last_modified),
+            expires=parse_expiry(response.headers) or time.time(),
+            body=self.body)
+
+    def is_fresh(self, now=None):
+        return (time.time() if now is None else now) < self.expires
+
+    def can_revalidate(self):
+        return self.etag is not None or self.last_modified is not None
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class RevalidationCache(object):
+    """
+    LRU map of urls to their cache entries, bounded in number of entries and
+    in total size of kept bodies, with counters of fresh hits, misses and
+    revalidations for each kind of resource. Entries of pages and images are
+    kept apart, so a url fetched as both has an entry for each kind.
+    """
+    KINDS = ('page', 'image')
+    OUTCOMES = ('hit', 'miss', 'revalidated')
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counters = dict((kind, dict((outcome, 0)
+                                          for outcome in self.OUTCOMES))
+                              for kind in self.KINDS)
+        self._lock = threading.Lock()
+
+    def get(self, url, kind='page'):
+        key = (kind, url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(self, url, response, body=None, kind='page'):
+        """
+        Records validators of given response for url.
+        :param kind: kind of resource, one of KINDS.
+        :return: CacheEntry object, None if response must not be cached.
+        """
+        return self._put((kind, url),
+                         CacheEntry.from_response(response, body=body))
+
+    def refresh(self, url, entry, response, kind='page'):
+        """
+        Replaces entry of url using a 304 Not Modified response.
+        :return: refreshed CacheEntry object.
+        """
+        return self._put((kind, url), entry.refreshed(response))
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._discard(key)
+            if entry is None:
+                return None
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and
+                     self._bytes > self.max_bytes):
+                self._discard(next(iter(self._entries)))
+        return entry
+
+    def fits(self, size):
+        """
+        Tells whether a body of given size (bytes) can be kept.
+        """
+        return self.max_bytes is None or size <= self.max_bytes
+
+    def _discard(self, key):
+        """
+        Removes entry of given (kind, url). Must be called holding the lock.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def count(self, kind, outcome):
+        with self._lock:
+            self._counters[kind][outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict((kind, dict(counters))
+                         for kind, counters in self._counters.items())
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            return stats
+
+
+class RevalidationManager(object):
+    """
+    Flask extension creating the revalidation cache of an application, if
+    enabled with REVALIDATION_ENABLED.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache = None
+        if app.config.get('REVALIDATION_ENABLED'):
+            cache = RevalidationCache(
+                max_entries=app.config.get('REVALIDATION_MAX_ENTRIES', 10000),
+                max_bytes=app.config.get('REVALIDATION_MAX_BYTES'))
+        app.extensions['revalidation_cache'] = cache
+
+
+def get_revalidation_cache():
+    """
+    Returns revalidation cache of current application, None if disabled.
+    """
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('revalidation_cache')
+
+
+def iter_page(url, chunk_size=None):
+    """
+    This function fetches the content of a web page and yields it in chunks
+    as it is received. The page is not requested while the copy fetched
+    earlier is fresh, and is revalidated once it is stale. A page is cached
+    only if it was consumed completely and fits in REVALIDATION_MAX_BYTES.
+    :param url: url of web page.
+    :param chunk_size: size of chunks (default=DOWNLOAD_CHUNK_SIZE in
+    application config).
+    :return: generator of content of web page (bytes).
+    """
+    if chunk_size is None and has_app_context():
+        chunk_size = current_app.config.get('DOWNLOAD_CHUNK_SIZE')
+    chunk_size = chunk_size or 64 * 1024
+    cache = get_revalidation_cache()
+    entry = cache.get(url) if cache is not None else None
+    if entry is not None and entry.is_fresh():
+        cache.count('page', 'hit')
+        logging.debug('Webpage=%s served from cache', url)
+        yield entry.body
+        return
+    headers = {}
+    if entry is not None:
+        headers = entry.conditional_headers()
+    response = get_session().get(url, headers=headers, stream=True)
+    try:
+        if response.status_code == 304 and entry is not None:
+            cache.count('page', 'revalidated')
+            entry = cache.refresh(url, entry, response)
+            logging.debug('Webpage=%s not modified', url)
+            yield entry.body
+            return
+        keep = False
+        if cache is not None:
+            cache.count('page', 'miss')
+            keep = response.status_code == 200 and \
+                CacheEntry.from_response(response) is not None
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if keep:
+                size += len(chunk)
+                # Pages larger than the whole cache are not kept.
+                keep = cache.fits(size)
+                if keep:
+                    chunks.append(chunk)
+                else:
+                    chunks = []
+            yield chunk
+        if keep:
+            cache.store(url, response, body=b''.join(chunks))
+    finally:
+        response.close()
+
+
+def fetch_page(url):
+    """
+    This function fetches the content of a web page, see iter_page.
+    :param url: url of web page.
+    :return: content of web page (bytes).
+    """
+    return b''.join(iter_page(url))
@@ -0,0 +1,160 @@
+"""
+This module fetches and parses robots.txt of websites. The parsed rules are
+fetched once per host and cached for ROBOTS_CACHE_TTL seconds, and are used
+for skipping disallowed pages, spacing requests by Crawl-delay and finding
+the sitemaps of a website.
+"""
+
+import time
+import logging
+import threading
+from flask import current_app, has_app_context
+from .http_session import get_session
+
+try:
+    # Python 3
+    from urllib.parse import urlsplit
+    from urllib.robotparser import RobotFileParser
+except ImportError:
+    # Python 2
+    from urlparse import urlsplit
+    from robotparser import RobotFileParser
+
+
+class RobotsRules(object):
+    """
+    Parsed robots.txt of a host.
+    """
+    def __init__(self, parser, sitemaps, expires):
+        self.parser = parser
+        self.sitemaps = sitemaps
+        self.expires = expires
+
+    @classmethod
+    def from_text(cls, text, expires):
+        parser = RobotFileParser()
+        lines = text.splitlines()
+        parser.parse(lines)
+        sitemaps = [line.split(':', 1)[1].strip() for line in lines
+                    if line.strip().lower().startswith('sitemap:')]
+        return cls(parser, sitemaps, expires)
+
+    @classmethod
+    def allow_all(cls, expires):
+        return cls.from_text('', expires)
+
+    @classmethod
+    def disallow_all(cls, expires):
+        return cls.from_text('User-agent: *\nDisallow: /', expires)
+
+    def can_fetch(self, user_agent, url):
+        return self.parser.can_fetch(user_agent, url)
+
+    def crawl_delay(self, user_agent):
+        # crawl_delay is only available in Python 3.6+
+        if not hasattr(self.parser, 'crawl_delay'):
+            return None
+        delay = self.parser.crawl_delay(user_agent)
+        return float(delay) if delay is not None else None
+
+
+class RobotsCache(object):
+    """
+    Cache of parsed robots.txt of hosts, fetched when first needed.
+    :param user_agent: user agent whose rules are applied.
+    :param ttl: seconds for which rules of a host are kept.
+    """
+    def __init__(self, user_agent='*', ttl=3600):
+        self.user_agent = user_agent
+        self.ttl = ttl
+        self._rules = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _origin(url):
+        parts = urlsplit(url)
+        return '{scheme}://{netloc}'.format(scheme=parts.scheme.lower(),
+                                            netloc=parts.netloc.lower())
+
+    def _fetch(self, origin):
+        """
+        Fetches and parses robots.txt of given origin. Like RobotFileParser,
+        everything is disallowed if access to robots.txt is denied (401/403)
+        and everything is allowed if it is missing or cannot be fetched.
+        """
+        expires = time.time() + self.ttl
+        try:
+            response = get_session().get(origin + '/robots.txt')
+        except Exception as ex:
+            logging.warning('Unable to fetch robots.txt of %s. Error=%s',
+                            origin, ex)
+            return RobotsRules.allow_all(expires)
+        if response.status_code in (401, 403):
+            return RobotsRules.disallow_all(expires)
+        if response.status_code >= 400:
+            return RobotsRules.allow_all(expires)
+        return RobotsRules.from_text(response.text, expires)
+
+    def rules(self, url):
+        """
+        Returns the robots.txt rules of host of given url. Only one thread
+        fetches robots.txt of a host, others wait for it.
+        :param url: any url on the host.
+        :return: RobotsRules object.
+        """
+        origin = self._origin(url)
+        with self._lock:
+            rules = self._rules.get(origin)
+            if rules is not None and rules.expires > time.time():
+                return rules
+            lock = self._locks.setdefault(origin, threading.Lock())
+        with lock:
+            rules = self._rules.get(origin)
+            if rules is None or rules.expires <= time.time():
+                rules = self._fetch(origin)
+                logging.debug('robots.txt of %s fetched', origin)
+                with self._lock:
+                    self._rules[origin] = rules
+        return rules
+
+    def can_fetch(self, url):
+        return self.rules(url).can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url):
+        return self.rules(url).crawl_delay(self.user_agent)
+
+    def sitemaps(self, url):
+        """
+        Returns urls of sitemaps listed in robots.txt of host of given url,
+        or the default /sitemap.xml if none are listed.
+        """
+        return self.rules(url).sitemaps or \
+            [self._origin(url) + '/sitemap.xml']
+
+
+class RobotsManager(object):
+    """
+    Flask extension creating the robots.txt cache of an application, if
+    enabled with ROBOTS_ENABLED.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache = None
+        if app.config.get('ROBOTS_ENABLED'):
+            cache = RobotsCache(
+                user_agent=app.config.get('USER_AGENT') or '*',
+                ttl=app.config.get('ROBOTS_CACHE_TTL', 3600))
+        app.extensions['robots_cache'] = cache
+
+
+def get_robots_cache():
+    """
+    Returns robots.txt cache of current application, None if disabled.
+    """
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('robots_cache')
@@ -6,141 +6,367 @@ Write a program in Python, which:
 
 import os
 import logging
+from functools import partial
 from flask import current_app
 # Uncomment following lines to enable logging
 # logging.basicConfig(level=logging.INFO,
 #                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-from .helpers import get_filename, save_image_from_uri, install_package, \
-    process_links
+from .helpers import save_image_from_uri, install_package, process_links, \
+    stream_response_to_file, ByteBudget, image_extensions, has_extension
+from .download_engine import DownloadEngine
+from .http_session import get_session
+from .image_cache import get_image_cache
+from .revalidation import get_revalidation_cache
+from .extraction import extract_from_url, extract_from_stylesheets, \
+    iter_extract_from_url
+from .result_cache import get_result_cache
+from .urls import resolve_url, absolute_url
+from .probe import probe_image_links, is_image_file
+from .naming import url_filename, Manifest
+from .metrics import URL_PROCESSING_SECONDS, IMAGE_DOWNLOAD_SECONDS, \
+    DOWNLOADED_BYTES, CACHE_HITS, metrics_enabled, url_host, count_failure
 
 try:
-    # Python 3
-    from urllib.parse import urlparse
-except ImportError:
-    # Python 2
-    from urlparse import urlparse
-
-try:
-    import requests
     from requests.exceptions import InvalidSchema, InvalidURL
 except ImportError:
     install_package('requests')
-    import requests
     from requests.exceptions import InvalidSchema, InvalidURL
 
-try:
-    from lxml import html
-except ImportError:
-    install_package('lxml')
-    from lxml import html
-
 
-def get_image_urls_from_webpage(input_url, inc_data_uri=True):
+def get_image_urls_from_webpage(input_url, inc_data_uri=True,
+                                max_images=None):
     """
     This function finds links to all images shown on given web page and
-    returns a list of urls for those images.
+    returns a list of urls for those images. The page is parsed in a single
+    pass while it is being received.
     Note: The urls also include data-uri(s) given in <img> tag's src attribute.
     :param input_url: Url of web page from which images links needs to be
     scrapped.
     :param inc_data_uri: Include data-uris as image resources (default=True)
+    :param max_images: Stop parsing the page after this many images are found
+    (default=None i.e. parse whole page).
     :return: list of urls (included data-uri) to images displayed on webpage.
     returns an empty list if there is an exception or no URLs are retrieved
     from webpage.
     """
     try:
-        page_content = requests.get(input_url)
-        html_tree = html.fromstring(page_content.text)
-        # Images loaded directly
-        image_urls = html_tree.xpath('//img/@src')
-        logging.debug('{count} links retrieved from <img> @src'.format(
-            count=len(image_urls)))
-        # Images loaded in hyperlinks
-        hyperlinks = html_tree.xpath('//a/@href')
-        # Lazy loaded image sources.
-        data_src_urls = html_tree.xpath('//img/@data-src')
-        logging.debug('{count} links retrieved from <img> @data-src'.format(
-            count=len(data_src_urls)))
-
-        # Find Image links from hyperlinks
-        hyperlinks_images = process_links(hyperlinks,
-                                          file_extensions=current_app.config[
-                                              'IMAGE_EXTENSIONS'])
-        logging.debug('{count} links retrieved from images retrieved from '
-                      'hyperlinks'.format(count=len(hyperlinks_images)))
-        # Combine all links
-        image_urls.extend(data_src_urls)
-        image_urls.extend(hyperlinks_images)
-
-        if len(image_urls) == 0:
-            logging.info('No urls for Images found in requested page.')
-            return []
-        protocols = current_app.config['PROTOCOLS']
-        parsed_url = urlparse(input_url)
-        processed_urls = []
-        for img_url in image_urls:
-            img_url = img_url.strip()   # Remove white spaces around link
-            if img_url.startswith('/'):
-                processed_urls.append(parsed_url.scheme
-                                      + '://'
-                                      + parsed_url.netloc
-                                      + '/'
-                                      + img_url)
-            elif img_url.startswith(protocols.get('data-uri')):
-                if inc_data_uri:
-                    processed_urls.append(img_url)
-            elif img_url.startswith(protocols.get('http')) or \
-                    img_url.startswith(protocols.get('https')):
-                '''
-                We remove query parameters (may be used for resizing etc.) from
-                querying image. Uncomment following line if you need image as
-                downloaded to display on page.
-                '''
-                # url.append(img_url)
-                processed_urls.append(img_url.split('?')[0])
-            else:
-                processed_urls.append(os.path.join(os.path.dirname(input_url),
-                                                   img_url))
-        # Only return unique links to avoid repetition.
-        logging.info('{count} unique links extracted for image sources from '
-                     'given webpage={url}'.format(
-                        count=len(set(processed_urls)), url=input_url))
-        return set(processed_urls)
+        image_urls, hyperlinks = scrape_webpage(input_url,
+                                                inc_data_uri=inc_data_uri,
+                                                max_images=max_images)
+        return image_urls or []
     except (InvalidSchema, InvalidURL) as ex:
-        logging.error('Invalid URL={url} provided for scrapping images. '
-                      'Error={err}'.format(url=input_url, err=ex))
+        logging.error('Invalid URL=%s provided for scrapping images. Error=%s',
+                      input_url, ex)
+        count_failure(input_url, ex)
         return []
 
 
-def download_images(image_urls, inc_data_uri=True):
+def scrape_webpage(input_url, inc_data_uri=True, max_images=None):
+    """
+    This function finds links to all images shown on given web page, as
+    get_image_urls_from_webpage, and returns the hyperlinks on the page as
+    well e.g. for crawling the website.
+    :param input_url: Url of web page from which images links needs to be
+    scrapped.
+    :param inc_data_uri: Include data-uris as image resources (default=True)
+    :param max_images: Stop parsing the page after this many images are found
+    (default=None i.e. parse whole page).
+    :return: tuple (set of normalized urls to images displayed on webpage,
+    list of hyperlinks i.e. <a> @href on webpage, resolved to absolute urls)
+    """
+    file_extensions = current_app.config['IMAGE_EXTENSIONS']
+    extractors = current_app.config.get('IMAGE_EXTRACTORS')
+    collector = extract_from_url(
+        input_url, max_images=max_images, file_extensions=file_extensions,
+        extractors=extractors,
+        target_dpr=current_app.config.get('SRCSET_TARGET_DPR'))
+    # Relative links are resolved against <base href> if page gives one.
+    base_url = input_url
+    if collector.base_url:
+        base_url = resolve_url(input_url, collector.base_url)
+    hyperlinks = [resolve_url(base_url, link)
+                  for link in collector.hyperlinks if link.strip()]
+    # Images loaded directly
+    image_urls = collector.image_urls
+    logging.debug('%s links retrieved from <img> @src', len(image_urls))
+    # Lazy loaded image sources.
+    data_src_urls = collector.data_src_urls
+    logging.debug('%s links retrieved from <img> @data-src',
+                  len(data_src_urls))
+
+    # Find Image links from hyperlinks
+    hyperlinks_images = process_links(hyperlinks,
+                                      file_extensions=file_extensions)
+    logging.debug('%s links retrieved from images retrieved from hyperlinks',
+                  len(hyperlinks_images))
+    # Links without extension (e.g. served by scripts), probed with HEAD.
+    if current_app.config.get('PROBE_LINK_CONTENT_TYPE'):
+        hyperlinks_images.extend(probe_image_links(hyperlinks))
+    # srcset, CSS backgrounds, preloads and meta images.
+    logging.debug('%s links retrieved by other extractors',
+                  len(collector.extra_urls))
+    # Images referred in linked stylesheets, resolved against stylesheet.
+    stylesheet_images = []
+    if collector.stylesheets and (extractors is None or
+                                  'stylesheet' in extractors):
+        stylesheet_images = extract_from_stylesheets(
+            base_url, collector.stylesheets, file_extensions,
+            max_stylesheets=current_app.config.get('MAX_STYLESHEETS', 10))
+    # Combine all links
+    image_urls.extend(data_src_urls)
+    image_urls.extend(hyperlinks_images)
+    image_urls.extend(collector.extra_urls)
+    image_urls.extend(stylesheet_images)
+
+    if len(image_urls) == 0:
+        logging.info('No urls for Images found in requested page.')
+        return set(), hyperlinks
+    processed_urls = set()
+    with URL_PROCESSING_SECONDS.time(host=url_host(input_url)):
+        for img_url in image_urls:
+            img_url = process_image_url(img_url, base_url, inc_data_uri)
+            if img_url is not None:
+                processed_urls.add(img_url)
+    # Only return unique links to avoid repetition.
+    logging.info('%s unique links extracted for image sources from given '
+                 'webpage=%s', len(processed_urls), input_url)
+    return processed_urls, hyperlinks
+
+
+def process_image_url(img_url, base_url, inc_data_uri=True):
+    """
+    This function turns a link to an image found on a web page into the url
+    used for downloading it i.e. resolves it against the page and normalizes
+    it. Data uris are kept as they are.
+    :param img_url: link as given on the web page.
+    :param base_url: url of web page, or its <base href> resolved against it.
+    :param inc_data_uri: Include data-uris as image resources (default=True)
+    :return: url of image, None if link is not usable (e.g. javascript:).
+    """
+    protocols = current_app.config['PROTOCOLS']
+    img_url = img_url.strip()   # Remove white spaces around link
+    if not img_url:
+        return None
+    if img_url.startswith(protocols.get('data-uri')):
+        return img_url if inc_data_uri else None
+    # Query parameters (may be used for resizing etc.) are removed from image
+    # urls. Disable STRIP_IMAGE_QUERY if you need image as displayed on page.
+    img_url = absolute_url(
+        base_url, img_url,
+        strip_query=current_app.config.get('STRIP_IMAGE_QUERY', True))
+    # Skip javascript:, mailto: etc. links.
+    if img_url.startswith(protocols.get('http')) or \
+            img_url.startswith(protocols.get('https')):
+        return img_url
+    return None
+
+
+def iter_image_urls_from_webpage(input_url, inc_data_uri=True,
+                                 refresh=False):
+    """
+    This function finds links to images shown on given web page, as
+    get_image_urls_from_webpage, but yields each url as soon as it is found
+    while the page is being received. Images referred in stylesheets (and
+    hyperlinks probed for their content type) are yielded once the page is
+    parsed. The urls are served from and stored in the result cache.
+    :param input_url: Url of web page from which images links needs to be
+    scrapped.
+    :param inc_data_uri: Include data-uris as image resources (default=True)
+    :param refresh: scrap the web page even if it is cached (default=False).
+    :return: generator of unique urls of images.
+    """
+    cache = get_result_cache()
+    if cache is not None and not refresh:
+        urls = cache.get(input_url)
+        if urls is not None:
+            CACHE_HITS.inc(host=url_host(input_url), cache='result')
+            for url in urls:
+                yield url
+            return
+    config = current_app.config
+    file_extensions = image_extensions(config['IMAGE_EXTENSIONS'])
+    extractors = config.get('IMAGE_EXTRACTORS')
+    found = set()
+    hyperlinks = []
+    stylesheets = []
+    base_url = input_url
+    for collector, links in iter_extract_from_url(
+            input_url, file_extensions=file_extensions,
+            extractors=extractors, target_dpr=config.get('SRCSET_TARGET_DPR')):
+        if collector.base_url:
+            base_url = resolve_url(input_url, collector.base_url)
+        for kind, link in links:
+            if kind == 'stylesheets':
+                stylesheets.append(link)
+                continue
+            if kind == 'hyperlinks':
+                if not link.strip():
+                    continue
+                link = resolve_url(base_url, link)
+                hyperlinks.append(link)
+                if not has_extension(link, file_extensions):
+                    continue
+            url = process_image_url(link, base_url, inc_data_uri)
+            if url is not None and url not in found:
+                found.add(url)
+                yield url
+    # Links found once the whole page is parsed.
+    links = []
+    if config.get('PROBE_LINK_CONTENT_TYPE'):
+        links.extend(probe_image_links(hyperlinks))
+    if stylesheets and (extractors is None or 'stylesheet' in extractors):
+        links.extend(extract_from_stylesheets(
+            base_url, stylesheets, file_extensions,
+            max_stylesheets=config.get('MAX_STYLESHEETS', 10)))
+    for link in links:
+        url = process_image_url(link, base_url, inc_data_uri)
+        if url is not None and url not in found:
+            found.add(url)
+            yield url
+    logging.info('%s unique links streamed for image sources from given '
+                 'webpage=%s', len(found), input_url)
+    # Failed and empty scrapes are not cached.
+    if cache is not None and found:
+        cache.set(input_url, found)
+
+
+def get_cached_image_urls(input_url, refresh=False, max_images=None):
+    """
+    This function returns the urls of images shown on given web page (see
+    get_image_urls_from_webpage), using the result cache when possible.
+    :param input_url: Url of web page from which images links needs to be
+    scrapped.
+    :param refresh: scrap the web page even if it is cached (default=False).
+    :param max_images: stop after this many images are found. Results limited
+    this way are neither served from nor stored in the cache.
+    :return: tuple (urls of images, True if urls were served from cache)
+    """
+    cache = get_result_cache()
+    if max_images is not None:
+        return get_image_urls_from_webpage(input_url,
+                                           max_images=max_images), False
+    if cache is not None and not refresh:
+        urls = cache.get(input_url)
+        if urls is not None:
+            logging.debug('Image urls for webpage=%s served from cache',
+                          input_url)
+            CACHE_HITS.inc(host=url_host(input_url), cache='result')
+            return urls, True
+    urls = get_image_urls_from_webpage(input_url)
+    # Failed and empty scrapes are not cached.
+    if cache is not None and urls:
+        cache.set(input_url, urls)
+    return urls, False
+
+
+def download_images(image_urls, inc_data_uri=True, engine=None,
+                    progress=None, dest_dir='.'):
     """
     This function downloads the images using urls given as input and stores
-    them in current working directory.
+    them in given directory. Downloads run concurrently, bounded by
+    DOWNLOAD_WORKERS in total and DOWNLOAD_PER_HOST_LIMIT per host, and are
+    streamed to disk within MAX_IMAGE_BYTES per image and MAX_JOB_BYTES in
+    total.
     :param image_urls: List of urls for the images.
     :param inc_data_uri: decode images from data-uris as well (default=True).
+    :param engine: DownloadEngine used for downloading images (default=engine
+    created from application config).
+    :param progress: function called with success (True/False) of each
+    download as soon as it finishes.
+    :param dest_dir: directory where images are stored, preferably absolute
+    and used by a single job (default=current working directory).
     :return: dictionary object containing number of images downloaded
-    successfully and number of images failed to download
+    successfully, number of images failed to download, time (in seconds)
+    taken for downloading each url and the manifest of stored images.
     """
-    from posixpath import basename
-    protocols = current_app.config['PROTOCOLS']
+    if engine is None:
+        engine = DownloadEngine.from_config(current_app.config)
+    # Total size of images downloaded for this call is limited as well.
+    budget = ByteBudget(current_app.config.get('MAX_JOB_BYTES'))
     failed = 0
-    for img_url in image_urls:
-        try:
-            if img_url.startswith(protocols.get('data-uri')):
-                if inc_data_uri:
-                    save_image_from_uri(img_url)
-            else:
-                filename = get_filename(basename(img_url))
-                f = open(filename, 'wb+')
-                f.write(requests.request('get', img_url).content)
-                f.close()
-        except Exception as ex:
-            logging.error('Unable to download and store image from '
-                          'url={url}. Error={err}'.format(url=img_url, err=ex))
+    timings = {}
+    manifest = Manifest()
+    for result in engine.iter_download(
+            image_urls, partial(download_image, inc_data_uri=inc_data_uri,
+                                dest_dir=dest_dir, budget=budget)):
+        timings[result.url] = result.elapsed
+        if metrics_enabled():
+            IMAGE_DOWNLOAD_SECONDS.observe(result.elapsed,
+                                           host=url_host(result.url))
+            if not result.success:
+                count_failure(result.url, result.error)
+        if not result.success:
             failed += 1
-            pass
-    logging.info('Failed to download {count} images.'.format(count=failed))
+        elif result.filename is not None:
+            manifest.add(result.url, result.filename)
+        if progress is not None:
+            progress(result.success)
+    logging.info('Failed to download %s images.', failed)
     return {
         "success": len(image_urls) - failed,
-        "fail": failed
+        "fail": failed,
+        "timings": timings,
+        "manifest": manifest
     }
+
+
+def download_image(img_url, inc_data_uri=True, dest_dir='.', budget=None):
+    """
+    This function downloads a single image and stores it in given directory.
+    Images found in the image cache are linked from there instead while they
+    are fresh, and after revalidating them with the server once they are
+    stale.
+    :param img_url: url for the image.
+    :param inc_data_uri: decode image from data-uri as well (default=True).
+    :param dest_dir: directory where image is stored.
+    :param budget: ByteBudget limiting total bytes downloaded for the job.
+    :return: filename of stored image (None if no image is stored).
+    """
+    protocols = current_app.config['PROTOCOLS']
+    if img_url.startswith(protocols.get('data-uri')):
+        if inc_data_uri:
+            return save_image_from_uri(img_url, dest_dir=dest_dir,
+                                       budget=budget)
+        return None
+    filename = os.path.join(dest_dir, url_filename(img_url))
+    cache = get_image_cache()
+    validators = get_revalidation_cache()
+    entry = None
+    if cache is not None and validators is not None and img_url in cache:
+        entry = validators.get(img_url, kind='image')
+        # Images are reused without a request only while fresh, images which
+        # must not be cached or were never validated are fetched again.
+        if entry is not None and entry.is_fresh():
+            if cache.copy_to(img_url, filename):
+                validators.count('image', 'hit')
+                CACHE_HITS.inc(host=url_host(img_url), cache='image')
+                logging.debug('Image from url=%s reused from image cache',
+                              img_url)
+                return filename
+            entry = None
+    if entry is not None and not entry.can_revalidate():
+        entry = None
+    headers = entry.conditional_headers() if entry is not None else {}
+    response = get_session().get(img_url, headers=headers, stream=True)
+    if response.status_code == 304 and entry is not None:
+        response.close()
+        if cache.copy_to(img_url, filename):
+            validators.count('image', 'revalidated')
+            CACHE_HITS.inc(host=url_host(img_url), cache='image')
+            validators.refresh(img_url, entry, response, kind='image')
+            return filename
+        response = get_session().get(img_url, stream=True)
+    written = stream_response_to_file(response, filename, budget=budget)
+    DOWNLOADED_BYTES.inc(written, host=url_host(img_url))
+    if validators is not None:
+        validators.count('image', 'miss')
+        # Only images actually served are recorded, as in iter_page.
+        entry = None
+        if 200 <= response.status_code < 300:
+            entry = validators.store(img_url, response, kind='image')
+        # Cached images are only reused with an entry (see above).
+        if cache is not None and entry is not None and is_image_file(
+                filename, response.headers.get('Content-Type')):
+            cache.store(img_url, filename)
+    return filename
@@ -0,0 +1,152 @@
+"""
+This module reads sitemaps (sitemap.xml) of websites, including sitemap
+indexes and image sitemaps (<image:loc>). Image sitemaps list the images of a
+website directly, so images can be discovered without fetching and parsing
+the HTML of every page. Sitemaps are parsed incrementally as they are
+received, and gzipped sitemaps are decompressed on the fly.
+"""
+
+import zlib
+import logging
+from collections import deque
+from .helpers import install_package
+from .revalidation import iter_page
+
+try:
+    from lxml import etree
+except ImportError:
+    install_package('lxml')
+    from lxml import etree
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+IMAGE_NS = '{http://www.google.com/schemas/sitemap-image/1.1}'
+
+
+def gunzip_chunks(chunks):
+    """
+    Decompresses content given in chunks if it is gzipped (e.g. sitemap.xml.gz
+    served as a file rather than with Content-Encoding), otherwise the chunks
+    are returned as they are.
+    :param chunks: iterable of bytes.
+    :return: generator of decompressed bytes.
+    """
+    decompressor = None
+    for chunk in chunks:
+        if decompressor is None:
+            if not chunk.startswith(b'\x1f\x8b'):
+                yield chunk
+                for chunk in chunks:
+                    yield chunk
+                return
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if decompressor is not None:
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+def iter_sitemap(url):
+    """
+    This function fetches a sitemap and yields the entries in it as they are
+    parsed.
+    :param url: url of sitemap.
+    :return: generator of tuples (kind, url) where kind is 'sitemap' for
+    sitemaps listed in a sitemap index, 'page' for pages and 'image' for
+    images of pages.
+    """
+    chunks = gunzip_chunks(iter_page(url))
+    parser = etree.XMLPullParser(events=('end',), recover=True)
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            for entry in _sitemap_entry(element):
+                yield entry
+    parser.close()
+    for event, element in parser.read_events():
+        for entry in _sitemap_entry(element):
+            yield entry
+
+
+def _sitemap_entry(element):
+    """
+    Returns the sitemap entries given by a parsed element, and frees the
+    element once its entries are read.
+    """
+    tag = element.tag
+    if tag == IMAGE_NS + 'image':
+        loc = element.findtext(IMAGE_NS + 'loc')
+        return [('image', loc.strip())] if loc else []
+    if tag in (SITEMAP_NS + 'url', SITEMAP_NS + 'sitemap'):
+        loc = element.findtext(SITEMAP_NS + 'loc')
+        element.clear()
+        # Free preceding siblings i.e. entries already read.
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        if not loc:
+            return []
+        return [('page' if tag == SITEMAP_NS + 'url' else 'sitemap',
+                 loc.strip())]
+    return []
+
+
+class SitemapResult(object):
+    """
+    Pages and images listed in the sitemaps of a website.
+    """
+    def __init__(self):
+        self.sitemaps = []
+        self.pages = []
+        self.image_urls = set()
+        self.errors = {}
+
+    def to_dict(self):
+        return {
+            'sitemaps': self.sitemaps,
+            'pages': len(self.pages),
+            'errors': self.errors,
+            'count': len(self.image_urls),
+            'url_list': sorted(self.image_urls)
+        }
+
+
+def read_sitemaps(sitemap_urls, max_sitemaps=50, max_urls=100000,
+                  robots=None):
+    """
+    This function reads the given sitemaps and sitemaps listed in them
+    (sitemap indexes), and collects the pages and images listed in them.
+    :param sitemap_urls: urls of sitemaps.
+    :param max_sitemaps: maximum number of sitemaps read.
+    :param max_urls: maximum number of pages and images collected.
+    :param robots: RobotsCache used for skipping disallowed pages.
+    :return: SitemapResult object.
+    """
+    result = SitemapResult()
+    queue = deque(sitemap_urls)
+    seen = set(sitemap_urls)
+    while queue and len(result.sitemaps) < max_sitemaps:
+        sitemap_url = queue.popleft()
+        result.sitemaps.append(sitemap_url)
+        try:
+            for kind, url in iter_sitemap(sitemap_url):
+                if kind == 'sitemap':
+                    if url not in seen:
+                        seen.add(url)
+                        queue.append(url)
+                elif kind == 'page':
+                    if robots is None or robots.can_fetch(url):
+                        result.pages.append(url)
+                else:
+                    result.image_urls.add(url)
+                if len(result.pages) + len(result.image_urls) >= max_urls:
+                    return result
+        except Exception as ex:
+            logging.error('Unable to read sitemap=%s. Error=%s', sitemap_url,
+                          ex)
+            result.errors[sitemap_url] = str(ex)
+    logging.info('%s image urls and %s pages found in %s sitemaps',
+                 len(result.image_urls), len(result.pages),
+                 len(result.sitemaps))
+    return result
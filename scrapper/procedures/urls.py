@@ -0,0 +1,83 @@
+"""
+This module resolves and normalizes urls. Links found on web pages are
+resolved against the url of the page (or its <base href>) following RFC 3986,
+and normalized so the same resource always gets the same url i.e. scheme and
+host are lowercased, default ports and fragments are removed and optionally
+the query string is removed. Normalized urls are the keys used for
+deduplicating image urls, crawl frontier and caches.
+"""
+
+from functools import lru_cache
+
+try:
+    # Python 3
+    from urllib.parse import urljoin, urlsplit, urlunsplit
+except ImportError:
+    # Python 2
+    from urlparse import urljoin, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# Number of urls whose normalized form is cached.
+URL_CACHE_SIZE = 10000
+
+
+def is_data_uri(url):
+    return url[:5].lower() == 'data:'
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def resolve_url(base_url, url):
+    """
+    This function resolves a link found on a web page to an absolute url
+    (RFC 3986), e.g. root relative '/img/a.png', relative '../a.png' and
+    protocol relative '//cdn.example.com/a.png' links.
+    :param base_url: url of web page, or its <base href> resolved against it.
+    :param url: link as given on the web page.
+    :return: absolute url. Data uris are returned as they are.
+    """
+    url = url.strip()
+    if is_data_uri(url):
+        return url
+    return urljoin(base_url, url)
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def normalize_url(url, strip_query=False):
+    """
+    This function normalizes an absolute url i.e. lowercases scheme and host,
+    removes default port, user info and fragment, and uses '/' as empty path.
+    :param url: absolute url.
+    :param strip_query: remove query string as well (default=False).
+    :return: normalized url. Data uris and urls without host are returned as
+    they are.
+    """
+    url = url.strip()
+    if is_data_uri(url):
+        return url
+    parts = urlsplit(url)
+    if not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if ':' in netloc:
+        # IPv6 address.
+        netloc = '[{host}]'.format(host=netloc)
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc += ':{port}'.format(port=port)
+    query = '' if strip_query else parts.query
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def absolute_url(base_url, url, strip_query=False):
+    """
+    Resolves a link found on a web page and normalizes it.
+    :param base_url: url of web page, or its <base href> resolved against it.
+    :param url: link as given on the web page.
+    :param strip_query: remove query string (default=False).
+    :return: normalized absolute url.
+    """
+    return normalize_url(resolve_url(base_url, url), strip_query)
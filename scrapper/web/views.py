@@ -3,15 +3,18 @@ This module implements the endpoints for web api.
 """
 import os
 import logging
-from flask import flash, redirect, url_for, request, abort, send_file
+from flask import flash, redirect, url_for, request, abort, send_file, \
+    Response, stream_with_context
 from flask import render_template, current_app
-from scrapper.procedures.scrapping_functions import \
-    get_image_urls_from_webpage
-from scrapper.procedures.helpers import get_filename
+from scrapper.procedures.scrapping_functions import get_cached_image_urls
+from scrapper.procedures.probe import probe_images
 from scrapper.web.forms import GetURLsForm
 from . import web_api, web_logger
+from scrapper.jobs import get_job_queue
 from .web_helpers import store_urls_to_file, create_files_folder, \
-    send_files_to_user, get_netloc_from_url
+    send_files_to_user, stream_files_to_user, get_netloc_from_url, \
+    url_list_filename, files_path, read_urls_from_file, remove_file, \
+    UrlPagination, JOB_TASKS
 
 
 @web_api.route('/shutdown')
@@ -41,43 +44,55 @@ def index():
     if form.validate_on_submit():
         if form.url_field.data == '':
             return render_template('400.html', message='No/ Bad URL provided.')
-        urls = get_image_urls_from_webpage(form.url_field.data)
-        flash('{count} urls for images retrieved.'.format(count=len(urls)))
+        if form.download.data and current_app.config['ASYNC_DOWNLOADS']:
+            # Download images in background and let user poll the job.
+            job = get_job_queue().submit('images', form.url_field.data,
+                                         JOB_TASKS['images'])
+            return redirect(url_for('web_api.job_status', job_id=job.id))
+        urls, cached = get_cached_image_urls(form.url_field.data)
+        flash('{count} urls for images retrieved{cached}.'.format(
+            count=len(urls), cached=' from cache' if cached else ''))
 
         # Create directory for storing files
-        create_files_folder(current_app.config['FILES_DIR'],
-                            change_to_directory=False)
-        filename = get_filename(
-            os.path.join(current_app.config['FILES_DIR'],
-                         get_netloc_from_url(form.url_field.data) + '.txt'))
+        create_files_folder(files_path())
+        filename = url_list_filename(form.url_field.data)
         try:
             # Store list of files for later use.
             store_urls_to_file(filename, urls)
             if form.show.data:
-                logging.info(
-                    'Presenting {count} links for image resources extracted '
-                    'from webpage={url}'.format(count=len(urls),
-                                                url=form.url_field.data))
-                return render_template('show_links.html',
-                                       count=len(urls),
-                                       webpage=form.url_field.data,
-                                       urls=urls)
+                # Links are shown page by page, from the stored list.
+                return redirect(url_for('web_api.show_links',
+                                        url=form.url_field.data))
+            if form.download.data and current_app.config['STREAM_ARCHIVES']:
+                # Send the zip file while images are being downloaded.
+                url_name = get_netloc_from_url(form.url_field.data)
+                logging.info('Streaming zip file containing images loaded '
+                             'with webpage=%s', form.url_field.data)
+                return Response(
+                    stream_with_context(stream_files_to_user(
+                        url_name=url_name, urls=urls)),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition':
+                             'attachment; filename={name}.zip'.format(
+                                 name=url_name)})
             if form.download.data:
                 # User wants to download all images in the page.
                 zfilename = send_files_to_user(
                     url_name=get_netloc_from_url(form.url_field.data),
                     urls=urls)
-                logging.info(
-                    'Returning zip file={fname} containing images loaded with '
-                    'webpage={url}'.format(fname=zfilename,
-                                           url=form.url_field.data))
-                return send_file(zfilename, as_attachment=True,
-                                 attachment_filename=os.path.basename(zfilename))
+                logging.info('Returning zip file=%s containing images loaded '
+                             'with webpage=%s', zfilename, form.url_field.data)
+                zip_file = open(zfilename, 'rb')
+                # Zip file of each request is removed right away, the open
+                # file stays readable until it is sent.
+                remove_file(zfilename)
+                return send_file(
+                    zip_file, as_attachment=True,
+                    attachment_filename=os.path.basename(zfilename))
         except ImportError as ex:
-            web_logger.error('Unable to store image urls for webpage={url} in'
-                             ' local storage. '
-                             'Error={err}'.format(url=form.url_field.data,
-                                                  err=ex))
+            web_logger.error('Unable to store image urls for webpage=%s in '
+                             'local storage. Error=%s', form.url_field.data,
+                             ex)
             return render_template(
                 '500.html',
                 message='Unable to retrieve the set of images from webpage='
@@ -85,6 +100,62 @@ def index():
     return render_template('index.html', form=form)
 
 
+@web_api.route('/links')
+def show_links():
+    """
+    Displays the links to images loaded with a webpage, LINKS_PER_PAGE links
+    per page. The webpage is scrapped only if its list of image urls is not
+    stored (see index) or is older than RESULT_CACHE_TTL, so changing page
+    does not scrap it again.
+    :parameter url: url of webpage.
+    :parameter page: number of page (default=1).
+    :return:
+    """
+    webpage = request.args.get('url')
+    if not webpage:
+        return render_template('400.html', message='No/ Bad URL provided.')
+    filename = url_list_filename(webpage)
+    urls = read_urls_from_file(
+        filename, max_age=current_app.config.get('RESULT_CACHE_TTL'))
+    if urls is None:
+        try:
+            urls = get_cached_image_urls(webpage)[0]
+        except Exception as ex:
+            web_logger.error('Unable to retrieve image urls for webpage=%s. '
+                             'Error=%s', webpage, ex)
+            return render_template(
+                '500.html',
+                message='Unable to retrieve the set of images from webpage='
+                        '{url}'.format(url=webpage))
+        create_files_folder(files_path())
+        store_urls_to_file(filename, urls)
+    pagination = UrlPagination(urls, page=request.args.get('page', 1,
+                                                           type=int))
+    logging.info('Presenting %s of %s links for image resources extracted '
+                 'from webpage=%s', len(pagination.items), len(urls), webpage)
+    images = {}
+    if current_app.config.get('SHOW_IMAGE_INFO'):
+        # Only images shown on this page are probed.
+        images = probe_images(pagination.items)
+    return render_template('show_links.html', count=len(urls),
+                           webpage=webpage, urls=pagination.items,
+                           images=images, pagination=pagination)
+
+
+@web_api.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Displays status and progress of a background job. The page reloads
+    itself until the job is done and then links to the result of the job.
+    :param job_id: id of job.
+    :return:
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        abort(404)
+    return render_template('job_status.html', job=job)
+
+
 @web_api.route('/')
 def root():
     """
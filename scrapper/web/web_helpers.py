@@ -3,11 +3,28 @@ This file contains helper functions to be used in implementing the endpoints
 for web api.
 """
 import os
+import time
+import base64
+import bisect
 import shutil
 import zipfile
-from flask import current_app, send_from_directory
+import tempfile
+from functools import partial
+from flask import current_app
 from . import web_logger
-from ..procedures.scrapping_functions import download_images
+from ..procedures.scrapping_functions import download_images, \
+    download_image, get_cached_image_urls
+from ..procedures.download_engine import DownloadEngine
+from ..procedures.helpers import ByteBudget
+from ..procedures.naming import Manifest, MANIFEST_NAME, url_hash, \
+    temporary_file, commit_file
+from ..procedures.crawler import Crawler
+from ..procedures.metrics import ZIP_CREATION_SECONDS
+from ..exceptions import ValidationError
+
+# Formats which are compressed already. These are stored in zip archives as
+# they are, since deflating them costs CPU without making them smaller.
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
 
 try:
     # Python 3
@@ -26,8 +43,7 @@ def get_netloc_from_url(url):
     try:
         return urlparse(url).netloc
     except Exception as ex:
-        web_logger.error('Error {err} while parsing {url}'.format(err=ex,
-                                                                  url=url))
+        web_logger.error('Error %s while parsing %s', ex, url)
         return None
 
 
@@ -40,51 +56,216 @@ def store_urls_to_file(filename, urls=None):
     """
     if urls is None or filename is None:
         web_logger.warning('Please provide valid URL set to be written to a '
-                           'valid file. Provided urls={urls}, \nfile='
-                           '{file}'.format(urls=urls, file=filename))
+                           'valid file. Provided urls=%s, \nfile=%s', urls,
+                           filename)
         return 0
     success = 0
+    tmp_filename = None
     try:
-        f = open(filename, 'w+')
-        for url in urls:
-            f.write(url+'\n')
-            success += 1
-        f.close()
+        # Write to temporary file, so the file is never seen partly written.
+        tmp_filename = temporary_file(filename)
+        with open(tmp_filename, 'w') as f:
+            for url in urls:
+                f.write(url+'\n')
+                success += 1
+        commit_file(tmp_filename, filename)
     except Exception as ex:
-        web_logger.error('Unable to store image urls to file={file}.'
-                         'Error={err}'.format(file=filename, err=ex))
-        pass
+        web_logger.error('Unable to store image urls to file=%s.Error=%s',
+                         filename, ex)
+        if tmp_filename is not None and os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        success = 0
     return success
 
 
-def create_files_folder(path, change_to_directory=True):
+def read_urls_from_file(filename, max_age=None):
+    """
+    This function reads list of urls written by store_urls_to_file.
+    :param filename: File where urls are stored.
+    :param max_age: maximum age of file in seconds (default=None i.e. any).
+    :return: List of urls, None if file does not exist, is older than max_age
+    or cannot be read.
+    """
+    try:
+        if max_age is not None and \
+                time.time() - os.path.getmtime(filename) > max_age:
+            return None
+        with open(filename) as f:
+            return [line.rstrip('\n') for line in f if line.strip()]
+    except (IOError, OSError):
+        return None
+
+
+def url_list_filename(url):
+    """
+    This function returns the file in FILES_DIR where the list of image urls
+    of given web page is stored, named after the net location of web page and
+    hash of its url e.g. files/example.com-3f2a9c0b1d.txt
+    :param url: web page url
+    :return:
+    """
+    return files_path('{netloc}-{digest}.txt'.format(
+        netloc=get_netloc_from_url(url), digest=url_hash(url)))
+
+
+def files_path(*paths):
+    """
+    This function returns the absolute path of given path inside FILES_DIR.
+    Paths are never relative to the current working directory, which is
+    shared by all threads of the process.
+    :param paths: path components inside FILES_DIR.
+    :return: absolute path.
+    """
+    return os.path.abspath(os.path.join(current_app.config['APP_WD'],
+                                        current_app.config['FILES_DIR'],
+                                        *paths))
+
+
+def encode_cursor(url):
+    """
+    Returns the opaque cursor pointing after given url in a sorted url list.
+    """
+    return base64.urlsafe_b64encode(url.encode('utf-8')).decode('ascii') \
+        .rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the url given by a cursor (see encode_cursor).
+    :raises ValidationError: if cursor is not valid.
+    """
+    try:
+        url = base64.urlsafe_b64decode(
+            str(cursor + '=' * (-len(cursor) % 4))).decode('utf-8')
+    except (TypeError, ValueError) as ex:
+        raise ValidationError('Invalid cursor={cursor}. Error={err}'.format(
+            cursor=cursor, err=ex))
+    # Characters outside the base64 alphabet are skipped when decoding.
+    if encode_cursor(url) != cursor.rstrip('='):
+        raise ValidationError('Invalid cursor={cursor}'.format(
+            cursor=cursor))
+    return url
+
+
+def paginate_urls(urls, cursor=None, limit=None):
+    """
+    This function returns a page of urls in sorted order, following the url
+    given by cursor. Cursors stay valid when urls are added or removed, unlike
+    page numbers.
+    :param urls: iterable of urls.
+    :param cursor: cursor returned with previous page (default=None i.e.
+    first page).
+    :param limit: number of urls per page (default=LINKS_PER_PAGE).
+    :return: tuple (list of urls, cursor of next page or None if this is the
+    last page)
+    """
+    if limit is None or limit < 1:
+        limit = current_app.config['LINKS_PER_PAGE']
+    urls = sorted(urls)
+    start = bisect.bisect_right(urls, decode_cursor(cursor)) if cursor else 0
+    page = urls[start:start + limit]
+    if start + limit < len(urls):
+        return page, encode_cursor(page[-1])
+    return page, None
+
+
+class UrlPagination(object):
+    """
+    Numbered page of sorted urls, with the attributes used by the
+    pagination_widget macro.
+    :param urls: iterable of urls.
+    :param page: number of page, starting from 1.
+    :param per_page: number of urls per page (default=LINKS_PER_PAGE).
+    """
+    def __init__(self, urls, page=1, per_page=None):
+        urls = sorted(urls)
+        self.per_page = per_page or current_app.config['LINKS_PER_PAGE']
+        self.total = len(urls)
+        self.pages = max(1, -(-self.total // self.per_page))
+        self.page = min(max(1, page), self.pages)
+        start = (self.page - 1) * self.per_page
+        self.items = urls[start:start + self.per_page]
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def next_num(self):
+        return self.page + 1
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=5,
+                   right_edge=2):
+        """
+        Yields the numbers of pages shown in pagination widget, and None for
+        gaps between them.
+        """
+        last = 0
+        for num in range(1, self.pages + 1):
+            if num <= left_edge or \
+                    self.page - left_current - 1 < num < \
+                    self.page + right_current or \
+                    num > self.pages - right_edge:
+                if last + 1 != num:
+                    yield None
+                yield num
+                last = num
+
+
+def create_files_folder(path):
     """
     This function creates the directories on the given path if they don't exist.
     :param path: Path for directory creation
-    :param change_to_directory: Flag indicating whether program should switch
-    to given directory as working directory. (default=True)
     :return:
     """
     try:
-        if not os.path.exists(path):
+        if not os.path.isdir(path):
             os.makedirs(path)
-            web_logger.info('{dir} created for storing images'.format(
-                dir=path))
-        if change_to_directory:
-            os.chdir(path)
+            web_logger.info('%s created for storing images', path)
         return True
     except OSError as os_ex:
-        web_logger.error('Cannot create requested directory={dir} to store '
-                         'files. Error={err}'.format(dir=path, err=os_ex))
+        # Directory may have been created by another request meanwhile.
+        if os.path.isdir(path):
+            return True
+        web_logger.error('Cannot create requested directory=%s to store '
+                         'files. Error=%s', path, os_ex)
         return False
     except Exception as ex:
-        web_logger.error(
-            'Error={err} while creating default directory for storing files '
-            'i.e.dir={dir}'.format(err=ex, dir=current_app.config['FILES_DIR']))
+        web_logger.error('Error=%s while creating default directory for '
+                         'storing files i.e.dir=%s', ex,
+                         current_app.config['FILES_DIR'])
         return False
 
 
-def send_files_to_user(url_name=None, urls=None):
+def create_job_folder(url_name):
+    """
+    This function creates a new directory for the files of a single request
+    or job, inside TEMP_SUBFOLDER of FILES_DIR. Every call gets a directory of
+    its own, so concurrent requests for the same website never share files.
+    :param url_name: name of website, used as prefix of directory name.
+    :return: absolute path of directory, None if it could not be created.
+    """
+    tmp_files_dir = files_path(current_app.config['TEMP_SUBFOLDER'])
+    if not create_files_folder(tmp_files_dir):
+        return None
+    try:
+        return tempfile.mkdtemp(prefix=(url_name or 'images') + '-',
+                                dir=tmp_files_dir)
+    except OSError as ex:
+        web_logger.error('Unable to create folder in=%s for storing content. '
+                         'Error=%s', tmp_files_dir, ex)
+        return None
+
+
+def send_files_to_user(url_name=None, urls=None, progress=None):
     """
     This function downloads the images given in the list of urls, stores them
     in temporary folder and generates a zip file containing all those
@@ -93,41 +274,79 @@ def send_files_to_user(url_name=None, urls=None):
     :param url_name: name of website from which the image resources links are
     scrapped.
     :param urls: list of urls to image resources.
-    :return:
+    :param progress: function called with success of each image download.
+    :return: absolute path of zip file, None if it could not be created. The
+    zip file is removed by the caller once it is opened (see remove_file).
     """
-    # Establish directory to store the downloaded images.
-    tmp_files_dir = current_app.config['TEMP_SUBFOLDER']
+    # Create the folder for storing the images of this request only.
+    job_dir = create_job_folder(url_name)
+    if job_dir is None:
+        return None
+    try:
+        # Store file with list of URLs to the repo
+        store_urls_to_file(os.path.join(job_dir, url_name + '.txt'),
+                           urls=urls)
+        web_logger.info('Successfully stored list of %s image urls to file=%s',
+                        len(urls), url_name+'.txt')
+        # Download Images
+        stats = download_images(urls, dest_dir=job_dir, progress=progress)
+        web_logger.info('Successfully downloaded %s images and failed to '
+                        'download %s images from given website=%s',
+                        stats['success'], stats['fail'], url_name)
 
-    # Create the folder for storing the images.
-    if not create_files_folder(tmp_files_dir+url_name):
-        web_logger.error('Unable to create folder at={dir} for storing '
-                         'content.'.format(dir=tmp_files_dir+url_name))
+        manifest = stats['manifest']
+        if current_app.config.get('NEAR_DUPLICATE_REMOVAL'):
+            manifest.discard(remove_near_duplicate_images(
+                job_dir, exclude=[url_name + '.txt']))
+        # Names of stored images by url.
+        manifest.write(job_dir)
+
+        # Zip the downloaded images, next to the folder of this request.
+        zip_filename = job_dir + '.zip'
+        with ZIP_CREATION_SECONDS.time(host=url_name):
+            zipped = zip_directory_to_file(zip_filename, path=job_dir)
+        if zipped:
+            return zip_filename
         return None
+    finally:
+        # Remove temporary files
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def remove_file(filename):
+    """
+    This function removes a file created for a request (e.g. zip file sent to
+    user), once it is not needed anymore.
+    :param filename: path of file.
+    """
+    try:
+        os.remove(filename)
+    except OSError as ex:
+        web_logger.warning('Unable to remove file=%s. Error=%s', filename, ex)
 
-    # Store file with list of URLs to the repo
-    store_urls_to_file(url_name + '.txt', urls=urls)
-    web_logger.info('Successfully stored list of {count}image urls to file='
-                    '{filename}'.format(count=len(urls),
-                                        filename=url_name+'.txt'))
-    # Download Images
-    stats = download_images(urls)
-    web_logger.info('Successfully downloaded {succ} images and failed to '
-                    'download {f} images from given website='
-                    '{url}'.format(succ=stats['success'], f=stats['fail'],
-                                   url=url_name))
-
-    # Zip the downloaded images
-    zip_filename = os.path.dirname(os.getcwd()) + '/' + url_name + '.zip'
-    if zip_directory_to_file(zip_filename, path=os.getcwd()):
-        os.chdir(os.path.dirname(os.getcwd()))
-        shutil.rmtree(url_name, ignore_errors=True)
-        os.chdir(current_app.config['APP_WD'])
-        return zip_filename
-    # Remove temporary files
-    os.chdir(os.path.dirname(os.getcwd()))
-    shutil.rmtree(url_name, ignore_errors=True)
-    os.chdir(current_app.config['APP_WD'])
-    return None
+
+def remove_near_duplicate_images(path, exclude=()):
+    """
+    This function removes near-duplicate images (e.g. same image in several
+    sizes) among the images downloaded to a directory, keeping the largest
+    one of each.
+    :param path: directory containing downloaded images.
+    :param exclude: names of files which are not images e.g. url list.
+    :return: list of removed files.
+    """
+    try:
+        from scrapper.procedures.dedup import remove_near_duplicates
+    except ImportError as ex:
+        web_logger.error('Unable to remove near-duplicate images, numpy and '
+                         'Pillow are required (see requirements-dedup.txt). '
+                         'Error=%s', ex)
+        return []
+    filenames = [os.path.join(path, name) for name in os.listdir(path)
+                 if name not in exclude]
+    return remove_near_duplicates(
+        filenames,
+        max_distance=current_app.config.get('NEAR_DUPLICATE_DISTANCE', 4),
+        hash_size=current_app.config.get('NEAR_DUPLICATE_HASH_SIZE', 8))
 
 
 def zip_directory_to_file(filename, path):
@@ -141,15 +360,167 @@ def zip_directory_to_file(filename, path):
         zipf = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
         for root, dirs, files in os.walk(path):
             for file in files:
-                web_logger.debug("archiving file {f}".format(f=file))
-                zipf.write(file, os.path.relpath(file, root))
+                web_logger.debug('archiving file %s', file)
+                zipf.write(os.path.join(root, file),
+                           os.path.relpath(os.path.join(root, file), path),
+                           compress_type=get_compress_type(file))
         zipf.close()
-        web_logger.info('Contents of {dir} zipped successfully to '
-                        '{fname}'.format(dir=path, fname=filename))
+        web_logger.info('Contents of %s zipped successfully to %s', path,
+                        filename)
         return True
     except Exception as ex:
-        web_logger.error('Cannot zip contents of dir={dir} to filename='
-                         '{fname}. Error={err}'.format(dir=path,
-                                                       fname=filename,
-                                                       err=ex))
+        web_logger.error('Cannot zip contents of dir=%s to filename=%s. '
+                         'Error=%s', path, filename, ex)
         return None
+
+
+def get_compress_type(filename):
+    """
+    This function returns the compression used for storing given file in a
+    zip archive. Already compressed image formats are stored as they are.
+    :param filename: name of file.
+    :return: zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+    """
+    if os.path.splitext(filename)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class ZipStream(object):
+    """
+    Write-only file object for zipfile.ZipFile which keeps the written bytes
+    until they are taken out with pop(). It is not seekable, so zipfile writes
+    the archive sequentially and it can be sent to user while being built.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """
+        Returns the bytes written since last call and discards them.
+        """
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_files_to_user(url_name=None, urls=None):
+    """
+    This function downloads the images given in the list of urls and yields a
+    zip archive containing them piece by piece. Each image is appended to the
+    archive as soon as its download finishes, so the user starts receiving the
+    archive with the first image instead of after the whole job.
+    Must be iterated within an application context (see stream_with_context).
+    :param url_name: name of website from which the image resources links are
+    scrapped.
+    :param urls: list of urls to image resources.
+    :return: generator of bytes of the zip archive.
+    """
+    job_dir = create_job_folder(url_name)
+    if job_dir is None:
+        return
+    engine = DownloadEngine.from_config(current_app.config)
+    budget = ByteBudget(current_app.config.get('MAX_JOB_BYTES'))
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED)
+    success = failed = 0
+    manifest = Manifest()
+    archived = set()
+    try:
+        # List of urls is the first entry of archive.
+        archive.writestr(url_name + '.txt',
+                         ''.join(url + '\n' for url in urls))
+        yield stream.pop()
+        for result in engine.iter_download(
+                urls, partial(download_image, dest_dir=job_dir,
+                              budget=budget)):
+            if not result.success:
+                failed += 1
+                continue
+            success += 1
+            if result.filename is None:
+                continue
+            manifest.add(result.url, result.filename)
+            name = os.path.basename(result.filename)
+            if name in archived:
+                # Identical data uri archived already.
+                continue
+            archived.add(name)
+            archive.write(result.filename, name,
+                          compress_type=get_compress_type(result.filename))
+            os.remove(result.filename)
+            data = stream.pop()
+            if data:
+                yield data
+        # Names of archived images by url is the last entry.
+        archive.writestr(MANIFEST_NAME, manifest.to_json())
+        archive.close()
+        yield stream.pop()
+        web_logger.info('Streamed %s images to user and failed to download '
+                        '%s images from given website=%s', success, failed,
+                        url_name)
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def scrape_urls_task(job):
+    """
+    Job task retrieving urls of image resources loaded in job's web page.
+    The urls are stored to a file in FILES_DIR as well.
+    :param job: Job object.
+    :return: sorted list of urls.
+    """
+    urls = sorted(get_cached_image_urls(job.url)[0])
+    job.set_total(len(urls))
+    create_files_folder(files_path())
+    filename = url_list_filename(job.url)
+    if store_urls_to_file(filename, urls):
+        job.files.append(filename)
+    return urls
+
+
+def scrape_images_task(job):
+    """
+    Job task downloading the images loaded in job's web page to a zip file.
+    :param job: Job object.
+    :return: filename of zip file.
+    """
+    urls = get_cached_image_urls(job.url)[0]
+    job.set_total(len(urls))
+    zip_filename = send_files_to_user(url_name=get_netloc_from_url(job.url),
+                                      urls=urls,
+                                      progress=job.update_progress)
+    if zip_filename is None:
+        raise IOError('Unable to create zip file of images from webpage='
+                      '{url}'.format(url=job.url))
+    job.files.append(zip_filename)
+    return zip_filename
+
+
+def crawl_task(job):
+    """
+    Job task crawling the website of job's web page and retrieving urls of
+    image resources loaded in all crawled pages.
+    :param job: Job object.
+    :return: sorted list of urls.
+    """
+    crawler = Crawler.from_config(job.url, current_app.config)
+    job.set_total(crawler.max_pages)
+    result = crawler.crawl(progress=job.update_progress)
+    job.set_total(len(result.pages) + len(result.errors))
+    return sorted(result.image_urls)
+
+
+# Tasks which can be run as jobs, by type of job.
+JOB_TASKS = {
+    'url_list': scrape_urls_task,
+    'images': scrape_images_task,
+    'crawl': crawl_task
+}
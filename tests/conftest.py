@@ -0,0 +1,31 @@
+"""
+Fixtures shared by the tests: an application created with TestingConfig,
+working in a temporary directory, and the fake web server of the benchmarks.
+"""
+import pytest
+from scrapper import create_app
+from benchmarks.fake_server import FakeServer, NetworkConditions
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app('testing', APP_WD=str(tmp_path), LOG_FILES={},
+                     LOG_DIR=str(tmp_path / 'logs'), HTTP_RETRIES=0,
+                     IMAGE_CACHE_ENABLED=False, ROBOTS_ENABLED=False)
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture(scope='session')
+def server():
+    with FakeServer() as server:
+        yield server
+
+
+@pytest.fixture(scope='session')
+def failing_server():
+    """
+    Fake web server answering every image request with 503.
+    """
+    with FakeServer(NetworkConditions(error_rate=1.0)) as server:
+        yield server
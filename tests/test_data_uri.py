@@ -0,0 +1,90 @@
+"""
+Tests of decoding images from data uris.
+"""
+import os
+import base64
+import pytest
+from scrapper.procedures.helpers import ByteBudget, save_image_from_uri, \
+    decode_data_uri
+from scrapper.procedures.scrapping_functions import \
+    get_image_urls_from_webpage, download_images
+
+
+def data_uri(data, content_type='image/png'):
+    return 'data:{type};base64,{data}'.format(
+        type=content_type, data=base64.b64encode(data).decode('ascii'))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 5, 1024])
+def test_decode_data_uri(chunk_size):
+    data = os.urandom(100)
+    uri = data_uri(data)
+    chunks = list(decode_data_uri(uri, uri.index(',') + 1, True, chunk_size))
+    assert b''.join(chunks) == data
+    # Base64 wrapped on several lines.
+    encoded = base64.encodebytes(data).decode('ascii')
+    uri = 'data:image/png;base64,' + encoded
+    chunks = decode_data_uri(uri, uri.index(',') + 1, True, chunk_size)
+    assert b''.join(chunks) == data
+    uri = 'data:image/svg+xml,%3Csvg%2F%3E'
+    chunks = decode_data_uri(uri, uri.index(',') + 1, False, chunk_size)
+    assert b''.join(chunks) == b'<svg/>'
+
+
+def test_images_are_named_after_content(app, tmp_path):
+    uri = data_uri(b'image data')
+    filename = save_image_from_uri(uri, dest_dir=str(tmp_path))
+    assert os.path.basename(filename).startswith('uri-')
+    assert filename.endswith('.png')
+    with open(filename, 'rb') as f:
+        assert f.read() == b'image data'
+    # Identical images are stored once.
+    assert save_image_from_uri(uri, dest_dir=str(tmp_path)) == filename
+    other = save_image_from_uri(data_uri(b'other data', 'image/svg+xml'),
+                                dest_dir=str(tmp_path))
+    assert other != filename and other.endswith('.svg')
+    assert sorted(os.listdir(str(tmp_path))) == \
+        sorted(os.path.basename(name) for name in (filename, other))
+
+
+def test_images_over_size_limit_are_not_stored(app, tmp_path):
+    assert save_image_from_uri(data_uri(b'x' * 100), dest_dir=str(tmp_path),
+                               max_bytes=99) is None
+    assert save_image_from_uri(data_uri(b'x' * 100), dest_dir=str(tmp_path),
+                               max_bytes=100) is not None
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_invalid_uris_are_not_stored(app, tmp_path):
+    assert save_image_from_uri('data:text/html,<p>', str(tmp_path)) is None
+    assert save_image_from_uri('data:image/png;base64,!!!',
+                               str(tmp_path)) is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_images_are_counted_in_budget(app, tmp_path):
+    budget = ByteBudget(150)
+    assert save_image_from_uri(data_uri(b'a' * 100), str(tmp_path),
+                               budget=budget) is not None
+    assert save_image_from_uri(data_uri(b'b' * 100), str(tmp_path),
+                               budget=budget) is None
+    # Failed images do not use the budget.
+    budget = ByteBudget(150)
+    save_image_from_uri('data:image/png;base64,!!!!' * 20, str(tmp_path),
+                        budget=budget)
+    assert budget.used == 0
+
+
+def test_data_uris_of_page_are_downloaded(app, server, tmp_path):
+    app.config['MAX_IMAGE_BYTES'] = 1500
+    urls = get_image_urls_from_webpage(
+        server.url('/synthetic/data_uri/3/1000'))
+    assert len(urls) == 3
+    stats = download_images(urls, dest_dir=str(tmp_path))
+    assert len(stats['manifest'].to_dict()) == 3
+    assert len(os.listdir(str(tmp_path))) == 3
+    # Images over MAX_IMAGE_BYTES are skipped.
+    urls = get_image_urls_from_webpage(
+        server.url('/synthetic/data_uri/3/2000'))
+    stats = download_images(urls, dest_dir=str(tmp_path / 'large'))
+    assert len(stats['manifest'].to_dict()) == 0
@@ -0,0 +1,82 @@
+"""
+Tests of the concurrency limits of the download engine.
+"""
+import time
+import threading
+from scrapper.procedures.download_engine import DownloadEngine
+
+
+class ConcurrencyRecorder(object):
+    """
+    Download function recording the largest number of calls running at the
+    same time, in total and for each host.
+    """
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.host_running = {}
+        self.max_host_running = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        host = DownloadEngine._host(url)
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.host_running[host] = self.host_running.get(host, 0) + 1
+            self.max_host_running[host] = max(
+                self.max_host_running.get(host, 0), self.host_running[host])
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+            self.host_running[host] -= 1
+        return url
+
+
+def urls(hosts, count):
+    return ['http://{host}/{i}.jpg'.format(host=host, i=i)
+            for host in hosts for i in range(count)]
+
+
+def test_global_limit(app):
+    recorder = ConcurrencyRecorder()
+    engine = DownloadEngine(max_workers=3, per_host_limit=10)
+    results = engine.download(urls(['a', 'b', 'c', 'd'], 3), recorder)
+    assert len(results) == 12
+    assert all(result.success for result in results)
+    assert recorder.max_running == 3
+
+
+def test_per_host_limit(app):
+    recorder = ConcurrencyRecorder()
+    engine = DownloadEngine(max_workers=8, per_host_limit=2)
+    engine.download(urls(['a', 'b'], 6), recorder)
+    assert recorder.max_host_running == {'a': 2, 'b': 2}
+    assert recorder.max_running == 4
+
+
+def test_busy_host_does_not_block_others(app):
+    recorder = ConcurrencyRecorder()
+    engine = DownloadEngine(max_workers=4, per_host_limit=1)
+    # Urls of host a come first, but b, c and d are downloaded meanwhile.
+    engine.download(urls(['a'], 4) + urls(['b', 'c', 'd'], 1), recorder)
+    assert recorder.max_host_running['a'] == 1
+    assert recorder.max_running == 4
+
+
+def test_data_uris_are_not_bound_to_a_host(app):
+    recorder = ConcurrencyRecorder()
+    engine = DownloadEngine(max_workers=4, per_host_limit=1)
+    engine.download(['data:image/png;base64,{i}'.format(i=i)
+                     for i in range(8)], recorder)
+    assert recorder.max_running == 4
+
+
+def test_failures_are_reported(app):
+    def fail(url):
+        raise IOError('failed ' + url)
+    results = DownloadEngine(max_workers=2).download(urls(['a'], 3), fail)
+    assert [result.success for result in results] == [False] * 3
+    assert all(isinstance(result.error, IOError) for result in results)
+
@@ -0,0 +1,104 @@
+"""
+Tests of streaming downloads to disk, their size caps and the byte budget of
+jobs.
+"""
+import os
+import pytest
+from scrapper.exceptions import DownloadLimitExceeded, DownloadError
+from scrapper.procedures.helpers import ByteBudget, fetch_to_file, \
+    stream_response_to_file
+from scrapper.procedures.scrapping_functions import download_images
+
+
+class FakeResponse(object):
+    """
+    Streamed response without Content-Length.
+    """
+    def __init__(self, chunks, status_code=200):
+        self.url = 'http://example.com/image.jpg'
+        self.status_code = status_code
+        self.headers = {}
+        self.chunks = chunks
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_fetch_to_file(app, server, tmp_path):
+    filename = str(tmp_path / 'image.jpg')
+    written = fetch_to_file(server.url('/img/a.jpg'), filename)
+    assert written == os.path.getsize(filename) > 0
+    assert os.listdir(str(tmp_path)) == ['image.jpg']
+
+
+@pytest.mark.parametrize('path', ['/img/a.jpg', '/missing.jpg'])
+def test_error_status_is_not_stored(app, failing_server, tmp_path, path):
+    filename = str(tmp_path / 'image.jpg')
+    with pytest.raises(DownloadError):
+        fetch_to_file(failing_server.url(path), filename)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_error_status_counts_as_failure(app, failing_server, tmp_path):
+    stats = download_images([failing_server.url('/img/a.jpg'),
+                             failing_server.url('/missing.jpg')],
+                            dest_dir=str(tmp_path))
+    assert (stats['success'], stats['fail']) == (0, 2)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_content_length_over_cap(app, server, tmp_path):
+    filename = str(tmp_path / 'image.jpg')
+    with pytest.raises(DownloadLimitExceeded):
+        fetch_to_file(server.url('/img/a.jpg'), filename, max_bytes=10)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_streamed_body_over_cap(tmp_path):
+    response = FakeResponse([b'x' * 10] * 5)
+    with pytest.raises(DownloadLimitExceeded):
+        stream_response_to_file(response, str(tmp_path / 'image.jpg'),
+                                max_bytes=25)
+    assert response.closed
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_budget():
+    budget = ByteBudget(100)
+    budget.consume(60)
+    budget.check(40)
+    with pytest.raises(DownloadLimitExceeded):
+        budget.consume(41)
+    assert budget.used == 60
+    budget.release(60)
+    budget.consume(100)
+
+
+def test_unlimited_budget():
+    budget = ByteBudget()
+    budget.consume(10 ** 12)
+
+
+def test_budget_of_abandoned_download_is_released(tmp_path):
+    budget = ByteBudget(100)
+    response = FakeResponse([b'x' * 30] * 3)
+    with pytest.raises(DownloadLimitExceeded):
+        stream_response_to_file(response, str(tmp_path / 'a.jpg'),
+                                max_bytes=50, budget=budget)
+    assert budget.used == 0
+    written = stream_response_to_file(FakeResponse([b'x' * 30] * 3),
+                                      str(tmp_path / 'b.jpg'), budget=budget)
+    assert written == budget.used == 90
+
+
+def test_budget_exhausted(tmp_path):
+    budget = ByteBudget(50)
+    with pytest.raises(DownloadLimitExceeded):
+        stream_response_to_file(FakeResponse([b'x' * 30] * 2),
+                                str(tmp_path / 'a.jpg'), budget=budget)
+    assert budget.used == 0
+    assert os.listdir(str(tmp_path)) == []
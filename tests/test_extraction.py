@@ -0,0 +1,46 @@
+"""
+Tests of extraction of image links from web pages.
+"""
+import unittest
+from scrapper.procedures.extraction import extract_from_chunks
+
+
+def extract(html):
+    collector = extract_from_chunks([html.encode('utf-8')])
+    return collector.image_urls + collector.data_src_urls + \
+        collector.extra_urls
+
+
+class SrcsetTestCase(unittest.TestCase):
+
+    def test_img_srcset_replaces_src(self):
+        self.assertEqual(extract(
+            '<html><body><img src="a.jpg" srcset="a-1x.jpg 1x, a-2x.jpg 2x">'
+            '</body></html>'), ['a-2x.jpg'])
+
+    def test_img_data_srcset_replaces_data_src(self):
+        self.assertEqual(extract(
+            '<html><body><img data-src="a.jpg" '
+            'data-srcset="a-small.jpg 300w, a-large.jpg 900w"></body></html>'),
+            ['a-large.jpg'])
+
+    def test_img_without_srcset_keeps_src(self):
+        self.assertEqual(extract(
+            '<html><body><img src="a.jpg"></body></html>'), ['a.jpg'])
+
+    def test_picture_gives_single_image(self):
+        self.assertEqual(extract(
+            '<html><body><picture>'
+            '<source type="image/webp" srcset="b.webp 1x, b-2x.webp 2x">'
+            '<source type="image/jpeg" srcset="b.jpg 1x, b-2x.jpg 2x">'
+            '<img src="b-fallback.jpg"></picture>'
+            '<img src="c.jpg"></body></html>'), ['c.jpg', 'b-2x.webp'])
+
+    def test_picture_without_sources_keeps_img(self):
+        self.assertEqual(extract(
+            '<html><body><picture><img src="b.jpg"></picture></body></html>'),
+            ['b.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Tests of the content-addressed image cache, and of its use by download_image.
+"""
+import os
+import pytest
+from benchmarks.fake_server import FakeServer, NetworkConditions
+from scrapper import create_app
+from scrapper.exceptions import DownloadError
+from scrapper.procedures.image_cache import ImageCache, get_image_cache
+from scrapper.procedures.scrapping_functions import download_image
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ImageCache(str(tmp_path / 'cache'), max_bytes=100)
+
+
+def test_store_and_copy(cache, tmp_path):
+    cache.store('http://a/1.jpg', write(str(tmp_path / '1.jpg'), b'one'))
+    assert 'http://a/1.jpg' in cache
+    assert 'http://a/2.jpg' not in cache
+    copy = str(tmp_path / 'copy.jpg')
+    assert cache.copy_to('http://a/1.jpg', copy)
+    with open(copy, 'rb') as f:
+        assert f.read() == b'one'
+    assert not cache.copy_to('http://a/2.jpg', copy)
+
+
+def test_same_content_is_stored_once(cache, tmp_path):
+    cache.store('http://a/1.jpg', write(str(tmp_path / '1.jpg'), b'same'))
+    cache.store('http://b/1.jpg', write(str(tmp_path / '2.jpg'), b'same'))
+    stats = cache.stats()
+    assert (stats['images'], stats['urls'], stats['bytes']) == (1, 2, 4)
+
+
+def test_least_recently_used_images_are_evicted(cache, tmp_path):
+    for name in ('a', 'b', 'c'):
+        cache.store('http://a/' + name, write(str(tmp_path / name),
+                                              name.encode() * 40))
+        if name == 'b':
+            # a is used again, so b is the least recently used image.
+            cache.lookup('http://a/a')
+    assert 'http://a/a' in cache
+    assert 'http://a/b' not in cache
+    assert 'http://a/c' in cache
+    assert cache.stats()['bytes'] == 80
+
+
+def test_index_is_reloaded(cache, tmp_path):
+    cache.store('http://a/1.jpg', write(str(tmp_path / '1.jpg'), b'one'))
+    cache.save()
+    reloaded = ImageCache(cache.root, max_bytes=100)
+    assert 'http://a/1.jpg' in reloaded
+    assert reloaded.stats()['bytes'] == 3
+
+
+def test_orphaned_images_are_removed(cache, tmp_path):
+    digest = cache.store('http://a/1.jpg',
+                         write(str(tmp_path / '1.jpg'), b'one'))
+    # Index is not saved, so the stored image has no known url.
+    reloaded = ImageCache(cache.root, max_bytes=100)
+    assert reloaded.stats()['images'] == 0
+    assert not os.path.exists(reloaded.blob_path(digest))
+
+
+@pytest.fixture
+def caching_server():
+    with FakeServer(NetworkConditions(max_age=60)) as server:
+        yield server
+
+
+@pytest.fixture
+def cache_app(tmp_path):
+    app = create_app('testing', APP_WD=str(tmp_path), LOG_FILES={},
+                     LOG_DIR=str(tmp_path / 'logs'), HTTP_RETRIES=0,
+                     IMAGE_CACHE_SAVE_INTERVAL=None)
+    with app.app_context():
+        yield app
+
+
+def test_fresh_images_are_reused(cache_app, caching_server, tmp_path):
+    url = caching_server.url('/img/reused.jpg')
+    first = download_image(url, dest_dir=str(tmp_path))
+    second_dir = tmp_path / 'second'
+    second_dir.mkdir()
+    second = download_image(url, dest_dir=str(second_dir))
+    assert caching_server.requests['/img/reused.jpg'] == 1
+    with open(first, 'rb') as f1, open(second, 'rb') as f2:
+        assert f1.read() == f2.read()
+
+
+def test_images_without_validators_are_not_cached(cache_app, server,
+                                                  tmp_path):
+    download_image(server.url('/img/uncached.jpg'), dest_dir=str(tmp_path))
+    assert get_image_cache().stats()['images'] == 0
+
+
+def test_error_bodies_are_not_cached(cache_app, failing_server, tmp_path):
+    with pytest.raises(DownloadError):
+        download_image(failing_server.url('/img/error.jpg'),
+                       dest_dir=str(tmp_path))
+    assert get_image_cache().stats()['images'] == 0
+
+
+def test_cache_needs_revalidation(tmp_path):
+    app = create_app('testing', APP_WD=str(tmp_path), LOG_FILES={},
+                     LOG_DIR=str(tmp_path / 'logs'),
+                     REVALIDATION_ENABLED=False)
+    assert app.extensions['image_cache'] is None
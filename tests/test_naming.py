@@ -0,0 +1,63 @@
+"""
+Tests of the naming of downloaded images and of the manifest of a job.
+"""
+import os
+import json
+from scrapper.procedures.naming import url_filename, write_file, Manifest, \
+    MAX_STEM_LENGTH
+from scrapper.procedures.scrapping_functions import download_images
+
+
+def test_same_basename_gives_distinct_names():
+    urls = ['http://a/x/image.jpg', 'http://a/y/image.jpg',
+            'http://b/x/image.jpg', 'http://a/x/image.jpg?w=2']
+    names = [url_filename(url) for url in urls]
+    assert len(set(names)) == len(urls)
+    assert all(name.startswith('image-') and name.endswith('.jpg')
+               for name in names)
+
+
+def test_names_are_stable():
+    assert url_filename('http://a/x/image.jpg') == \
+        url_filename('http://a/x/image.jpg')
+
+
+def test_names_are_safe():
+    name = url_filename('http://a/x/my%20photo%2F..%2Fpasswd.JPG')
+    assert '/' not in name and ' ' not in name
+    assert name.startswith('my_photo_.._passwd-') and name.endswith('.jpg')
+    assert url_filename('http://a/x/..').startswith('image-')
+    assert url_filename('http://a/').startswith('image-')
+    assert url_filename('http://a/', default_stem='page').startswith('page-')
+    assert len(url_filename('http://a/' + 'x' * 300 + '.png')) == \
+        MAX_STEM_LENGTH + len('-0123456789.png')
+
+
+def test_write_file_leaves_no_temporary_file(tmp_path):
+    filename = str(tmp_path / 'image.jpg')
+    write_file(filename, b'old')
+    write_file(filename, b'new')
+    with open(filename, 'rb') as f:
+        assert f.read() == b'new'
+    assert os.listdir(str(tmp_path)) == ['image.jpg']
+
+
+def test_manifest(tmp_path):
+    manifest = Manifest()
+    manifest.add('http://a/1.jpg', '/files/1.jpg')
+    manifest.add('http://a/2.jpg', '/files/2.jpg')
+    manifest.discard(['/other/1.jpg'])
+    assert len(manifest) == 1
+    filename = manifest.write(str(tmp_path))
+    with open(filename) as f:
+        assert json.load(f) == {'http://a/2.jpg': '2.jpg'}
+
+
+def test_images_with_same_basename_are_all_stored(app, server, tmp_path):
+    urls = [server.url('/img/{i}/image.jpg'.format(i=i)) for i in range(5)]
+    stats = download_images(urls, dest_dir=str(tmp_path))
+    assert stats['success'] == 5
+    names = stats['manifest'].to_dict()
+    assert [names[url] for url in urls] == \
+        [url_filename(url) for url in urls]
+    assert sorted(os.listdir(str(tmp_path))) == sorted(names.values())
@@ -0,0 +1,99 @@
+"""
+Tests of the pagination of image urls of a web page, with cursors in the REST
+api and page numbers in the web interface.
+"""
+import os
+import time
+import pytest
+from scrapper.exceptions import ValidationError
+from scrapper.web.web_helpers import encode_cursor, decode_cursor, \
+    paginate_urls, UrlPagination, store_urls_to_file, read_urls_from_file
+
+URLS = ['http://a/{i:02d}.jpg'.format(i=i) for i in range(25)]
+
+
+@pytest.mark.parametrize('url', ['http://a/1.jpg', 'http://a/été',
+                                 'data:image/png;base64,AAAA', ''])
+def test_cursor_round_trip(url):
+    cursor = encode_cursor(url)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == url
+
+
+@pytest.mark.parametrize('cursor', ['!!!', 'a', 'aHR0cDovL2E-!', 'é'])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValidationError):
+        decode_cursor(cursor)
+
+
+def test_paginate_urls(app):
+    cursor, pages = None, []
+    while True:
+        page, cursor = paginate_urls(reversed(URLS), cursor=cursor, limit=10)
+        pages.append(page)
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sum(pages, []) == URLS
+
+
+def test_cursor_survives_changes_of_urls(app):
+    page, cursor = paginate_urls(URLS, limit=10)
+    # Urls before the cursor are removed, and urls are added after it.
+    urls = URLS[5:] + ['http://a/10a.jpg']
+    page, cursor = paginate_urls(urls, cursor=cursor, limit=2)
+    assert page == ['http://a/10.jpg', 'http://a/10a.jpg']
+
+
+def test_default_page_size(app):
+    app.config['LINKS_PER_PAGE'] = 20
+    assert len(paginate_urls(URLS)[0]) == 20
+    assert len(paginate_urls(URLS, limit=0)[0]) == 20
+
+
+def test_numbered_pages(app):
+    pagination = UrlPagination(reversed(URLS), page=3, per_page=10)
+    assert (pagination.pages, pagination.items) == (3, URLS[20:])
+    assert pagination.has_prev and not pagination.has_next
+    # Pages out of range are clamped.
+    assert UrlPagination(URLS, page=9, per_page=10).page == 3
+    assert UrlPagination([], page=0, per_page=10).page == 1
+
+
+def test_stored_urls_expire(app, tmp_path):
+    filename = str(tmp_path / 'urls.txt')
+    assert store_urls_to_file(filename, URLS) == len(URLS)
+    assert read_urls_from_file(filename, max_age=60) == URLS
+    old = time.time() - 120
+    os.utime(filename, (old, old))
+    assert read_urls_from_file(filename) == URLS
+    assert read_urls_from_file(filename, max_age=60) is None
+    assert read_urls_from_file(str(tmp_path / 'missing.txt')) is None
+
+
+def test_get_url_list_pages(app, server):
+    client = app.test_client()
+    url = server.url('/synthetic/images/25')
+    response = client.get('/api/get_url_list', query_string={'url': url})
+    assert response.status_code == 200
+    urls = response.get_json()['url_list']
+    assert 'next_cursor' not in response.get_json()
+    pages, cursor = [], None
+    while True:
+        query = {'url': url, 'limit': 10}
+        if cursor is not None:
+            query['cursor'] = cursor
+        data = client.get('/api/get_url_list', query_string=query).get_json()
+        assert data['total'] == len(urls)
+        pages.append(data['url_list'])
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [10, 10, len(urls) - 20]
+    assert sum(pages, []) == sorted(urls)
+
+
+def test_get_url_list_with_malformed_cursor(app, server):
+    response = app.test_client().get('/api/get_url_list', query_string={
+        'url': server.url('/synthetic/images/25'), 'cursor': '!!!'})
+    assert response.status_code == 400
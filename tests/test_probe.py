@@ -0,0 +1,137 @@
+"""
+Tests of probing images for their type, dimensions and size.
+"""
+import os
+import base64
+import hashlib
+import struct
+import pytest
+from benchmarks.fake_server import TINY_IMAGES_DIR
+from scrapper.procedures import probe
+from scrapper.procedures.probe import image_header_info, is_image_file, \
+    probe_image, probe_images
+
+PNG = b'\x89PNG\r\n\x1a\n' + struct.pack('>I4sII', 13, b'IHDR', 640, 480)
+GIF = b'GIF89a' + struct.pack('<HH', 32, 16)
+BMP = b'BM' + b'\0' * 12 + struct.pack('<Iii', 40, 100, -50)
+OS2_BMP = b'BM' + b'\0' * 12 + struct.pack('<IHH', 12, 7, 9) + b'\0' * 4
+WEBP_VP8 = b'RIFF\0\0\0\0WEBPVP8 ' + b'\0' * 10 + struct.pack('<HH', 20, 10)
+WEBP_VP8L = b'RIFF\0\0\0\0WEBPVP8L' + b'\0' * 5 + \
+    struct.pack('<I', (20 - 1) | (10 - 1) << 14)
+WEBP_VP8X = b'RIFF\0\0\0\0WEBPVP8X' + b'\0' * 8 + \
+    struct.pack('<I', 20 - 1)[:3] + struct.pack('<I', 10 - 1)[:3]
+
+
+def tiny_image(name):
+    with open(os.path.join(TINY_IMAGES_DIR, name), 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('data, info', [
+    (PNG, ('image/png', 640, 480)),
+    (GIF, ('image/gif', 32, 16)),
+    (BMP, ('image/bmp', 100, 50)),
+    (OS2_BMP, ('image/bmp', 7, 9)),
+    (WEBP_VP8, ('image/webp', 20, 10)),
+    (WEBP_VP8L, ('image/webp', 20, 10)),
+    (WEBP_VP8X, ('image/webp', 20, 10)),
+    (tiny_image('iscream.jpg'), ('image/jpeg', 300, 250)),
+    # Header truncated before the dimensions.
+    (PNG[:16], (None, None, None)),
+    (tiny_image('iscream.jpg')[:64], ('image/jpeg', None, None)),
+    (b'<svg xmlns="http://www.w3.org/2000/svg"/>', (None, None, None)),
+])
+def test_image_header_info(data, info):
+    assert image_header_info(data) == info
+
+
+def test_is_image_file(tmp_path):
+    filename = str(tmp_path / 'image')
+    with open(filename, 'wb') as f:
+        f.write(GIF)
+    assert is_image_file(filename)
+    with open(filename, 'wb') as f:
+        f.write(b'<html></html>')
+    assert not is_image_file(filename)
+    assert not is_image_file(filename, 'text/html; charset=utf-8')
+    assert is_image_file(filename, 'Image/SVG+XML')
+
+
+def test_probe_image_without_range_support(app, server):
+    # The fake server ignores Range, so the size is given by Content-Length.
+    _, body = server.images[
+        hashlib.md5(b'probe.jpg').digest()[0] % len(server.images)]
+    info = probe_image(server.url('/img/probe.jpg'), probe_bytes=4096)
+    assert (info.content_type, info.width, info.height) == \
+        image_header_info(body)
+    assert info.size == len(body)
+
+
+class FakeSession(object):
+    """
+    Session answering Range requests with the given image.
+    """
+    def __init__(self, data, status_code=206, content_range=True):
+        self.data = data
+        self.status_code = status_code
+        self.content_range = content_range
+        self.headers = None
+
+    def get(self, url, stream=False, headers=None):
+        self.headers = headers
+        end = int(headers['Range'].rsplit('-', 1)[1])
+        session = self
+
+        class Response(object):
+            status_code = session.status_code
+            headers = {'Content-Type': 'application/octet-stream'}
+            if session.content_range:
+                headers['Content-Range'] = 'bytes 0-{end}/{size}'.format(
+                    end=end, size=len(session.data))
+
+            def raise_for_status(self):
+                if self.status_code >= 400:
+                    raise IOError(self.status_code)
+
+            def iter_content(self, chunk_size=None):
+                yield session.data[:end + 1]
+
+            def close(self):
+                pass
+        return Response()
+
+
+def test_probe_image_with_range(monkeypatch):
+    data = PNG + b'\0' * 1000
+    session = FakeSession(data)
+    monkeypatch.setattr(probe, 'get_session', lambda: session)
+    info = probe_image('http://a/image', probe_bytes=32)
+    assert session.headers == {'Range': 'bytes=0-31'}
+    assert (info.content_type, info.width, info.height, info.size) == \
+        ('image/png', 640, 480, len(data))
+
+
+def test_probe_image_with_unknown_size(monkeypatch):
+    session = FakeSession(b'\0' * 100, content_range=False)
+    monkeypatch.setattr(probe, 'get_session', lambda: session)
+    info = probe_image('http://a/image', probe_bytes=32)
+    assert (info.content_type, info.width, info.size) == \
+        ('application/octet-stream', None, None)
+
+
+def test_probe_data_uri():
+    uri = 'data:image/gif;base64,' + base64.b64encode(
+        GIF + b'\0' * 90).decode('ascii')
+    info = probe_image(uri, probe_bytes=16)
+    assert (info.content_type, info.width, info.height, info.size) == \
+        ('image/gif', 32, 16, 100)
+    info = probe_image('data:image/svg+xml,<svg/>')
+    assert (info.content_type, info.width, info.size) == \
+        ('image/svg+xml', None, 6)
+
+
+def test_probe_images_reports_errors(app, failing_server):
+    url = failing_server.url('/img/a.jpg')
+    infos = probe_images([url])
+    assert infos[url].error is not None
+    assert infos[url].content_type is None
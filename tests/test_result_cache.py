@@ -0,0 +1,80 @@
+"""
+Tests of the cache of image urls extracted from web pages.
+"""
+import time
+import pytest
+from scrapper import create_app
+from scrapper.procedures.result_cache import MemoryBackend, DiskBackend, \
+    ResultCache, get_result_cache
+from scrapper.procedures.scrapping_functions import get_cached_image_urls
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def backend(request, tmp_path):
+    if request.param == 'disk':
+        return DiskBackend(str(tmp_path / 'results'), max_entries=2)
+    return MemoryBackend(max_entries=2)
+
+
+def test_entries_expire_after_ttl(backend):
+    cache = ResultCache(backend, ttl=60)
+    cache.set('http://a/page', ['http://a/1.png'])
+    assert cache.get('http://a/page') == {'http://a/1.png'}
+    # Expire the entry without waiting for it.
+    expires, urls = backend.get('http://a/page')
+    backend.set('http://a/page', (time.time() - 1, urls))
+    assert cache.get('http://a/page') is None
+    assert backend.get('http://a/page') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'ttl': 60}
+
+
+def test_least_recently_used_entries_are_removed(backend):
+    cache = ResultCache(backend)
+    cache.set('http://a/1', ['http://a/1.png'])
+    cache.set('http://a/2', ['http://a/2.png'])
+    # Page 1 becomes the most recently used, page 2 is removed.
+    assert cache.get('http://a/1') is not None
+    cache.set('http://a/3', ['http://a/3.png'])
+    assert cache.get('http://a/2') is None
+    assert cache.get('http://a/1') == {'http://a/1.png'}
+    assert cache.get('http://a/3') == {'http://a/3.png'}
+
+
+def test_urls_are_normalized():
+    cache = ResultCache(MemoryBackend())
+    cache.set('HTTP://A/page', ['http://a/1.png'])
+    assert cache.get('http://a/page') == {'http://a/1.png'}
+
+
+def test_disk_backend_survives_restart(tmp_path):
+    path = str(tmp_path / 'results')
+    ResultCache(DiskBackend(path)).set('http://a/page', ['http://a/1.png'])
+    cache = ResultCache(DiskBackend(path))
+    assert cache.get('http://a/page') == {'http://a/1.png'}
+
+
+def test_pages_are_scrapped_once(app, server):
+    url = server.url('/synthetic/images/13')
+    before = server.requests.get('/synthetic/images/13', 0)
+    urls, cached = get_cached_image_urls(url)
+    assert len(urls) == 13 and not cached
+    assert get_cached_image_urls(url) == (urls, True)
+    assert server.requests['/synthetic/images/13'] == before + 1
+    # Refresh scraps the page again.
+    assert get_cached_image_urls(url, refresh=True) == (urls, False)
+    assert server.requests['/synthetic/images/13'] == before + 2
+
+
+def test_empty_results_are_not_cached(app, server):
+    url = server.url('/not-found.html')
+    urls, cached = get_cached_image_urls(url)
+    assert not urls and not cached
+    assert get_result_cache().get(url) is None
+
+
+def test_cache_can_be_disabled(tmp_path):
+    app = create_app('testing', APP_WD=str(tmp_path), LOG_FILES={},
+                     LOG_DIR=str(tmp_path / 'logs'),
+                     RESULT_CACHE_ENABLED=False)
+    with app.app_context():
+        assert get_result_cache() is None
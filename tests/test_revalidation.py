@@ -0,0 +1,109 @@
+"""
+Tests of HTTP conditional revalidation of pages and images.
+"""
+import time
+import pytest
+from benchmarks.fake_server import FakeServer, NetworkConditions
+from scrapper import create_app
+from scrapper.procedures.revalidation import parse_expiry, CacheEntry, \
+    RevalidationCache, fetch_page, get_revalidation_cache
+from scrapper.procedures.scrapping_functions import download_image
+
+
+class FakeResponse(object):
+    def __init__(self, **headers):
+        self.headers = dict((name.replace('_', '-'), value)
+                            for name, value in headers.items())
+
+
+def test_parse_expiry():
+    now = 1000.0
+    assert parse_expiry({'Cache-Control': 'no-store'}, now) is None
+    assert parse_expiry({'Cache-Control': 'no-cache'}, now) == now
+    assert parse_expiry({'Cache-Control': 'public, max-age=60'}, now) == 1060
+    assert parse_expiry({'Cache-Control': 'max-age=60', 'Age': '20'},
+                        now) == 1040
+    assert parse_expiry({'Expires': 'Thu, 01 Jan 1970 00:20:00 GMT'},
+                        now) == 1200
+    assert parse_expiry({}, now) == now
+
+
+def test_responses_which_cannot_be_reused_are_not_cached():
+    assert CacheEntry.from_response(FakeResponse(
+        Cache_Control='no-store', ETag='"a"')) is None
+    # Neither fresh nor revalidatable.
+    assert CacheEntry.from_response(FakeResponse()) is None
+    entry = CacheEntry.from_response(FakeResponse(ETag='"a"'))
+    assert not entry.is_fresh()
+    assert entry.conditional_headers() == {'If-None-Match': '"a"'}
+
+
+def test_refresh_returns_new_entry():
+    entry = CacheEntry(etag='"a"', expires=0, body=b'page')
+    refreshed = entry.refreshed(FakeResponse(Cache_Control='max-age=60'))
+    assert refreshed.is_fresh()
+    assert (refreshed.etag, refreshed.body) == ('"a"', b'page')
+    assert not entry.is_fresh()
+
+
+def test_pages_and_images_are_kept_apart():
+    cache = RevalidationCache()
+    response = FakeResponse(Cache_Control='max-age=60')
+    cache.store('http://a/x', response, kind='image')
+    assert cache.get('http://a/x') is None
+    assert cache.get('http://a/x', kind='image') is not None
+
+
+def test_bodies_are_bounded_by_size():
+    cache = RevalidationCache(max_bytes=10)
+    response = FakeResponse(Cache_Control='max-age=60')
+    cache.store('http://a/1', response, body=b'x' * 6)
+    cache.store('http://a/2', response, body=b'x' * 3)
+    cache.get('http://a/1')
+    cache.store('http://a/3', response, body=b'x' * 4)
+    # 2 is the least recently used entry.
+    assert cache.get('http://a/2') is None
+    assert cache.get('http://a/1') is not None
+    assert cache.stats()['bytes'] == 10
+
+
+def test_entries_are_bounded_in_number():
+    cache = RevalidationCache(max_entries=2)
+    response = FakeResponse(Cache_Control='max-age=60')
+    for i in range(3):
+        cache.store('http://a/{i}'.format(i=i), response)
+    assert cache.stats()['entries'] == 2
+    assert cache.get('http://a/0') is None
+
+
+def test_page_is_fetched_if_only_image_entry_exists(app, server):
+    url = server.url('/synthetic/images/3')
+    get_revalidation_cache().store(
+        url, FakeResponse(Cache_Control='max-age=60', ETag='"a"'),
+        kind='image')
+    assert fetch_page(url).startswith(b'<!DOCTYPE html>')
+
+
+@pytest.fixture
+def stale_server():
+    # Images are stale as soon as they are fetched, but have an ETag.
+    with FakeServer(NetworkConditions(max_age=0)) as server:
+        yield server
+
+
+def test_stale_images_are_revalidated(stale_server, tmp_path):
+    app = create_app('testing', APP_WD=str(tmp_path), LOG_FILES={},
+                     LOG_DIR=str(tmp_path / 'logs'), HTTP_RETRIES=0,
+                     IMAGE_CACHE_SAVE_INTERVAL=None)
+    url = stale_server.url('/img/stale.jpg')
+    with app.app_context():
+        download_image(url, dest_dir=str(tmp_path))
+        time.sleep(0.01)
+        second_dir = tmp_path / 'second'
+        second_dir.mkdir()
+        filename = download_image(url, dest_dir=str(second_dir))
+        stats = get_revalidation_cache().stats()['image']
+    assert stale_server.requests['/img/stale.jpg'] == 2
+    assert (stats['miss'], stats['revalidated']) == (1, 1)
+    with open(filename, 'rb') as f:
+        assert f.read()
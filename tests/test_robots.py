@@ -0,0 +1,137 @@
+"""
+Tests of robots.txt rules and of the reading of sitemaps.
+"""
+import gzip
+import time
+import pytest
+from scrapper.procedures import sitemaps
+from scrapper.procedures.robots import RobotsRules, RobotsCache
+from scrapper.procedures.sitemaps import gunzip_chunks, read_sitemaps
+
+ROBOTS_TXT = """
+User-agent: scrapper
+Disallow: /private/
+Crawl-delay: 2
+
+User-agent: *
+Disallow: /
+
+Sitemap: http://a/sitemap-index.xml
+"""
+
+SITEMAP_INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>http://a/sitemap-1.xml</loc></sitemap>
+  <sitemap><loc> http://a/sitemap-2.xml.gz </loc></sitemap>
+  <sitemap><loc>http://a/sitemap-1.xml</loc></sitemap>
+</sitemapindex>
+"""
+
+SITEMAP_1 = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
+        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">
+  <url>
+    <loc>http://a/page-1.html</loc>
+    <image:image><image:loc>http://a/1.jpg</image:loc></image:image>
+    <image:image><image:loc>http://a/2.jpg</image:loc></image:image>
+  </url>
+  <url><loc>http://a/private/page-2.html</loc></url>
+  <url><loc></loc></url>
+</urlset>
+"""
+
+SITEMAP_2 = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
+        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">
+  <url>
+    <loc>http://a/page-3.html</loc>
+    <image:image><image:loc>http://a/1.jpg</image:loc></image:image>
+  </url>
+</urlset>
+"""
+
+
+def test_robots_rules():
+    rules = RobotsRules.from_text(ROBOTS_TXT, time.time() + 60)
+    assert rules.can_fetch('scrapper', 'http://a/page.html')
+    assert not rules.can_fetch('scrapper', 'http://a/private/page.html')
+    assert not rules.can_fetch('other', 'http://a/page.html')
+    assert rules.crawl_delay('scrapper') == 2.0
+    assert rules.crawl_delay('other') is None
+    assert rules.sitemaps == ['http://a/sitemap-index.xml']
+
+
+def test_missing_robots_txt_allows_everything(app, server):
+    robots = RobotsCache(user_agent='scrapper')
+    assert robots.can_fetch(server.url('/private/page.html'))
+    assert robots.crawl_delay(server.url('/')) is None
+    assert robots.sitemaps(server.url('/page.html')) == \
+        [server.url('/sitemap.xml')]
+
+
+def test_robots_txt_is_fetched_once_per_host(app, server):
+    before = server.requests.get('/robots.txt', 0)
+    robots = RobotsCache()
+    for path in ('/a.html', '/b/c.html', '/'):
+        robots.can_fetch(server.url(path))
+    assert server.requests['/robots.txt'] == before + 1
+
+
+def test_gunzip_chunks():
+    data = gzip.compress(SITEMAP_2)
+    chunks = [data[:10], data[10:]]
+    assert b''.join(gunzip_chunks(iter(chunks))) == SITEMAP_2
+    assert b''.join(gunzip_chunks(iter([SITEMAP_2[:5], SITEMAP_2[5:]]))) == \
+        SITEMAP_2
+
+
+@pytest.fixture
+def sitemap_pages(monkeypatch):
+    pages = {
+        'http://a/sitemap-index.xml': SITEMAP_INDEX,
+        'http://a/sitemap-1.xml': SITEMAP_1,
+        'http://a/sitemap-2.xml.gz': gzip.compress(SITEMAP_2),
+    }
+
+    def iter_page(url):
+        if url not in pages:
+            raise IOError('Not found')
+        # Small chunks, so the sitemaps are parsed incrementally.
+        data = pages[url]
+        return (data[i:i + 16] for i in range(0, len(data), 16))
+    monkeypatch.setattr(sitemaps, 'iter_page', iter_page)
+    return pages
+
+
+def test_read_sitemaps(sitemap_pages):
+    result = read_sitemaps(['http://a/sitemap-index.xml'])
+    assert result.sitemaps == ['http://a/sitemap-index.xml',
+                               'http://a/sitemap-1.xml',
+                               'http://a/sitemap-2.xml.gz']
+    assert result.pages == ['http://a/page-1.html',
+                            'http://a/private/page-2.html',
+                            'http://a/page-3.html']
+    assert result.image_urls == {'http://a/1.jpg', 'http://a/2.jpg'}
+    assert result.errors == {}
+
+
+def test_read_sitemaps_honors_robots_txt(sitemap_pages):
+    robots = RobotsCache(user_agent='scrapper')
+    robots._fetch = lambda origin: RobotsRules.from_text(
+        ROBOTS_TXT, time.time() + 60)
+    result = read_sitemaps(['http://a/sitemap-1.xml'], robots=robots)
+    assert result.pages == ['http://a/page-1.html']
+
+
+def test_read_sitemaps_limits(sitemap_pages):
+    result = read_sitemaps(['http://a/sitemap-index.xml'], max_sitemaps=2)
+    assert len(result.sitemaps) == 2
+    result = read_sitemaps(['http://a/sitemap-1.xml'], max_urls=2)
+    assert len(result.pages) + len(result.image_urls) == 2
+
+
+def test_unreadable_sitemaps_are_reported(sitemap_pages):
+    result = read_sitemaps(['http://a/missing.xml',
+                            'http://a/sitemap-1.xml'])
+    assert result.errors == {'http://a/missing.xml': 'Not found'}
+    assert len(result.pages) == 2